@@ -1,10 +1,10 @@
 # ----------------------------------------------------------------------------#
 # Imports
 # ----------------------------------------------------------------------------#
-import sys
 import json
 import dateutil.parser
 import babel
+import click
 from flask import (
     Flask,
     render_template,
@@ -12,14 +12,32 @@ from flask import (
     Response,
     flash,
     redirect,
-    url_for)
+    url_for,
+    abort,
+    jsonify,
+    make_response)
 from flask_moment import Moment
-from flask_sqlalchemy import SQLAlchemy
-import logging
-from logging import Formatter, FileHandler
 from flask_wtf import Form
 from forms import *
 from flask_migrate import Migrate
+from replicas import RoutingSQLAlchemy
+from partitions import ShowPartitions
+from changes import ChangeTracker
+from catalog import Catalog
+from matching import MatchIndex
+from feeds import ShowFeeds
+from limits import Limiter
+from compression import Compressor
+from sessions import Sessions
+from entity_cache import EntityCache
+from rollups import ShowRollups
+from prerender import Publisher
+from outbox import Outbox
+from dedup import Deduplicator
+from deletion import Deleter
+from logs import Logs
+from slowlog import SlowQueryLog
+from schemas import Schema
 
 from config import SQLALCHEMY_DATABASE_URI
 
@@ -30,11 +48,27 @@ from config import SQLALCHEMY_DATABASE_URI
 app = Flask(__name__)
 moment = Moment(app)
 app.config.from_object('config')
+logs = Logs(app)
+slow_queries = SlowQueryLog(app)
 app.config['SQLALCHEMY_DATABASE_URI'] = SQLALCHEMY_DATABASE_URI
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-db = SQLAlchemy(app)
+db = RoutingSQLAlchemy(app)
+sessions = Sessions(app, db)
 
 migrate = Migrate(app, db)
+show_partitions = ShowPartitions(app, db)
+changes = ChangeTracker(app, db)
+catalog = Catalog(app, db, changes)
+matches = MatchIndex(app, db, changes)
+feeds = ShowFeeds(app, db, changes)
+entity_cache = EntityCache(app, db, changes)
+stats = ShowRollups(app, db, changes)
+publisher = Publisher(app, db, changes)
+outbox = Outbox(app, db, changes)
+dedup = Deduplicator(app, db, changes)
+deleter = Deleter(app, db, changes)
+limiter = Limiter(app)
+compressor = Compressor(app)
 current_time = datetime.now()
 
 
@@ -58,7 +92,10 @@ class Venue(db.Model):
     genres = db.Column(db.ARRAY(db.String(120)))
     seeking_talent = db.Column(db.Boolean, nullable=False, default=False)
     seeking_description = db.Column(db.String(500), default=None)
-    shows = db.relationship('Show', backref='venue', lazy=True)
+    # set instead of deleting the row when DELETE_MODE is 'soft'
+    deleted_at = db.Column(db.DateTime)
+    # dynamic so pages can bound shows by start_time (and prune partitions) instead of loading them all
+    shows = db.relationship('Show', backref='venue', lazy='dynamic')
 
     def __init__(self, name, city, state, address, phone, genres, image_link=None, facebook_link=None, website=None,
                  seeking_talent=False, seeking_description=None):
@@ -78,7 +115,7 @@ class Venue(db.Model):
         return {
             "id": self.id,
             "name": self.name,
-            "num_upcoming_shows": len([show.id for show in self.shows if show.start_time > current_time]),
+            "num_upcoming_shows": self.shows.filter(Show.start_time > current_time).count(),
         }
 
     def __repr__(self):
@@ -99,7 +136,8 @@ class Artist(db.Model):
     website = db.Column(db.String(120))
     seeking_venue = db.Column(db.Boolean, nullable=False, default=False)
     seeking_description = db.Column(db.String(1000), default=None)
-    shows = db.relationship('Show', backref='artist', lazy=True)
+    deleted_at = db.Column(db.DateTime)
+    shows = db.relationship('Show', backref='artist', lazy='dynamic')
 
     def __init__(self, name, city, state, phone, genres, image_link=None, facebook_link=None, website=None,
                  seeking_venue=False, seeking_description=None):
@@ -119,6 +157,8 @@ class Artist(db.Model):
 
 
 class Show(db.Model):
+    # On PostgreSQL the table is partitioned by start_time and its primary key is (id, start_time);
+    # id alone is still unique, so the mapper keeps it as the identity.
     __tablename__ = 'show'
 
     id = db.Column(db.Integer, primary_key=True)
@@ -133,7 +173,7 @@ class Show(db.Model):
 
     def artist_details(self):
         return {
-            'artist_id': self.venue_id,
+            'artist_id': self.artist_id,
             'artist_name': self.artist.name,
             'artist_image_link': self.artist.image_link,
             'start_time': str(self.start_time)
@@ -161,6 +201,32 @@ class Show(db.Model):
         return f'<class {self.__class__.__name__} {self.id}>'
 
 
+changes.track_history(Show.venue_id, Show.artist_id, Show.start_time, Venue.city, Venue.state, Artist.genres)
+
+
+venue_schema = Schema(Venue, VenueForm)
+artist_schema = Schema(Artist, ArtistForm)
+show_schema = Schema(Show, ShowForm)
+
+
+@app.cli.command('load')
+@click.argument('kind', type=click.Choice(['venue', 'artist', 'show']))
+@click.argument('source', type=click.File())
+def load_records(kind, source):
+    """Validate and insert a JSON list of venues, artists or shows; nothing is inserted if any record fails."""
+    model, schema = {'venue': (Venue, venue_schema), 'artist': (Artist, artist_schema),
+                     'show': (Show, show_schema)}[kind]
+    results = schema.validate_many(json.load(source), db.session)
+    failed = [(position, errors) for position, (clean, errors) in enumerate(results) if errors]
+    for position, errors in failed:
+        click.echo(f'record {position}: {json.dumps(errors)}', err=True)
+    if failed:
+        raise click.ClickException(f'{len(failed)} of {len(results)} records are invalid')
+    db.session.add_all([model(**clean) for clean, errors in results])
+    db.session.commit()
+    click.echo(f'loaded {len(results)} {kind} records')
+
+
 # ----------------------------------------------------------------------------#
 # Filters.
 # ----------------------------------------------------------------------------#
@@ -177,6 +243,94 @@ def format_datetime(value, format='medium'):
 app.jinja_env.filters['datetime'] = format_datetime
 
 
+def feed_response(feed, fmt):
+    if feed is None:
+        abort(404)
+    if fmt == 'ics':
+        response = Response(feed.ics, mimetype='text/calendar')
+        response.set_etag(feed.ics_etag)
+    else:
+        response = Response(feed.json, mimetype='application/json')
+        response.set_etag(feed.json_etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = 60
+    return response.make_conditional(request)
+
+
+def submitted_data():
+    # JSON bodies go through the same schemas as form posts
+    if not request.is_json:
+        return request.form
+    data = request.get_json()
+    if not isinstance(data, dict):
+        abort(make_response(jsonify(errors={"body": ['Must be a JSON object.']}), 400))
+    return data
+
+
+def invalid_submission(errors, template=None, redirect_to=None, **context):
+    if request.is_json:
+        return jsonify(errors=errors), 400
+    for field, messages in errors.items():
+        flash(f"{field.replace('_', ' ').capitalize()}: {' '.join(messages)}")
+    if redirect_to:
+        return redirect(redirect_to)
+    return render_template(template, **context), 400
+
+
+def flash_duplicates(kind, duplicates):
+    for duplicate in duplicates:
+        flash(f'Possible duplicate: {kind} {duplicate["name"]} ({duplicate["city"]}, {duplicate["state"]}) '
+              f'is already listed at /{kind}s/{duplicate["id"]}.')
+
+
+def similar_response(kind):
+    return jsonify(dedup.similar(kind, request.args.get('name', ''), request.args.get('city', ''),
+                                 request.args.get('state', '')))
+
+
+def live_or_404(model, entity_id):
+    entity = entity_cache.get(model, entity_id)
+    if entity is None or entity.deleted_at is not None:
+        abort(404)
+    return entity
+
+
+def for_update_or_404(model, entity_id):
+    # edits start from the committed row, never from a cached copy another worker may have outdated
+    query = db.session.query(model).filter(model.id == entity_id)
+    if db.session.connection().dialect.name == 'postgresql':
+        query = query.with_for_update()
+    entity = query.first()
+    if entity is None or entity.deleted_at is not None:
+        abort(404)
+    return entity
+
+
+def delete_response(kind, entity_id):
+    # shows go with set-based statements (or are archived in soft mode), none are loaded into the session
+    try:
+        name = deleter.delete(kind, entity_id)
+    except:
+        db.session.rollback()
+        app.logger.exception('could not delete %s %s', kind, entity_id)
+        flash(f'An error occurred. {kind.capitalize()} {entity_id} could not be deleted.')
+        return submission_response(True, 'pages/home.html')
+    finally:
+        db.session.close()
+    if name is None:
+        abort(404)
+    flash(f'{kind.capitalize()} {name} was successfully deleted!')
+    if request.is_json:
+        return jsonify(id=entity_id, name=name, mode=deleter.mode)
+    return render_template('pages/home.html')
+
+
+def submission_response(error, template, **data):
+    if request.is_json:
+        return jsonify(**data), 500 if error else 201
+    return render_template(template)
+
+
 # ----------------------------------------------------------------------------#
 # Controllers.
 # ----------------------------------------------------------------------------#
@@ -190,8 +344,11 @@ def index():
 #  ----------------------------------------------------------------
 
 @app.route('/venues')
+@limiter.route_class('listing')
 def venues():
-    venues = Venue.query.group_by(Venue.id, Venue.state, Venue.city).all()
+    if catalog.enabled:
+        return render_template('pages/venues.html', areas=catalog.snapshot().venue_areas(current_time))
+    venues = Venue.query.filter(Venue.deleted_at.is_(None)).group_by(Venue.id, Venue.state, Venue.city).all()
     venue_state_and_city = ""
     data = []
 
@@ -210,10 +367,11 @@ def venues():
 
 
 @app.route('/venues/search', methods=['POST'])
+@limiter.route_class('search')
 def search_venues():
     search_term = request.form.get('search_term', '')
     # Below is the search query which returns list of all matched venues
-    venues_list = Venue.query.filter(Venue.name.ilike('%' + search_term + '%')).all()
+    venues_list = Venue.query.filter(Venue.deleted_at.is_(None), Venue.name.ilike('%' + search_term + '%')).all()
     response = {
         "count": len(venues_list),
         "data": [venue.venue_data() for venue in venues_list]
@@ -221,11 +379,26 @@ def search_venues():
     return render_template('pages/search_venues.html', results=response, search_term=search_term)
 
 
+@app.route('/venues/similar')
+@limiter.route_class('search')
+def similar_venues():
+    return similar_response('venue')
+
+
 @app.route('/venues/<int:venue_id>')
 def show_venue(venue_id):
-    venue = Venue.query.get(venue_id)
-    upcoming_shows = [show.artist_details() for show in venue.shows if show.start_time >= current_time]
-    past_shows = [show.artist_details() for show in venue.shows if show.start_time < current_time]
+    if catalog.enabled:
+        page = catalog.snapshot().venue_page(venue_id, current_time)
+        if page is None:
+            abort(404)
+        return render_template('pages/show_venue.html', venue=page)
+    venue = live_or_404(Venue, venue_id)
+    upcoming_shows = [show.artist_details() for show in
+                      venue.shows.filter(Show.start_time >= current_time).order_by(Show.start_time)]
+    past_shows = [show.artist_details() for show in
+                  venue.shows.filter(Show.start_time < current_time,
+                                     Show.start_time >= show_partitions.archive_cutoff())
+                  .order_by(Show.start_time.desc())]
     data = {
         "id": venue.id,
         "name": venue.name,
@@ -247,6 +420,20 @@ def show_venue(venue_id):
     return render_template('pages/show_venue.html', venue=data)
 
 
+@app.route('/venues/<int:venue_id>/calendar.<any(ics, json):fmt>')
+def venue_calendar(venue_id, fmt):
+    return feed_response(feeds.get('venue', venue_id, request.url_root), fmt)
+
+
+@app.route('/venues/<int:venue_id>/matches')
+def venue_matches(venue_id):
+    found = matches.artists_for_venue(venue_id)
+    if found is None:
+        abort(404)
+    venue = {"kind": "venue", "id": venue_id, "name": matches.venue_name(venue_id)}
+    return render_template('pages/matches.html', entity=venue, kind='artists', matches=found)
+
+
 #  Create Venue
 #  ----------------------------------------------------------------
 
@@ -258,77 +445,57 @@ def create_venue_form():
 
 @app.route('/venues/create', methods=['POST'])
 def create_venue_submission():
-    # TODO: insert form data as a new Venue record in the db, instead
-    # TODO: modify data to be the data object returned from db insertion
+    venue_data, errors = venue_schema.validate(submitted_data())
+    if errors:
+        return invalid_submission(errors, 'forms/new_venue.html', form=VenueForm())
+    if not venue_data["seeking_talent"]:
+        venue_data["seeking_description"] = None
+    duplicates = dedup.similar('venue', venue_data["name"], venue_data["city"], venue_data["state"]) \
+        if dedup.warn_on_create else []
     error = False
     try:
-        form_data = request.form
-        seeking_talent_data = True if form_data.get("seeking_talent") == "True" else False
-        if not seeking_talent_data:
-            seeking_description_data = None
-        else:
-            seeking_description_data = form_data.get("seeking_description")
-        new_venue = Venue(
-            name=form_data.get("name"),
-            city=form_data.get("city"),
-            state=form_data.get("state"),
-            address=form_data.get("address"),
-            phone=form_data.get("phone"),
-            genres=form_data.getlist("genres"),
-            facebook_link=form_data.get("facebook_link"),
-            image_link=form_data.get("image_link"),
-            website=form_data.get("website"),
-            seeking_talent=seeking_talent_data,
-            seeking_description=seeking_description_data
-        )
+        new_venue = Venue(**venue_data)
         db.session.add(new_venue)
         db.session.commit()
+        venue_id = new_venue.id
     except:
         error = True
         db.session.rollback()
-        print(sys.exc_info())
+        app.logger.exception('could not create venue')
     finally:
         db.session.close()
 
     if error:
-        flash('An error occurred. Venue ' + form_data.get("name") + ' could not be listed.')
+        flash('An error occurred. Venue ' + venue_data["name"] + ' could not be listed.')
     else:
-        flash('Venue ' + request.form['name'] + ' was successfully listed!')
-        return render_template('pages/home.html')
+        flash('Venue ' + venue_data["name"] + ' was successfully listed!')
+        flash_duplicates('venue', duplicates)
+    return submission_response(error, 'pages/home.html', id=None if error else venue_id,
+                               possible_duplicates=duplicates)
 
 
-@app.route('/venues/<venue_id>', methods=['DELETE'])
+@app.route('/venues/<int:venue_id>', methods=['DELETE'])
 def delete_venue(venue_id):
-    # TODO: Complete this endpoint for taking a venue_id, and using
-    # SQLAlchemy ORM to delete a record. Handle cases where the session commit could fail.
-    try:
-        venue = Venue.query.get(venue_id)
-        venue_name = venue.name
-        db.session.delete(venue)
-        db.session.commit()
-        flash('Venue ' + venue_name + ' was successfully deleted!')
-    except:
-        db.session.rollback()
-        print(sys.exc_info())
-    finally:
-        db.session.close()
-    # BONUS CHALLENGE: Implement a button to delete a Venue on a Venue Page, have it so that
-    # clicking that button delete it from the db then redirect the user to the homepage
-    return render_template('pages/home.html')
+    return delete_response('venue', venue_id)
 
 
 #  Artists
 #  ----------------------------------------------------------------
 @app.route('/artists')
+@limiter.route_class('listing')
 def artists():
-    data = [{"id": artist.id, "name": artist.name} for artist in Artist.query.all()]
+    if catalog.enabled:
+        return render_template('pages/artists.html', artists=catalog.snapshot().artist_list())
+    data = [{"id": artist.id, "name": artist.name} for artist in Artist.query.filter(Artist.deleted_at.is_(None))]
     return render_template('pages/artists.html', artists=data)
 
 
 @app.route('/artists/search', methods=['POST'])
+@limiter.route_class('search')
 def search_artists():
     search_term = request.form.get('search_term', '')
-    req_artist_list = Artist.query.filter(Artist.name.ilike("%" + search_term + "%")).all()
+    req_artist_list = Artist.query.filter(Artist.deleted_at.is_(None),
+                                          Artist.name.ilike("%" + search_term + "%")).all()
     # Note: There is no point in giving "num_upcoming_shows" data in response. so, didn't add that data in response
     response = {
         "count": len(req_artist_list),
@@ -337,11 +504,26 @@ def search_artists():
     return render_template('pages/search_artists.html', results=response, search_term=search_term)
 
 
+@app.route('/artists/similar')
+@limiter.route_class('search')
+def similar_artists():
+    return similar_response('artist')
+
+
 @app.route('/artists/<int:artist_id>')
 def show_artist(artist_id):
-    artist = Artist.query.get(artist_id)
-    upcoming_shows = [show.venue_details() for show in artist.shows if show.start_time >= current_time]
-    past_shows = [show.venue_details() for show in artist.shows if show.start_time < current_time]
+    if catalog.enabled:
+        page = catalog.snapshot().artist_page(artist_id, current_time)
+        if page is None:
+            abort(404)
+        return render_template('pages/show_artist.html', artist=page)
+    artist = live_or_404(Artist, artist_id)
+    upcoming_shows = [show.venue_details() for show in
+                      artist.shows.filter(Show.start_time >= current_time).order_by(Show.start_time)]
+    past_shows = [show.venue_details() for show in
+                  artist.shows.filter(Show.start_time < current_time,
+                                      Show.start_time >= show_partitions.archive_cutoff())
+                  .order_by(Show.start_time.desc())]
 
     data = {
         "id": artist.id,
@@ -363,12 +545,31 @@ def show_artist(artist_id):
     return render_template('pages/show_artist.html', artist=data)
 
 
+@app.route('/artists/<int:artist_id>', methods=['DELETE'])
+def delete_artist(artist_id):
+    return delete_response('artist', artist_id)
+
+
+@app.route('/artists/<int:artist_id>/calendar.<any(ics, json):fmt>')
+def artist_calendar(artist_id, fmt):
+    return feed_response(feeds.get('artist', artist_id, request.url_root), fmt)
+
+
+@app.route('/artists/<int:artist_id>/matches')
+def artist_matches(artist_id):
+    found = matches.venues_for_artist(artist_id)
+    if found is None:
+        abort(404)
+    artist = {"kind": "artist", "id": artist_id, "name": matches.artist_name(artist_id)}
+    return render_template('pages/matches.html', entity=artist, kind='venues', matches=found)
+
+
 #  Update
 #  ----------------------------------------------------------------
 @app.route('/artists/<int:artist_id>/edit', methods=['GET'])
 def edit_artist(artist_id):
     form = ArtistForm()
-    artist_data = Artist.query.get(artist_id)
+    artist_data = live_or_404(Artist, artist_id)
     artist = {
         "id": artist_data.id,
         "name": artist_data.name,
@@ -387,47 +588,36 @@ def edit_artist(artist_id):
 
 @app.route('/artists/<int:artist_id>/edit', methods=['POST'])
 def edit_artist_submission(artist_id):
-    # TODO: take values from the form submitted, and update existing
-    # artist record with ID <artist_id> using the new attributes
+    artist_data, errors = artist_schema.validate(submitted_data())
+    if errors:
+        return invalid_submission(errors, redirect_to=url_for('edit_artist', artist_id=artist_id))
+    if not artist_data["seeking_venue"]:
+        artist_data["seeking_description"] = None
+    artist = for_update_or_404(Artist, artist_id)
     error = False
     try:
-        data = request.form
-        seeking_venue_data = True if data.get("seeking_venue") == "True" else False
-        if not seeking_venue_data:
-            seeking_description_data = None
-        else:
-            seeking_description_data = data.get("seeking_description")
-        artist = Artist.query.get(artist_id)
-        artist.name = data.get("name")
-        artist.genres = data.getlist("genres")
-        artist.city = data.get("city")
-        artist.state = data.get("state")
-        artist.phone = data.get("phone")
-        artist.website = data.get("website")
-        artist.facebook_link = data.get("facebook_link")
-        artist.image_link = data.get("image_link")
-        artist.seeking_venue = seeking_venue_data
-        artist.seeking_description = seeking_description_data
+        for field, value in artist_data.items():
+            setattr(artist, field, value)
         db.session.commit()
     except:
         error = True
         db.session.rollback()
-        print(sys.exc_info())
+        app.logger.exception('could not update artist %s', artist_id)
     finally:
         db.session.close()
 
     if error:
-        flash('An error occurred while updating ' + request.form['name'])
+        flash('An error occurred while updating ' + artist_data["name"])
         return redirect(url_for('show_artist', artist_id=artist_id))
     else:
-        flash('Artist ' + request.form['name'] + ' was successfully updated!')
+        flash('Artist ' + artist_data["name"] + ' was successfully updated!')
         return redirect(url_for('show_artist', artist_id=artist_id))
 
 
 @app.route('/venues/<int:venue_id>/edit', methods=['GET'])
 def edit_venue(venue_id):
     form = VenueForm()
-    venue_data = Venue.query.get(venue_id)
+    venue_data = live_or_404(Venue, venue_id)
     venue = {
         "id": venue_data.id,
         "name": venue_data.name,
@@ -447,42 +637,29 @@ def edit_venue(venue_id):
 
 @app.route('/venues/<int:venue_id>/edit', methods=['POST'])
 def edit_venue_submission(venue_id):
-    # TODO: take values from the form submitted, and update existing
-    # venue record with ID <venue_id> using the new attributes
+    venue_data, errors = venue_schema.validate(submitted_data())
+    if errors:
+        return invalid_submission(errors, redirect_to=url_for('edit_venue', venue_id=venue_id))
+    if not venue_data["seeking_talent"]:
+        venue_data["seeking_description"] = None
+    venue = for_update_or_404(Venue, venue_id)
     error = False
     try:
-        venue = Venue.query.get(venue_id)
-        form_data = request.form
-        seeking_talent_data = True if form_data.get("seeking_talent") == "True" else False
-        if not seeking_talent_data:
-            seeking_description_data = None
-        else:
-            seeking_description_data = form_data.get("seeking_description")
-        print("form_data", form_data)
-        venue.name = form_data.get("name")
-        venue.city = form_data.get("city")
-        venue.state = form_data.get("state")
-        venue.address = form_data.get("address")
-        venue.phone = form_data.get("phone")
-        venue.genres = form_data.getlist("genres")
-        venue.facebook_link = form_data.get("facebook_link")
-        venue.image_link = form_data.get("image_link")
-        venue.website = form_data.get("website")
-        venue.seeking_talent = seeking_talent_data
-        venue.seeking_description = seeking_description_data
+        for field, value in venue_data.items():
+            setattr(venue, field, value)
         db.session.commit()
     except:
         error = True
         db.session.rollback()
-        print(sys.exc_info())
+        app.logger.exception('could not update venue %s', venue_id)
     finally:
         db.session.close()
 
     if error:
-        flash('An error occurred while updating ' + request.form['name'])
+        flash('An error occurred while updating ' + venue_data["name"])
         return redirect(url_for('show_venue', venue_id=venue_id))
     else:
-        flash('Venue ' + request.form['name'] + ' was successfully updated!')
+        flash('Venue ' + venue_data["name"] + ' was successfully updated!')
         return redirect(url_for('show_venue', venue_id=venue_id))
 
 
@@ -498,49 +675,43 @@ def create_artist_form():
 @app.route('/artists/create', methods=['POST'])
 def create_artist_submission():
     # called upon submitting the new artist listing form
-    # TODO: insert form data as a new Venue record in the db, instead
-    # TODO: modify data to be the data object returned from db insertion
+    artist_data, errors = artist_schema.validate(submitted_data())
+    if errors:
+        return invalid_submission(errors, 'forms/new_artist.html', form=ArtistForm())
+    if not artist_data["seeking_venue"]:
+        artist_data["seeking_description"] = None
+    duplicates = dedup.similar('artist', artist_data["name"], artist_data["city"], artist_data["state"]) \
+        if dedup.warn_on_create else []
     error = False
     try:
-        form_data = request.form
-        seeking_venue_data = True if form_data.get("seeking_venue") == "True" else False
-        if not seeking_venue_data:
-            seeking_description_data = None
-        else:
-            seeking_description_data = form_data.get("seeking_description")
-        new_artist = Artist(
-            name=form_data.get("name"),
-            city=form_data.get("city"),
-            state=form_data.get("state"),
-            phone=form_data.get("phone"),
-            genres=form_data.getlist("genres"),
-            image_link=form_data.get("image_link"),
-            website=form_data.get("website"),
-            seeking_venue=seeking_venue_data,
-            seeking_description=seeking_description_data
-        )
+        new_artist = Artist(**artist_data)
         db.session.add(new_artist)
         db.session.commit()
+        artist_id = new_artist.id
     except:
         error = True
         db.session.rollback()
-        print(sys.exc_info())
+        app.logger.exception('could not create artist')
     finally:
         db.session.close()
 
     if error:
-        flash('An error occurred. Artist ' + form_data.get("name") + ' could not be listed.')
-        return render_template('pages/home.html')
+        flash('An error occurred. Artist ' + artist_data["name"] + ' could not be listed.')
     else:
-        flash('Artist ' + form_data.get("name") + ' was successfully listed!')
-        return render_template('pages/home.html')
+        flash('Artist ' + artist_data["name"] + ' was successfully listed!')
+        flash_duplicates('artist', duplicates)
+    return submission_response(error, 'pages/home.html', id=None if error else artist_id,
+                               possible_duplicates=duplicates)
 
 
 #  Shows
 #  ----------------------------------------------------------------
 
 @app.route('/shows')
+@limiter.route_class('listing')
 def shows():
+    if catalog.enabled:
+        return render_template('pages/shows.html', shows=catalog.snapshot().show_list())
     data = [show.show_details() for show in Show.query.order_by(Show.start_time.desc()).all()]
     return render_template('pages/shows.html', shows=data)
 
@@ -555,38 +726,90 @@ def create_shows():
 @app.route('/shows/create', methods=['POST'])
 def create_show_submission():
     # called to create new shows in the db, upon submitting new show listing form
-    # TODO: insert form data as a new Show record in the db, instead
+    # the schema checks artist_id and venue_id exist in the same query batch as any other show
+    show_data, errors = show_schema.validate(submitted_data(), db.session)
+    if errors:
+        return invalid_submission(errors, redirect_to='/shows/create')
     error = False
     try:
-        form = ShowForm()
-        form_data = request.form
-        artist = Artist.query.get(form_data.get('artist_id'))
-        if not artist:
-            flash(f"Artist with given id {form_data.get('artist_id')} not exists!!!")
-            return redirect('/shows/create')
-        venue = Venue.query.get(form_data.get('venue_id'))
-        if not venue:
-            flash(f"Venue with given id {form_data.get('venue_id')} not exists!!!")
-            return redirect('/shows/create')
-        new_show = Show(
-            venue_id=form_data.get('venue_id'),
-            artist_id=form_data.get('artist_id'),
-            start_time=form_data.get('start_time')
-        )
+        new_show = Show(**show_data)
         db.session.add(new_show)
         db.session.commit()
+        show_id = new_show.id
         # on successful db insert, flash success
         flash('Show was successfully listed!')
     except:
         error = True
         db.session.rollback()
-        print(sys.exc_info())
+        app.logger.exception('could not create show')
     finally:
         db.session.close()
 
     if error:
         flash('An error occurred. Show could not be listed.')
-    return render_template('pages/home.html')
+    return submission_response(error, 'pages/home.html', id=None if error else show_id)
+
+
+#  Stats
+#  ----------------------------------------------------------------
+
+def stats_report():
+    def month(name):
+        value = request.args.get(name)
+        try:
+            return datetime.strptime(value, '%Y-%m').date() if value else None
+        except ValueError:
+            abort(400)
+
+    return stats.report(city=request.args.get('city') or None, state=request.args.get('state') or None,
+                        genre=request.args.get('genre') or None, since=month('since'), until=month('until'))
+
+
+@app.route('/stats')
+@limiter.route_class('listing')
+def show_stats():
+    return render_template('pages/stats.html', stats=stats_report(), states=STATE_CHOICES, genres=GENRE_CHOICES)
+
+
+@app.route('/stats.json')
+@limiter.route_class('listing')
+def show_stats_json():
+    return jsonify(stats_report())
+
+
+#  Admin
+#  ----------------------------------------------------------------
+
+@app.route('/admin/entity-cache')
+def entity_cache_stats():
+    return jsonify(entity_cache.stats())
+
+
+SLOW_QUERY_ORDERS = ('total_ms', 'max_ms', 'mean_ms', 'count')
+
+
+def slow_query_order():
+    order = request.args.get('order', 'total_ms')
+    if order not in SLOW_QUERY_ORDERS:
+        abort(400)
+    return order
+
+
+def slow_queries_page():
+    order = slow_query_order()
+    return render_template('pages/slow_queries.html', queries=slow_queries.top(order), order=order,
+                           orders=SLOW_QUERY_ORDERS, enabled=slow_queries.enabled,
+                           threshold_ms=slow_queries.threshold_ms)
+
+
+def slow_queries_json():
+    return jsonify(slow_queries.top(slow_query_order()))
+
+
+# unauthenticated, so only served in development or when SLOW_QUERY_ADMIN asks for it
+if slow_queries.admin:
+    app.add_url_rule('/admin/slow-queries', view_func=slow_queries_page)
+    app.add_url_rule('/admin/slow-queries.json', view_func=slow_queries_json)
 
 
 @app.errorhandler(404)
@@ -599,16 +822,6 @@ def server_error(error):
     return render_template('errors/500.html'), 500
 
 
-if not app.debug:
-    file_handler = FileHandler('error.log')
-    file_handler.setFormatter(
-        Formatter('%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]')
-    )
-    app.logger.setLevel(logging.INFO)
-    file_handler.setLevel(logging.INFO)
-    app.logger.addHandler(file_handler)
-    app.logger.info('errors')
-
 # ----------------------------------------------------------------------------#
 # Launch.
 # ----------------------------------------------------------------------------#
@@ -0,0 +1,168 @@
+"""Ad-hoc performance reports.
+
+  $ python benchmarks.py catalog       # snapshot memory per 100k rows, DB vs snapshot latency
+  $ python benchmarks.py matches       # match index build and ranking latency over 100k venues and artists
+  $ python benchmarks.py compression   # bytes on the wire and CPU per request for each encoding
+"""
+import argparse
+import random
+import statistics
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+
+def timed(function, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples), max(samples)
+
+
+def synthetic_catalog(rows):
+    """Venue, artist and show rows shaped like the catalog tables, ``rows`` of each."""
+    genres = ['Jazz', 'Reggae', 'Swing', 'Classical', 'Folk', 'Rock n Roll']
+    venues = [(i, f'Venue {i}', f'City {i % 500}', 'CA', f'{i} Main St', '555-0100', None, None, None,
+               random.sample(genres, 2), bool(i % 2), None) for i in range(1, rows + 1)]
+    artists = [(i, f'Artist {i}', f'City {i % 500}', 'NY', '555-0199', random.sample(genres, 2), None, None,
+                None, bool(i % 3), None) for i in range(1, rows + 1)]
+    start = datetime(2020, 1, 1)
+    shows = [(i, random.randint(1, rows), random.randint(1, rows), start + timedelta(hours=random.randint(0, 70000)))
+             for i in range(1, rows + 1)]
+    return venues, artists, shows
+
+
+def bench_catalog(args):
+    from catalog import Snapshot
+
+    venues, artists, shows = synthetic_catalog(args.rows)
+
+    def traced(build):
+        tracemalloc.start()
+        snapshot = build()
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del snapshot
+        return current
+
+    # shows are only kept with their venue and artist, so they are measured on top of both
+    parents = traced(lambda: Snapshot(0, venues, artists, []))
+    for name, used in (
+            ('venues', traced(lambda: Snapshot(0, venues, [], []))),
+            ('artists', traced(lambda: Snapshot(0, [], artists, []))),
+            ('shows', traced(lambda: Snapshot(0, venues, artists, shows)) - parents)):
+        print(f'snapshot {name:8} {used / args.rows * 100000 / 2 ** 20:8.1f} MiB per 100k rows')
+
+    snapshot = Snapshot(0, venues, artists, shows)
+    now = datetime(2024, 1, 1)
+    for name, function in (
+            ('venue_page', lambda: snapshot.venue_page(random.randint(1, args.rows), now)),
+            ('artist_page', lambda: snapshot.artist_page(random.randint(1, args.rows), now))):
+        median, worst = timed(function, args.repeat)
+        print(f'snapshot {name:12} median {median:7.3f} ms  max {worst:7.3f} ms')
+
+    # Same pages end to end against the configured database, with and without the snapshot.
+    try:
+        from app import app, catalog, db, Venue
+        with app.app_context():
+            venue_id = db.session.query(Venue.id).limit(1).scalar()
+    except Exception as error:
+        print(f'skipping DB comparison: {error}')
+        return
+    client = app.test_client()
+    paths = ['/venues', '/artists', '/shows'] + ([f'/venues/{venue_id}'] if venue_id else [])
+    for enabled in (False, True):
+        catalog.enabled = enabled
+        for path in paths:
+            median, worst = timed(lambda: client.get(path), args.repeat)
+            mode = 'snapshot' if enabled else 'db'
+            print(f'{mode:8} GET {path:16} median {median:8.2f} ms  max {worst:8.2f} ms')
+
+
+def bench_matches(args):
+    import numpy as np
+    from matching import MatchIndex, SideIndex, Vocabulary
+
+    venues, artists, _ = synthetic_catalog(args.rows)
+    index = MatchIndex()
+    places = Vocabulary()
+    started = time.perf_counter()
+    index.venues = SideIndex(index.genres, places)
+    index.artists = SideIndex(index.genres, places)
+    for row in venues:
+        index.venues.upsert(row[0], row[1], row[2], row[3], row[9], row[10])
+    for row in artists:
+        index.artists.upsert(row[0], row[1], row[2], row[3], row[5], row[9])
+    print(f'build {args.rows} venues + {args.rows} artists  {(time.perf_counter() - started) * 1000:9.1f} ms')
+
+    # _rank is what a request runs once the past-show history is loaded; no database involved
+    no_history = np.zeros(index.artists.ids.shape[0])
+    for name, function in (
+            ('rank artists for venue', lambda: index._rank(
+                index.venues, index.artists, random.randint(1, args.rows), no_history, 20)),
+            ('upsert one artist', lambda: index.artists.upsert(
+                random.randint(1, args.rows), 'Renamed', 'City 7', 'NY', ['Jazz', 'Folk'], True))):
+        median, worst = timed(function, args.repeat)
+        print(f'{name:24} median {median:7.3f} ms  max {worst:7.3f} ms')
+
+
+def bench_compression(args):
+    from compression import supported_encodings
+    from app import app
+
+    client = app.test_client()
+    paths = ['/', '/venues', '/artists', '/shows', '/static/css/bootstrap.min.css', '/static/js/libs/jquery-1.11.1.min.js']
+    for path in paths:
+        baseline = None
+        for encoding in ('identity',) + supported_encodings():
+            def fetch():
+                # fyyur.internal keeps the rate limiter out of the measurement
+                response = client.get(path, headers={'Accept-Encoding': encoding},
+                                      environ_base={'fyyur.internal': True})
+                body = response.get_data()
+                response.close()
+                return response, body
+
+            try:
+                response, body = fetch()
+            except Exception as error:
+                print(f'skipping {path}: {error}')
+                break
+            started = time.process_time()
+            for _ in range(args.repeat):
+                fetch()
+            cpu_ms = (time.process_time() - started) / args.repeat * 1000
+            if baseline is None:
+                baseline = cpu_ms
+            served = response.headers.get('Content-Encoding', 'identity')
+            print(f'GET {path:40} {encoding:8} -> {served:8} {len(body):9} bytes  '
+                  f'cpu {cpu_ms:7.3f} ms ({cpu_ms - baseline:+.3f})')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='benchmark')
+    subparsers.required = True
+
+    catalog = subparsers.add_parser('catalog', help='catalog snapshot memory and latency')
+    catalog.add_argument('--rows', type=int, default=100000)
+    catalog.add_argument('--repeat', type=int, default=50)
+    catalog.set_defaults(run=bench_catalog)
+
+    matches = subparsers.add_parser('matches', help='match index build and ranking latency')
+    matches.add_argument('--rows', type=int, default=100000)
+    matches.add_argument('--repeat', type=int, default=50)
+    matches.set_defaults(run=bench_matches)
+
+    compression = subparsers.add_parser('compression', help='response size and CPU per encoding')
+    compression.add_argument('--repeat', type=int, default=50)
+    compression.set_defaults(run=bench_compression)
+
+    args = parser.parse_args()
+    args.run(args)
+
+
+if __name__ == '__main__':
+    main()
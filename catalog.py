@@ -0,0 +1,314 @@
+"""Optional in-process snapshot of the venue/artist/show catalog.
+
+With ``CATALOG_SNAPSHOT`` enabled the listing and detail pages are served from
+a compact in-memory copy of the catalog instead of the database: venues and
+artists are ``__slots__`` records indexed by id, shows are parallel ``array``
+columns sorted by start_time. With ``CATALOG_VERSIONING`` on (the default when
+the snapshot is) every committed write bumps ``catalog_version``; processes
+notice through PostgreSQL LISTEN/NOTIFY, or by polling the version table on
+other databases, and reload the snapshot. The bump locks the version row until
+commit, so writes are serialized on it; with versioning off it is never touched.
+"""
+import logging
+import select
+import threading
+import time
+from array import array
+from datetime import datetime, timedelta
+
+from sqlalchemy import DateTime, text
+
+logger = logging.getLogger(__name__)
+
+EPOCH = datetime(1970, 1, 1)
+NOTIFY_CHANNEL = 'catalog_changed'
+
+VENUE_FIELDS = ('id', 'name', 'city', 'state', 'address', 'phone', 'image_link', 'facebook_link',
+                'website', 'genres', 'seeking_talent', 'seeking_description')
+ARTIST_FIELDS = ('id', 'name', 'city', 'state', 'phone', 'genres', 'image_link', 'facebook_link',
+                 'website', 'seeking_venue', 'seeking_description')
+
+
+def to_seconds(value):
+    return (value - EPOCH).total_seconds()
+
+
+def from_seconds(seconds):
+    return EPOCH + timedelta(seconds=seconds)
+
+
+class VenueRecord(object):
+    __slots__ = VENUE_FIELDS
+
+    def __init__(self, row):
+        for field, value in zip(VENUE_FIELDS, row):
+            setattr(self, field, value)
+
+
+class ArtistRecord(object):
+    __slots__ = ARTIST_FIELDS
+
+    def __init__(self, row):
+        for field, value in zip(ARTIST_FIELDS, row):
+            setattr(self, field, value)
+
+
+class Snapshot(object):
+    """Immutable catalog snapshot; build a new one instead of mutating it."""
+
+    def __init__(self, version, venue_rows, artist_rows, show_rows):
+        self.version = version
+        self.venues = [VenueRecord(row) for row in venue_rows]
+        self.artists = [ArtistRecord(row) for row in artist_rows]
+        self.venue_index = {venue.id: index for index, venue in enumerate(self.venues)}
+        self.artist_index = {artist.id: index for index, artist in enumerate(self.artists)}
+
+        self.show_id = array('q')
+        self.show_venue = array('q')
+        self.show_artist = array('q')
+        self.show_start = array('d')
+        for show_id, venue_id, artist_id, start_time in sorted(show_rows, key=lambda row: row[3]):
+            if venue_id not in self.venue_index or artist_id not in self.artist_index:
+                # a show is only listed with its venue and artist, whatever a concurrent write left behind
+                continue
+            self.show_id.append(show_id)
+            self.show_venue.append(venue_id)
+            self.show_artist.append(artist_id)
+            self.show_start.append(to_seconds(start_time))
+
+        # show rows per venue/artist, ascending by start_time like the columns themselves
+        self.venue_shows = {}
+        self.artist_shows = {}
+        for row in range(len(self.show_id)):
+            self.venue_shows.setdefault(self.show_venue[row], array('l')).append(row)
+            self.artist_shows.setdefault(self.show_artist[row], array('l')).append(row)
+
+    def __len__(self):
+        return len(self.venues) + len(self.artists) + len(self.show_id)
+
+    def venue(self, venue_id):
+        index = self.venue_index.get(venue_id)
+        return None if index is None else self.venues[index]
+
+    def artist(self, artist_id):
+        index = self.artist_index.get(artist_id)
+        return None if index is None else self.artists[index]
+
+    def _split(self, rows, now):
+        """Split ``rows`` (ascending by start) at ``now``; returns (past, upcoming)."""
+        now = to_seconds(now)
+        low, high = 0, len(rows)
+        while low < high:
+            middle = (low + high) // 2
+            if self.show_start[rows[middle]] < now:
+                low = middle + 1
+            else:
+                high = middle
+        return rows[:low], rows[low:]
+
+    def _show_time(self, row):
+        return str(from_seconds(self.show_start[row]))
+
+    def venue_areas(self, now):
+        areas = {}
+        now_seconds = to_seconds(now)
+        for venue in sorted(self.venues, key=lambda venue: (venue.state, venue.city, venue.id)):
+            past, upcoming = self._split(self.venue_shows.get(venue.id, array('l')), now)
+            area = areas.setdefault((venue.city, venue.state),
+                                    {"city": venue.city, "state": venue.state, "venues": []})
+            area["venues"].append({
+                "id": venue.id,
+                "name": venue.name,
+                "num_upcoming_shows": sum(1 for row in upcoming if self.show_start[row] > now_seconds),
+            })
+        return list(areas.values())
+
+    def artist_list(self):
+        return [{"id": artist.id, "name": artist.name} for artist in self.artists]
+
+    def show_list(self):
+        shows = []
+        for row in reversed(range(len(self.show_id))):
+            venue = self.venue(self.show_venue[row])
+            artist = self.artist(self.show_artist[row])
+            shows.append({
+                "venue_id": venue.id,
+                "venue_name": venue.name,
+                "artist_id": artist.id,
+                "artist_name": artist.name,
+                "artist_image_link": artist.image_link,
+                "start_time": self._show_time(row)
+            })
+        return shows
+
+    def _artist_details(self, row):
+        artist = self.artist(self.show_artist[row])
+        return {
+            'artist_id': artist.id,
+            'artist_name': artist.name,
+            'artist_image_link': artist.image_link,
+            'start_time': self._show_time(row)
+        }
+
+    def _venue_details(self, row):
+        venue = self.venue(self.show_venue[row])
+        return {
+            'venue_id': venue.id,
+            'venue_name': venue.name,
+            'venue_image_link': venue.image_link,
+            'start_time': self._show_time(row)
+        }
+
+    def venue_page(self, venue_id, now):
+        venue = self.venue(venue_id)
+        if venue is None:
+            return None
+        past, upcoming = self._split(self.venue_shows.get(venue_id, array('l')), now)
+        data = {field: getattr(venue, field) for field in VENUE_FIELDS}
+        data["past_shows"] = [self._artist_details(row) for row in reversed(past)]
+        data["upcoming_shows"] = [self._artist_details(row) for row in upcoming]
+        data["past_shows_count"] = len(past)
+        data["upcoming_shows_count"] = len(upcoming)
+        return data
+
+    def artist_page(self, artist_id, now):
+        artist = self.artist(artist_id)
+        if artist is None:
+            return None
+        past, upcoming = self._split(self.artist_shows.get(artist_id, array('l')), now)
+        data = {field: getattr(artist, field) for field in ARTIST_FIELDS}
+        data["past_shows"] = [self._venue_details(row) for row in reversed(past)]
+        data["upcoming_shows"] = [self._venue_details(row) for row in upcoming]
+        data["past_shows_count"] = len(past)
+        data["upcoming_shows_count"] = len(upcoming)
+        return data
+
+
+class Catalog(object):
+    """Keeps a fresh ``Snapshot`` per process.
+
+    Configuration:
+
+    * ``CATALOG_SNAPSHOT`` -- serve read pages from the snapshot
+    * ``CATALOG_VERSIONING`` -- bump ``catalog_version`` on every write; defaults to ``CATALOG_SNAPSHOT``
+    * ``CATALOG_POLL_SECONDS`` -- how often ``catalog_version`` is polled without LISTEN/NOTIFY
+    * ``CATALOG_LISTEN`` -- use LISTEN/NOTIFY on PostgreSQL
+    """
+
+    def __init__(self, app=None, db=None, changes=None):
+        self.db = db
+        self.enabled = False
+        self.versioned = False
+        self.poll_seconds = 2
+        self.listen = True
+        self._snapshot = None
+        self._stale = True
+        self._polled_at = 0.0
+        self._listener = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app, db, changes)
+
+    def init_app(self, app, db, changes):
+        self.db = db
+        self.enabled = app.config.setdefault('CATALOG_SNAPSHOT', False)
+        self.poll_seconds = app.config.setdefault('CATALOG_POLL_SECONDS', 2)
+        self.listen = app.config.setdefault('CATALOG_LISTEN', True)
+        # Set alike in every process of a deployment, so CLI commands and workers tell the processes
+        # serving a snapshot even if they do not serve one themselves.
+        self.versioned = app.config.setdefault('CATALOG_VERSIONING', self.enabled)
+        if self.versioned:
+            changes.on_flush(lambda session, _: self._bump_version(session, changes))
+        if self.enabled:
+            changes.on_commit(lambda _: self.invalidate())
+
+    def invalidate(self):
+        self._stale = True
+
+    def _bump_version(self, session, changes):
+        pending = changes.pending(session)
+        if 'catalog_version' in pending.flags:
+            return
+        pending.flags.add('catalog_version')
+        connection = session.connection()
+        connection.execute(text('UPDATE catalog_version SET version = version + 1 WHERE id = 1'))
+        # the row stays locked until commit, so this is exactly the version the transaction will publish
+        pending.version = self._version(connection)
+        if connection.dialect.name == 'postgresql':
+            # delivered to listeners only when the transaction commits
+            connection.execute(text(f'NOTIFY {NOTIFY_CHANNEL}'))
+
+    def _version(self, connection):
+        return connection.execute(text('SELECT version FROM catalog_version WHERE id = 1')).scalar()
+
+    def load(self):
+        # Read from the primary: a lagging replica could pair a new version with old rows.
+        with self.db.engine.connect() as connection:
+            if connection.dialect.name == 'postgresql':
+                # one snapshot for the version and all three tables, so no show outlives its venue or artist
+                connection = connection.execution_options(isolation_level='REPEATABLE READ')
+            with connection.begin():
+                return self._load(connection)
+
+    def _load(self, connection):
+        version = self._version(connection)
+        venues = connection.execute(text(
+            f'SELECT {", ".join(VENUE_FIELDS)} FROM venue WHERE deleted_at IS NULL')).fetchall()
+        artists = connection.execute(text(
+            f'SELECT {", ".join(ARTIST_FIELDS)} FROM artist WHERE deleted_at IS NULL ORDER BY id')).fetchall()
+        shows = connection.execute(
+            text('SELECT id, venue_id, artist_id, start_time FROM show').columns(start_time=DateTime)
+        ).fetchall()
+        return Snapshot(version, venues, artists, shows)
+
+    def snapshot(self):
+        self._watch()
+        if not self._stale and self._listener is None and time.time() - self._polled_at >= self.poll_seconds:
+            self._polled_at = time.time()
+            with self.db.engine.connect() as connection:
+                version = self._version(connection)
+            self._stale = self._snapshot is None or version != self._snapshot.version
+        if self._stale or self._snapshot is None:
+            # One thread rebuilds; the others keep serving the previous snapshot meanwhile.
+            if self._lock.acquire(blocking=self._snapshot is None):
+                try:
+                    self._stale = False
+                    self._snapshot = self.load()
+                    self._polled_at = time.time()
+                except Exception:
+                    self._stale = True
+                    raise
+                finally:
+                    self._lock.release()
+        return self._snapshot
+
+    def _watch(self):
+        if self._listener is not None and self._listener.is_alive():
+            return
+        self._listener = None
+        if not self.listen or self.db.engine.dialect.name != 'postgresql':
+            return
+        self._listener = threading.Thread(target=self._listen, args=(self.db.engine,),
+                                          name='catalog-listener', daemon=True)
+        self._listener.start()
+
+    def _listen(self, engine):
+        connection = engine.raw_connection()
+        try:
+            dbapi_connection = connection.connection
+            dbapi_connection.set_isolation_level(0)  # autocommit, required for LISTEN
+            dbapi_connection.cursor().execute(f'LISTEN {NOTIFY_CHANNEL}')
+            # anything committed before LISTEN took effect would otherwise be missed
+            self.invalidate()
+            while True:
+                if select.select([dbapi_connection], [], [], 5) == ([], [], []):
+                    continue
+                dbapi_connection.poll()
+                if dbapi_connection.notifies:
+                    del dbapi_connection.notifies[:]
+                    self.invalidate()
+        except Exception:
+            logger.exception('catalog listener stopped, falling back to polling')
+            self.listen = False
+        finally:
+            connection.invalidate()
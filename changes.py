@@ -0,0 +1,133 @@
+"""Tracks which venues, artists and shows a database transaction changed.
+
+Caches and derived data subscribe here instead of hooking SQLAlchemy events
+themselves. Flush listeners run inside the transaction (so they may write to
+the database), commit listeners run once the transaction has committed.
+"""
+from collections import defaultdict
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm.attributes import get_history
+
+TRACKED_TABLES = ('venue', 'artist', 'show')
+
+
+class ChangeSet(object):
+    """Ids of changed rows per table and operation ('created', 'updated', 'deleted')."""
+
+    def __init__(self):
+        self.created = defaultdict(set)
+        self.updated = defaultdict(set)
+        self.deleted = defaultdict(set)
+        # (table, id) of the venues and artists whose shows changed
+        self.show_parents = set()
+        # ids of shows that were only moved to show_archive; they are also in updated['show']
+        self.archived = set()
+        # (op, instance) pairs, only populated on the ChangeSet handed to flush listeners
+        self.instances = []
+        # scratch space for listeners, lives as long as the transaction
+        self.flags = set()
+        # catalog_version this transaction wrote, set by the catalog; None if it wrote none
+        self.version = None
+
+    def __bool__(self):
+        return any(self.created.values()) or any(self.updated.values()) or any(self.deleted.values())
+
+    def ids(self, table):
+        return self.created[table] | self.updated[table] | self.deleted[table]
+
+    def parents(self, table):
+        return {parent_id for parent_table, parent_id in self.show_parents if parent_table == table}
+
+    def add(self, table, op, ids):
+        getattr(self, op)[table].update(ids)
+
+    def update(self, other):
+        for op in ('created', 'updated', 'deleted'):
+            for table, ids in getattr(other, op).items():
+                getattr(self, op)[table].update(ids)
+        self.show_parents.update(other.show_parents)
+        self.archived.update(other.archived)
+
+
+class ChangeTracker(object):
+    def __init__(self, app=None, db=None):
+        self._flush_listeners = []
+        self._commit_listeners = []
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db):
+        event.listen(db.session, 'after_flush', self._after_flush)
+        event.listen(db.session, 'after_commit', self._after_commit)
+        event.listen(db.session, 'after_rollback', self._after_rollback)
+
+    def on_flush(self, callback):
+        """Register ``callback(session, changes)``, called inside the transaction after each flush."""
+        self._flush_listeners.append(callback)
+        return callback
+
+    def on_commit(self, callback):
+        """Register ``callback(changes)``, called with everything a transaction changed once it commits."""
+        self._commit_listeners.append(callback)
+        return callback
+
+    def track_history(self, *attributes):
+        """Load the old value of ``attributes`` before they change, so a show moved
+        to another venue or artist reports both the old and the new parent."""
+        for attribute in attributes:
+            event.listen(attribute, 'set', lambda target, value, oldvalue, initiator: value,
+                         active_history=True)
+
+    def mark(self, session, table, op, ids, show_parents=(), archived=False):
+        """Record changes made with set-based statements that bypass the unit of work.
+
+        Mark deletions before the statement runs and the rest after it, so
+        flush listeners can read the rows either way. Shows moved unchanged
+        into show_archive are marked 'updated' with ``archived=True``.
+        """
+        changes = ChangeSet()
+        changes.add(table, op, ids)
+        changes.show_parents.update(show_parents)
+        if archived:
+            changes.archived.update(ids)
+        self._record(session, changes)
+
+    def pending(self, session):
+        return session.info.setdefault('tracked_changes', ChangeSet())
+
+    def _record(self, session, changes):
+        if not changes:
+            return
+        self.pending(session).update(changes)
+        for callback in self._flush_listeners:
+            callback(session, changes)
+
+    def _after_flush(self, session, flush_context):
+        changes = ChangeSet()
+        for op, instances in (('created', session.new), ('updated', session.dirty), ('deleted', session.deleted)):
+            for instance in instances:
+                table = getattr(instance, '__tablename__', None)
+                if table not in TRACKED_TABLES:
+                    continue
+                if op == 'updated' and not session.is_modified(instance):
+                    continue
+                changes.add(table, op, inspect(instance).mapper.primary_key_from_instance(instance))
+                changes.instances.append((op, instance))
+                if table == 'show':
+                    for parent in ('venue', 'artist'):
+                        history = get_history(instance, parent + '_id')
+                        for parent_id in history.sum():
+                            if parent_id is not None:
+                                changes.show_parents.add((parent, int(parent_id)))
+        self._record(session, changes)
+
+    def _after_commit(self, session):
+        changes = session.info.pop('tracked_changes', None)
+        if not changes:
+            return
+        for callback in self._commit_listeners:
+            callback(changes)
+
+    def _after_rollback(self, session):
+        session.info.pop('tracked_changes', None)
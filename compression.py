@@ -0,0 +1,314 @@
+"""Response compression.
+
+``CompressionMiddleware`` wraps the WSGI app and negotiates ``br`` (when the
+brotli package is installed) or ``gzip`` from ``Accept-Encoding``. Responses
+are compressed as they stream: each chunk the application yields is
+compressed and flushed on its own, so streamed pages still reach the client
+incrementally. Bodies smaller than ``COMPRESSION_MIN_SIZE``, types outside
+``COMPRESSION_MIMETYPES``, partial responses and responses that are already
+encoded pass through untouched. Files under static/ with a precompressed
+``.br``/``.gz`` sibling (see ``flask static compress``) are served from disk
+without compressing anything per request.
+"""
+import gzip
+import mimetypes
+import os
+import zlib
+
+import click
+from flask.cli import AppGroup
+from werkzeug.datastructures import Headers
+from werkzeug.wrappers import Response
+from werkzeug.wsgi import ClosingIterator, wrap_file
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = frozenset((
+    'text/html', 'text/css', 'text/plain', 'text/xml', 'text/calendar', 'text/javascript',
+    'application/javascript', 'application/json', 'application/xml', 'image/svg+xml',
+    'application/vnd.ms-fontobject', 'font/ttf', 'font/otf',
+))
+# files worth precompressing; images and woff fonts are already compressed
+STATIC_EXTENSIONS = ('.css', '.js', '.map', '.svg', '.html', '.txt', '.json', '.xml', '.ttf', '.otf', '.eot')
+SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+
+
+def supported_encodings():
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def negotiate(header, supported):
+    """Encodings from ``supported`` the client accepts, best first; ties keep ``supported`` order."""
+    quality = {}
+    for part in header.split(','):
+        coding, _, params = part.strip().partition(';')
+        coding = coding.strip().lower()
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if coding:
+            quality[coding] = q
+    ranked = []
+    for position, encoding in enumerate(supported):
+        q = quality.get(encoding, quality.get('*', 0.0))
+        if q > 0:
+            ranked.append((-q, position, encoding))
+    return [encoding for _, _, encoding in sorted(ranked)]
+
+
+class GzipStream(object):
+    def __init__(self, level):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data):
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+class BrotliStream(object):
+    def __init__(self, quality):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data):
+        return self._compressor.process(data) + self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+def add_vary(headers):
+    vary = headers.get('Vary')
+    if not vary:
+        headers['Vary'] = 'Accept-Encoding'
+    elif vary.strip() != '*' and 'accept-encoding' not in vary.lower():
+        headers['Vary'] = vary + ', Accept-Encoding'
+
+
+class StaticFiles(object):
+    """Serves ``<file>.br``/``<file>.gz`` for a static file when they exist and are not older than it."""
+
+    def __init__(self, folder, url_path, max_age=None):
+        self.folder = os.path.abspath(folder)
+        self.prefix = url_path.rstrip('/') + '/'
+        self.max_age = max_age
+
+    def response(self, environ, encodings):
+        path = environ.get('PATH_INFO', '')
+        if not encodings or not path.startswith(self.prefix) or environ.get('HTTP_RANGE'):
+            return None
+        filename = os.path.normpath(os.path.join(self.folder, path[len(self.prefix):]))
+        if not filename.startswith(self.folder + os.sep):
+            return None
+        try:
+            original = os.stat(filename)
+        except OSError:
+            return None
+        for encoding in encodings:
+            variant = filename + SUFFIXES[encoding]
+            try:
+                stat = os.stat(variant)
+            except OSError:
+                continue
+            if stat.st_mtime < original.st_mtime:
+                continue
+            mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+            response = Response(wrap_file(environ, open(variant, 'rb')), mimetype=mimetype,
+                                direct_passthrough=True)
+            response.headers['Content-Encoding'] = encoding
+            response.headers['Vary'] = 'Accept-Encoding'
+            response.content_length = stat.st_size
+            response.last_modified = int(original.st_mtime)
+            response.set_etag(f'{int(original.st_mtime)}-{original.st_size}-{encoding}')
+            if self.max_age is not None:
+                response.cache_control.public = True
+                response.cache_control.max_age = self.max_age
+            return response.make_conditional(environ)
+        return None
+
+
+class CompressionMiddleware(object):
+    def __init__(self, wsgi_app, min_size=500, level=6, brotli_quality=4, mimetypes=COMPRESSIBLE_MIMETYPES,
+                 static=None):
+        self.wsgi_app = wsgi_app
+        self.min_size = min_size
+        self.level = level
+        self.brotli_quality = brotli_quality
+        self.mimetypes = frozenset(mimetypes)
+        self.static = static
+        self.encodings = supported_encodings()
+
+    def __call__(self, environ, start_response):
+        encodings = negotiate(environ.get('HTTP_ACCEPT_ENCODING', ''), self.encodings)
+        if self.static is not None and environ['REQUEST_METHOD'] in ('GET', 'HEAD'):
+            response = self.static.response(environ, encodings)
+            if response is not None:
+                return response(environ, start_response)
+
+        state = {}
+        prelude = []
+
+        def capture(status, headers, exc_info=None):
+            if exc_info is not None and state.get('started'):
+                raise exc_info[1].with_traceback(exc_info[2])
+            state['status'], state['headers'], state['exc_info'] = status, headers, exc_info
+            return prelude.append
+
+        app_iter = self.wsgi_app(environ, capture)
+        encoding = encodings[0] if encodings and environ['REQUEST_METHOD'] != 'HEAD' else None
+        body = self._stream(app_iter, prelude, state, encoding, start_response)
+        return ClosingIterator(body, getattr(app_iter, 'close', None))
+
+    def _compressible(self, status, headers):
+        code = int(status.split(None, 1)[0])
+        if code < 200 or code in (204, 206, 304) or 'Content-Encoding' in headers or 'Content-Range' in headers:
+            return False
+        if 'no-transform' in headers.get('Cache-Control', ''):
+            return False
+        mimetype = headers.get('Content-Type', '').split(';', 1)[0].strip().lower()
+        return mimetype in self.mimetypes
+
+    def _stream(self, app_iter, pending, state, encoding, start_response):
+        iterator = iter(app_iter)
+        pending = list(pending)
+        # WSGI allows start_response to be called as late as the first chunk
+        while 'status' not in state:
+            chunk = next(iterator, None)
+            if chunk is None:
+                break
+            pending.append(chunk)
+        status, headers = state['status'], Headers(state['headers'])
+
+        compress = encoding is not None and self._compressible(status, headers)
+        if self._compressible(status, headers):
+            add_vary(headers)
+        if compress and headers.get('Content-Length') is not None:
+            compress = int(headers['Content-Length']) >= self.min_size
+        elif compress:
+            # unknown length: hold back chunks until the threshold is reached or the body ends
+            size = sum(len(chunk) for chunk in pending)
+            while size < self.min_size:
+                chunk = next(iterator, None)
+                if chunk is None:
+                    compress = False
+                    break
+                pending.append(chunk)
+                size += len(chunk)
+
+        if not compress:
+            state['started'] = True
+            start_response(status, headers.to_wsgi_list(), state['exc_info'])
+            yield from pending
+            yield from iterator
+            return
+
+        del headers['Content-Length']
+        headers['Content-Encoding'] = encoding
+        etag = headers.get('ETag')
+        if etag and not etag.startswith('W/'):
+            # the encoded body is not byte-for-byte the original, but If-None-Match still matches weakly
+            headers['ETag'] = 'W/' + etag
+        state['started'] = True
+        start_response(status, headers.to_wsgi_list(), state['exc_info'])
+        stream = BrotliStream(self.brotli_quality) if encoding == 'br' else GzipStream(self.level)
+        if pending:
+            yield stream.compress(b''.join(pending))
+        for chunk in iterator:
+            if chunk:
+                yield stream.compress(chunk)
+        yield stream.finish()
+
+
+def precompress(path, encodings, force=False):
+    """Write ``path.gz``/``path.br`` next to ``path``; variants that do not save space are removed."""
+    with open(path, 'rb') as source:
+        data = source.read()
+    written = []
+    for encoding in encodings:
+        variant = path + SUFFIXES[encoding]
+        if not force and os.path.exists(variant) and os.path.getmtime(variant) >= os.path.getmtime(path):
+            continue
+        if encoding == 'br':
+            compressed = brotli.compress(data, quality=11)
+        else:
+            compressed = gzip.compress(data, compresslevel=9, mtime=0)
+        if len(compressed) >= len(data) * 0.9:
+            if os.path.exists(variant):
+                os.remove(variant)
+            continue
+        temporary = variant + '.tmp'
+        with open(temporary, 'wb') as target:
+            target.write(compressed)
+        os.replace(temporary, variant)
+        written.append((variant, len(data), len(compressed)))
+    return written
+
+
+class Compressor(object):
+    """Configuration:
+
+    * ``COMPRESSION_ENABLED``
+    * ``COMPRESSION_MIN_SIZE`` -- bodies smaller than this many bytes are sent as they are
+    * ``COMPRESSION_LEVEL`` -- gzip level for dynamic responses
+    * ``COMPRESSION_BROTLI_QUALITY`` -- brotli quality for dynamic responses
+    * ``COMPRESSION_MIMETYPES``
+    * ``COMPRESSION_STATIC_PRECOMPRESSED`` -- serve ``.br``/``.gz`` siblings of static files
+    """
+
+    def __init__(self, app=None):
+        self.middleware = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        config = app.config
+        config.setdefault('COMPRESSION_ENABLED', True)
+        config.setdefault('COMPRESSION_MIN_SIZE', 500)
+        config.setdefault('COMPRESSION_LEVEL', 6)
+        config.setdefault('COMPRESSION_BROTLI_QUALITY', 4)
+        config.setdefault('COMPRESSION_MIMETYPES', COMPRESSIBLE_MIMETYPES)
+        config.setdefault('COMPRESSION_STATIC_PRECOMPRESSED', True)
+        app.cli.add_command(self._command_group(app))
+        if not config['COMPRESSION_ENABLED']:
+            return
+        static = None
+        if config['COMPRESSION_STATIC_PRECOMPRESSED'] and app.static_folder:
+            max_age = config.get('SEND_FILE_MAX_AGE_DEFAULT')
+            if hasattr(max_age, 'total_seconds'):
+                max_age = int(max_age.total_seconds())
+            static = StaticFiles(app.static_folder, app.static_url_path, max_age)
+        self.middleware = app.wsgi_app = CompressionMiddleware(
+            app.wsgi_app, min_size=config['COMPRESSION_MIN_SIZE'], level=config['COMPRESSION_LEVEL'],
+            brotli_quality=config['COMPRESSION_BROTLI_QUALITY'], mimetypes=config['COMPRESSION_MIMETYPES'],
+            static=static)
+
+    def _command_group(self, app):
+        static_group = AppGroup('static', help='Manage files under static/.')
+
+        @static_group.command('compress')
+        @click.option('--force', is_flag=True, help='Rewrite variants that are already up to date.')
+        def compress(force):
+            """Write .gz (and .br with brotli installed) variants of static files."""
+            original_total = compressed_total = 0
+            for directory, _, filenames in os.walk(app.static_folder):
+                for filename in filenames:
+                    if not filename.endswith(STATIC_EXTENSIONS):
+                        continue
+                    for variant, original, compressed in precompress(os.path.join(directory, filename),
+                                                                     supported_encodings(), force):
+                        original_total += original
+                        compressed_total += compressed
+                        click.echo(f'{os.path.relpath(variant, app.static_folder)}: {original} -> {compressed} bytes')
+            if brotli is None:
+                click.echo('brotli is not installed; only .gz variants were written')
+            click.echo(f'{original_total} -> {compressed_total} bytes written')
+
+        return static_group
@@ -0,0 +1,371 @@
+"""Fuzzy duplicate detection for venues and artists.
+
+Names are normalized first: lower case ASCII, ``&`` spelled out, punctuation
+dropped and a leading or trailing article removed, so "The Musical Hop" and
+"Musical Hop, The" both become "musical hop". Only rows in the same city and
+state that share a name token are compared (blocking); tokens shared by more
+than ``DEDUP_MAX_BLOCK`` rows of a city carry no signal and are not blocked on.
+Candidate pairs are generated and scored with NumPy: each name is a row of
+character trigram codes, and the similarity of a pair is the Dice coefficient
+of their trigrams, after a cheaper estimate from 256-bit trigram signatures
+has discarded the pairs that are nowhere near. Pairs above
+``DEDUP_THRESHOLD`` are grouped, and a cluster keeps only the rows at least
+that similar to the row it keeps.
+
+Creating a venue or artist warns about likely duplicates (and
+``/venues/similar`` lets the form check as you type); ``flask dedup report``
+lists every cluster and ``flask dedup merge`` folds duplicates into one row,
+re-pointing their shows with set-based statements.
+"""
+import json
+import re
+import unicodedata
+
+import click
+import numpy as np
+from flask.cli import AppGroup
+from sqlalchemy import bindparam, text
+
+from matching import popcount
+
+TABLES = ('venue', 'artist')
+ARTICLES = ('the', 'a', 'an')
+STOPWORDS = frozenset(ARTICLES + ('and', 'of', 'at', 'in', 'on'))
+TRAILING_ARTICLE = re.compile(r'^(.*?),\s*(the|a|an)$')
+NON_WORD = re.compile(r'[^a-z0-9]+')
+# trigrams hashed into a 256 bit signature per name; pairs whose signatures are too far apart are not scored
+SIGNATURE_WORDS = 4
+SIGNATURE_MARGIN = 0.15
+# pairs scored per vectorized step, fewer for long names: the (pairs, trigrams, trigrams) comparison array
+# stays under COMPARISON_CELLS
+PAIR_CHUNK = 20000
+COMPARISON_CELLS = PAIR_CHUNK * 22 * 22
+# blank columns of the row that is kept are filled in from the duplicates
+FILL_COLUMNS = {
+    'venue': ('address', 'phone', 'image_link', 'facebook_link', 'website'),
+    'artist': ('phone', 'image_link', 'facebook_link', 'website'),
+}
+
+
+def ascii_lower(value):
+    return unicodedata.normalize('NFKD', value or '').encode('ascii', 'ignore').decode('ascii').lower().strip()
+
+
+def normalize_name(name):
+    value = ascii_lower(name).replace('&', ' and ')
+    match = TRAILING_ARTICLE.match(value)
+    if match:
+        value = f'{match.group(2)} {match.group(1)}'
+    words = NON_WORD.sub(' ', value).split()
+    if len(words) > 1 and words[0] in ARTICLES:
+        words = words[1:]
+    return ' '.join(words)
+
+
+def normalize_place(city, state):
+    return ' '.join(NON_WORD.sub(' ', ascii_lower(city)).split()) + '|' + (state or '').strip().upper()
+
+
+def blocking_tokens(normalized):
+    return {word for word in normalized.split() if len(word) > 1 and word not in STOPWORDS}
+
+
+def trigrams(names):
+    """(rows, longest name + 2) uint32 trigram codes of normalized names; 0 past the end of a name."""
+    encoded = [f' {name} '.encode('ascii') for name in names]
+    width = max([3] + [len(name) for name in encoded])
+    padded = np.array(encoded, dtype=f'S{width}')
+    as_bytes = padded.view(np.uint8).reshape(len(names), width).astype(np.uint32)
+    codes = as_bytes[:, :-2] << 16 | as_bytes[:, 1:-1] << 8 | as_bytes[:, 2:]
+    codes[as_bytes[:, 2:] == 0] = 0
+    return codes
+
+
+def signatures(codes):
+    """(rows, SIGNATURE_WORDS) uint64 bitsets of the hashed trigrams of each row."""
+    bits = (codes.astype(np.uint64) * np.uint64(2654435761) >> np.uint64(8)) % np.uint64(64 * SIGNATURE_WORDS)
+    masks = np.where(codes != 0, np.uint64(1) << bits % np.uint64(64), np.uint64(0))
+    words = bits // np.uint64(64)
+    return np.stack([np.bitwise_or.reduce(np.where(words == word, masks, np.uint64(0)), axis=1)
+                     for word in range(SIGNATURE_WORDS)], axis=1)
+
+
+def estimated_similarity(left, right):
+    """Dice coefficient of the signature bits; close to ``similarity`` and far cheaper."""
+    shared = popcount(left & right)
+    return 2 * shared / np.maximum(popcount(left) + popcount(right), 1)
+
+
+def similarity(left, right):
+    """Dice coefficient of the trigrams of each row of ``left`` and the same row of ``right``."""
+    scores = np.empty(left.shape[0], dtype=np.float64)
+    left_lengths, right_lengths = (left != 0).sum(axis=1), (right != 0).sum(axis=1)
+    start = 0
+    while start < left.shape[0]:
+        # codes are left-aligned, so a chunk only needs as many columns as its longest names have trigrams
+        chunk = PAIR_CHUNK
+        while True:
+            left_width = max(1, int(left_lengths[start:start + chunk].max()))
+            right_width = max(1, int(right_lengths[start:start + chunk].max()))
+            if chunk == 1 or chunk * left_width * right_width <= COMPARISON_CELLS:
+                break
+            chunk //= 2
+        a, b = left[start:start + chunk, :left_width], right[start:start + chunk, :right_width]
+        equal = (a[:, :, None] == b[:, None, :]) & (a[:, :, None] != 0)
+        common = equal.any(axis=2).sum(axis=1) + equal.any(axis=1).sum(axis=1)
+        sizes = left_lengths[start:start + chunk] + right_lengths[start:start + chunk]
+        scores[start:start + chunk] = common / np.maximum(sizes, 1)
+        start += chunk
+    return scores
+
+
+def candidate_pairs(blocks, rows, max_block):
+    """Unique (row, row) pairs of rows that share a block, skipping blocks over ``max_block`` rows."""
+    if not len(blocks):
+        return np.zeros((0, 2), dtype=np.int64)
+    sizes = np.bincount(blocks)
+    keep = (sizes[blocks] > 1) & (sizes[blocks] <= max_block)
+    order = np.lexsort((rows[keep], blocks[keep]))
+    blocks, rows = blocks[keep][order], rows[keep][order]
+    # entries left after each one in its block; entry i pairs with i + offset while offset < remaining[i]
+    block_end = np.cumsum(np.bincount(blocks))[blocks]
+    remaining = block_end - np.arange(len(blocks)) - 1
+    starts = np.flatnonzero(remaining > 0)
+    pairs = []
+    offset = 1
+    while len(starts):
+        pairs.append(np.stack([rows[starts], rows[starts + offset]], axis=1))
+        offset += 1
+        starts = starts[remaining[starts] >= offset]
+    if not pairs:
+        return np.zeros((0, 2), dtype=np.int64)
+    # rows sharing several tokens pair up once per block; one int64 per pair makes the unique cheap
+    width = int(rows.max()) + 1
+    keys = np.sort(np.concatenate([pair[:, 0] * width + pair[:, 1] for pair in pairs]))
+    unique = keys[np.concatenate(([True], keys[1:] != keys[:-1]))]
+    return np.stack([unique // width, unique % width], axis=1)
+
+
+class DisjointSet(object):
+    def __init__(self):
+        self.parent = {}
+
+    def find(self, item):
+        root = self.parent.setdefault(item, item)
+        while root != self.parent[root]:
+            root = self.parent[root]
+        while item != root:
+            item, self.parent[item] = self.parent[item], root
+        return root
+
+    def union(self, left, right):
+        self.parent[self.find(left)] = self.find(right)
+
+    def groups(self):
+        groups = {}
+        for item in self.parent:
+            groups.setdefault(self.find(item), []).append(item)
+        return list(groups.values())
+
+
+class Deduplicator(object):
+    """Configuration:
+
+    * ``DEDUP_THRESHOLD`` -- trigram similarity from which two names in the same city count as one
+    * ``DEDUP_MAX_BLOCK`` -- name tokens shared by more rows of a city than this are not blocked on
+    * ``DEDUP_WARN_ON_CREATE`` -- flash likely duplicates when a venue or artist is created
+    """
+
+    def __init__(self, app=None, db=None, changes=None):
+        self.db = db
+        self.changes = changes
+        self.threshold = 0.8
+        self.max_block = 200
+        self.warn_on_create = True
+        if app is not None:
+            self.init_app(app, db, changes)
+
+    def init_app(self, app, db, changes):
+        self.db = db
+        self.changes = changes
+        self.threshold = app.config.setdefault('DEDUP_THRESHOLD', 0.8)
+        self.max_block = app.config.setdefault('DEDUP_MAX_BLOCK', 200)
+        self.warn_on_create = app.config.setdefault('DEDUP_WARN_ON_CREATE', True)
+        app.cli.add_command(self._command_group())
+
+    # Live checks
+
+    def similar(self, table, name, city, state, exclude=None, limit=5):
+        """Existing rows of ``table`` in the same place whose name is likely the same as ``name``."""
+        normalized = normalize_name(name)
+        if not normalized or not city or not state:
+            return []
+        city = city.strip()
+        # a handful of spellings keeps the lookup on the partial (state, city) index of rows not deleted
+        statement = text(
+            f'SELECT id, name, city, state FROM {table} WHERE state = :state AND city IN :cities AND deleted_at IS NULL'
+        ).bindparams(bindparam('cities', expanding=True))
+        cities = sorted({city, city.lower(), city.title(), city.upper()})
+        rows = [row for row in self.db.session.execute(statement, {'state': state, 'cities': cities})
+                if row[0] != exclude]
+        if not rows:
+            return []
+        codes = trigrams([normalize_name(row[1]) for row in rows])
+        scores = similarity(np.repeat(trigrams([normalized]), len(rows), axis=0), codes)
+        matches = [{"id": row[0], "name": row[1], "city": row[2], "state": row[3], "score": round(float(score), 3)}
+                   for row, score in zip(rows, scores) if score >= self.threshold]
+        return sorted(matches, key=lambda match: -match["score"])[:limit]
+
+    # Batch report
+
+    def _load(self, table):
+        # rows just merged may not have reached a replica yet, so read the primary
+        with self.db.engine.connect() as connection:
+            return connection.execute(text(
+                f'SELECT id, name, city, state FROM {table} WHERE deleted_at IS NULL ORDER BY id')).fetchall()
+
+    def clusters(self, table, threshold=None):
+        """Groups of likely duplicates; each lists the row to keep (most shows) first.
+
+        Every other row of a group is at least ``threshold`` similar to the one kept.
+        """
+        threshold = self.threshold if threshold is None else threshold
+        rows = self._load(table)
+        names = [normalize_name(row[1]) for row in rows]
+        codes = trigrams(names)
+        block_codes, blocks, members = {}, [], []
+        for position, (row, name) in enumerate(zip(rows, names)):
+            place = normalize_place(row[2], row[3])
+            for token in blocking_tokens(name):
+                blocks.append(block_codes.setdefault((place, token), len(block_codes)))
+                members.append(position)
+        pairs = candidate_pairs(np.array(blocks, dtype=np.int64), np.array(members, dtype=np.int64), self.max_block)
+        signature = signatures(codes)
+        pairs = pairs[estimated_similarity(signature[pairs[:, 0]], signature[pairs[:, 1]])
+                      >= threshold - SIGNATURE_MARGIN]
+        scores = similarity(codes[pairs[:, 0]], codes[pairs[:, 1]])
+        groups = DisjointSet()
+        for left, right in pairs[scores >= threshold]:
+            groups.union(int(left), int(right))
+
+        found = groups.groups()
+        show_counts = self._show_counts(table, [rows[position][0] for group in found for position in group])
+        clusters = []
+        for group in found:
+            group.sort(key=lambda position: (-show_counts.get(rows[position][0], 0), rows[position][0]))
+            keep = group[0]
+            scores = similarity(np.repeat(codes[[keep]], len(group), axis=0), codes[group])
+            # pairs chain up (A~B, B~C) even when A and C differ; only rows close to the kept one belong with it
+            close = scores >= threshold
+            close[0] = True
+            if close.sum() < 2:
+                continue
+            group, scores = [position for position, near in zip(group, close) if near], scores[close]
+            clusters.append([{
+                "id": rows[position][0],
+                "name": rows[position][1],
+                "city": rows[position][2],
+                "state": rows[position][3],
+                "shows": show_counts.get(rows[position][0], 0),
+                "score": round(float(score), 3),
+            } for position, score in zip(group, scores)])
+        return sorted(clusters, key=lambda cluster: (-len(cluster), cluster[0]["id"]))
+
+    def _show_counts(self, table, ids):
+        if not ids:
+            return {}
+        statement = text(
+            f'SELECT {table}_id, count(*) FROM show WHERE {table}_id IN :ids GROUP BY {table}_id'
+        ).bindparams(bindparam('ids', expanding=True))
+        with self.db.engine.connect() as connection:
+            return dict(connection.execute(statement, {'ids': ids}).fetchall())
+
+    # Merging
+
+    def merge(self, table, keep_id, drop_ids):
+        """Fold ``drop_ids`` into ``keep_id``: shows move over, blank fields are filled in, the duplicates go.
+
+        Returns the number of shows moved.
+        """
+        session = self.db.session
+        column = f'{table}_id'
+        drop_ids = sorted(set(drop_ids) - {keep_id})
+        if not drop_ids:
+            return 0
+        ids = [keep_id] + drop_ids
+        connection = session.connection()
+        expanding = (bindparam('ids', expanding=True), bindparam('drop', expanding=True))
+
+        lock = f'SELECT id FROM {table} WHERE id IN :ids AND deleted_at IS NULL ORDER BY id'
+        if connection.dialect.name == 'postgresql':
+            # new shows for the duplicates wait until they are gone (and then fail their foreign key check)
+            lock += ' FOR UPDATE'
+        found = {row[0] for row in connection.execute(text(lock).bindparams(expanding[0]), {'ids': ids})}
+        missing = set(ids) - found
+        if missing:
+            raise ValueError(f'No {table} with id {", ".join(map(str, sorted(missing)))}')
+
+        for name in FILL_COLUMNS[table]:
+            connection.execute(text(
+                f'UPDATE {table} SET {name} = (SELECT d.{name} FROM {table} d WHERE d.id IN :drop '
+                f'AND d.{name} IS NOT NULL ORDER BY d.id LIMIT 1) WHERE id = :keep AND {name} IS NULL'
+            ).bindparams(expanding[1]), {'keep': keep_id, 'drop': drop_ids})
+        moved = [row[0] for row in connection.execute(text(
+            f'SELECT id FROM show WHERE {column} IN :drop UNION ALL SELECT id FROM show_archive WHERE {column} IN :drop'
+        ).bindparams(expanding[1]), {'drop': drop_ids})]
+        for shows_table in ('show', 'show_archive'):
+            connection.execute(text(f'UPDATE {shows_table} SET {column} = :keep WHERE {column} IN :drop').bindparams(
+                expanding[1]), {'keep': keep_id, 'drop': drop_ids})
+        # marked before the statement, like every deletion
+        self.changes.mark(session, table, 'deleted', drop_ids)
+        connection.execute(text(f'DELETE FROM {table} WHERE id IN :drop').bindparams(expanding[1]), {'drop': drop_ids})
+
+        self.changes.mark(session, 'show', 'updated', moved, show_parents={(table, entity_id) for entity_id in ids})
+        self.changes.mark(session, table, 'updated', [keep_id])
+        session.commit()
+        return len(moved)
+
+    def _command_group(self):
+        dedup_group = AppGroup('dedup', help='Find and merge duplicate venues and artists.')
+
+        @dedup_group.command('report')
+        @click.argument('table', type=click.Choice(TABLES))
+        @click.option('--threshold', type=float, default=None, help='Similarity from 0 to 1 (DEDUP_THRESHOLD).')
+        @click.option('--json', 'as_json', is_flag=True, help='Print the clusters as JSON.')
+        def report(table, threshold, as_json):
+            """List groups of likely duplicates, the row to keep first."""
+            clusters = self.clusters(table, threshold)
+            if as_json:
+                click.echo(json.dumps(clusters, indent=2))
+                return
+            for cluster in clusters:
+                keep = cluster[0]
+                click.echo(f'#{keep["id"]} {keep["name"]} ({keep["city"]}, {keep["state"]}), {keep["shows"]} shows')
+                for duplicate in cluster[1:]:
+                    click.echo(f'    #{duplicate["id"]} {duplicate["name"]}, {duplicate["shows"]} shows, '
+                               f'similarity {duplicate["score"]}')
+            click.echo(f'{len(clusters)} groups of duplicate {table}s')
+
+        @dedup_group.command('merge')
+        @click.argument('table', type=click.Choice(TABLES))
+        @click.argument('keep', type=int, required=False)
+        @click.argument('duplicates', type=int, nargs=-1)
+        @click.option('--all', 'merge_all', is_flag=True, help='Merge every group `flask dedup report` lists.')
+        @click.option('--threshold', type=float, default=None, help='Similarity from 0 to 1, with --all.')
+        def merge(table, keep, duplicates, merge_all, threshold):
+            """Merge DUPLICATES into KEEP, moving their shows over."""
+            if merge_all:
+                groups = [(cluster[0]["id"], [row["id"] for row in cluster[1:]])
+                          for cluster in self.clusters(table, threshold)]
+            elif keep is not None and duplicates:
+                groups = [(keep, list(duplicates))]
+            else:
+                raise click.UsageError('Give KEEP and DUPLICATES ids, or --all.')
+            for keep_id, drop_ids in groups:
+                try:
+                    moved = self.merge(table, keep_id, drop_ids)
+                except ValueError as error:
+                    raise click.ClickException(str(error))
+                click.echo(f'merged {table} {", ".join(map(str, drop_ids))} into {keep_id}, moved {moved} shows')
+
+        return dedup_group
@@ -0,0 +1,134 @@
+"""Deleting venues and artists together with their shows.
+
+A venue or artist goes with a handful of set-based statements however many
+shows it has: nothing is loaded into the session, and the shows are reported
+to the change tracker by id (``changes.mark``), so rollups, caches and change
+events follow. ``DELETE_MODE`` picks what happens to the row:
+
+* ``'cascade'`` deletes it and its shows, archived ones included; they no
+  longer count in /stats.
+* ``'soft'`` sets ``deleted_at`` instead and moves its shows to
+  ``show_archive``, where they keep counting in /stats like any old show.
+  Listings, searches and the derived indexes skip rows with ``deleted_at``
+  set, through partial indexes over the rest. ``flask delete purge`` removes
+  soft-deleted rows for good once they are ``DELETE_PURGE_AFTER_DAYS`` old.
+
+The foreign keys have no ``ON DELETE CASCADE``: shows the database deleted on
+its own would never reach the change tracker.
+"""
+from datetime import datetime, timedelta
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import bindparam, text
+
+TABLES = ('venue', 'artist')
+MODES = ('cascade', 'soft')
+SHOW_TABLES = ('show', 'show_archive')
+
+
+def show_parents(shows):
+    """(table, id) of the venues and artists of ``shows`` rows (id, venue_id, artist_id)."""
+    return {(table, row[position]) for row in shows for position, table in ((1, 'venue'), (2, 'artist'))}
+
+
+class Deleter(object):
+    """Configuration:
+
+    * ``DELETE_MODE`` -- ``'cascade'`` or ``'soft'``
+    * ``DELETE_PURGE_AFTER_DAYS`` -- age from which ``flask delete purge`` removes soft-deleted rows
+    """
+
+    def __init__(self, app=None, db=None, changes=None):
+        self.db = db
+        self.changes = changes
+        self.mode = 'cascade'
+        self.purge_after = 30
+        if app is not None:
+            self.init_app(app, db, changes)
+
+    def init_app(self, app, db, changes):
+        self.db = db
+        self.changes = changes
+        self.mode = app.config.setdefault('DELETE_MODE', 'cascade')
+        if self.mode not in MODES:
+            raise ValueError(f'DELETE_MODE must be one of {", ".join(MODES)}, not {self.mode!r}')
+        self.purge_after = app.config.setdefault('DELETE_PURGE_AFTER_DAYS', 30)
+        app.cli.add_command(self._command_group())
+
+    def delete(self, table, entity_id):
+        """Delete a venue or artist the configured way and commit; returns its name, None if there is none."""
+        session = self.db.session
+        connection = session.connection()
+        lookup = f'SELECT name FROM {table} WHERE id = :id AND deleted_at IS NULL'
+        if connection.dialect.name == 'postgresql':
+            # shows being added for it wait until it is gone (and then fail their foreign key check)
+            lookup += ' FOR UPDATE'
+        name = connection.execute(text(lookup), {'id': entity_id}).scalar()
+        if name is None:
+            return None
+        if self.mode == 'soft':
+            self._archive(session, table, [entity_id])
+        else:
+            self._cascade(session, table, [entity_id])
+        session.commit()
+        return name
+
+    def _shows(self, connection, table, ids, show_tables=SHOW_TABLES):
+        query = ' UNION ALL '.join(f'SELECT id, venue_id, artist_id FROM {shows} WHERE {table}_id IN :ids'
+                                   for shows in show_tables)
+        return connection.execute(text(query).bindparams(bindparam('ids', expanding=True)), {'ids': ids}).fetchall()
+
+    def _cascade(self, session, table, ids):
+        connection = session.connection()
+        shows = self._shows(connection, table, ids)
+        # marked before the rows go, so flush listeners (the rollups) can still read them
+        self.changes.mark(session, 'show', 'deleted', [row[0] for row in shows], show_parents=show_parents(shows))
+        self.changes.mark(session, table, 'deleted', ids)
+        for statement in [f'DELETE FROM {shows} WHERE {table}_id IN :ids' for shows in SHOW_TABLES] + [
+                f'DELETE FROM {table} WHERE id IN :ids']:
+            connection.execute(text(statement).bindparams(bindparam('ids', expanding=True)), {'ids': ids})
+        return len(shows)
+
+    def _archive(self, session, table, ids):
+        connection = session.connection()
+        shows = self._shows(connection, table, ids, ('show',))
+        for statement in (
+                'INSERT INTO show_archive (id, venue_id, artist_id, start_time) '
+                f'SELECT id, venue_id, artist_id, start_time FROM show WHERE {table}_id IN :ids',
+                f'DELETE FROM show WHERE {table}_id IN :ids',
+                f'UPDATE {table} SET deleted_at = :now WHERE id IN :ids'):
+            connection.execute(text(statement).bindparams(bindparam('ids', expanding=True)),
+                               {'ids': ids, 'now': datetime.utcnow()})
+        # archived shows still count in /stats under the same keys, so for the tracker they changed rather
+        # than went away, and the rollups leave them alone
+        self.changes.mark(session, 'show', 'updated', [row[0] for row in shows], show_parents=show_parents(shows),
+                          archived=True)
+        self.changes.mark(session, table, 'deleted', ids)
+        return len(shows)
+
+    def purge(self, table, older_than_days=None, batch_size=500):
+        """Delete rows soft-deleted more than ``older_than_days`` ago, with their shows; returns how many."""
+        days = self.purge_after if older_than_days is None else older_than_days
+        session = self.db.session
+        ids = [row[0] for row in session.execute(text(
+            f'SELECT id FROM {table} WHERE deleted_at < :cutoff ORDER BY id'
+        ), {'cutoff': datetime.utcnow() - timedelta(days=days)})]
+        for start in range(0, len(ids), batch_size):
+            # one transaction per batch keeps locks and the tracked change sets small
+            self._cascade(session, table, ids[start:start + batch_size])
+            session.commit()
+        return len(ids)
+
+    def _command_group(self):
+        delete_group = AppGroup('delete', help='Clean up deleted venues and artists.')
+
+        @delete_group.command('purge')
+        @click.argument('table', type=click.Choice(TABLES))
+        @click.option('--older-than', type=int, default=None,
+                      help='Days since the soft delete (DELETE_PURGE_AFTER_DAYS).')
+        def purge(table, older_than):
+            """Remove soft-deleted rows of TABLE and their archived shows for good."""
+            click.echo(f'purged {self.purge(table, older_than)} {table}s')
+
+        return delete_group
@@ -0,0 +1,157 @@
+"""Read-through cache in front of primary-key lookups of venues and artists.
+
+Column values are cached per process in an LRU with a TTL. A hit is turned
+back into a persistent instance of the request's session without touching
+the database (``make_transient_to_detached`` + ``merge(load=False)``), so
+relationships work as on a freshly loaded row. Commits in this process evict
+the rows they changed; changes made by other processes are picked up once
+``ENTITY_CACHE_SECONDS`` have passed. Misses are read through the request's
+session, so they go to a replica where the request would; rows this process
+committed within the last ``SQLALCHEMY_REPLICA_STICKY_SECONDS`` are read from
+the primary instead, so a lagging replica cannot put the old row back. The
+cache is for reads only: a cached copy may predate another worker's commit,
+so edits load the row itself.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import inspect
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
+
+CACHED_TABLES = ('venue', 'artist')
+
+
+class CacheStats(object):
+    __slots__ = ('hits', 'misses', 'evictions', 'invalidations')
+
+    def __init__(self):
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    def as_dict(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+        }
+
+
+class EntityCache(object):
+    """Configuration:
+
+    * ``ENTITY_CACHE_ENABLED``
+    * ``ENTITY_CACHE_SIZE`` -- rows kept across venues and artists
+    * ``ENTITY_CACHE_SECONDS`` -- upper bound on the age of a cached row
+    """
+
+    def __init__(self, app=None, db=None, changes=None):
+        self.db = db
+        self.enabled = True
+        self.size = 10000
+        self.ttl = 60
+        self.primary_seconds = 5
+        self._rows = OrderedDict()
+        # (table, id) -> until when misses for a row this process just committed read the primary
+        self._written = {}
+        self._generations = {table: 0 for table in CACHED_TABLES}
+        self._stats = {table: CacheStats() for table in CACHED_TABLES}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app, db, changes)
+
+    def init_app(self, app, db, changes):
+        self.db = db
+        self.enabled = app.config.setdefault('ENTITY_CACHE_ENABLED', True)
+        self.size = app.config.setdefault('ENTITY_CACHE_SIZE', 10000)
+        self.ttl = app.config.setdefault('ENTITY_CACHE_SECONDS', 60)
+        self.primary_seconds = app.config.get('SQLALCHEMY_REPLICA_STICKY_SECONDS', 5)
+        changes.on_commit(self._on_commit)
+
+    def _on_commit(self, changes):
+        now = time.time()
+        with self._lock:
+            self._written = {key: until for key, until in self._written.items() if until > now}
+            for table in CACHED_TABLES:
+                ids = changes.ids(table)
+                if not ids:
+                    continue
+                # loads that started before this commit must not store what they read
+                self._generations[table] += 1
+                for entity_id in ids:
+                    self._written[(table, entity_id)] = now + self.primary_seconds
+                    if self._rows.pop((table, entity_id), None) is not None:
+                        self._stats[table].invalidations += 1
+
+    def _lookup(self, table, entity_id):
+        """(values, None) on a hit; on a miss (None, generation, whether to read the primary)."""
+        key = (table, entity_id)
+        with self._lock:
+            entry = self._rows.get(key)
+            if entry is not None and entry[1] > time.time():
+                self._rows.move_to_end(key)
+                self._stats[table].hits += 1
+                return entry[0], None, False
+            if entry is not None:
+                del self._rows[key]
+            self._stats[table].misses += 1
+            return None, self._generations[table], self._written.get(key, 0) > time.time()
+
+    def _store(self, table, entity_id, values, generation):
+        with self._lock:
+            if self._generations[table] != generation:
+                return
+            self._rows[(table, entity_id)] = (values, time.time() + self.ttl)
+            while len(self._rows) > self.size:
+                (evicted_table, _), _ = self._rows.popitem(last=False)
+                self._stats[evicted_table].evictions += 1
+
+    def _load(self, mapper, entity_id, primary=False):
+        statement = mapper.local_table.select().where(mapper.primary_key[0] == entity_id)
+        if primary:
+            with self.db.engine.connect() as connection:
+                row = connection.execute(statement).first()
+        else:
+            row = self.db.session.execute(statement, mapper=mapper).first()
+        if row is None:
+            return None
+        return {prop.key: row[prop.columns[0]] for prop in mapper.column_attrs}
+
+    def get(self, model, entity_id):
+        """``model.query.get(entity_id)``, served from the cache when possible."""
+        session = self.db.session
+        if not self.enabled:
+            return session.query(model).get(entity_id)
+        mapper = inspect(model)
+        table = mapper.local_table.name
+        entity_id = int(entity_id)
+        instance = session.identity_map.get(mapper.identity_key_from_primary_key((entity_id,)))
+        if instance is not None:
+            return instance
+
+        values, generation, primary = self._lookup(table, entity_id)
+        if values is None:
+            values = self._load(mapper, entity_id, primary)
+            if values is None:
+                return None
+            self._store(table, entity_id, values, generation)
+
+        instance = mapper.class_manager.new_instance()
+        for key, value in values.items():
+            # copy mutable values (the genres list) so edits never reach the cached row
+            set_committed_value(instance, key, list(value) if isinstance(value, list) else value)
+        make_transient_to_detached(instance)
+        return session.merge(instance, load=False)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "size": len(self._rows),
+                "capacity": self.size,
+                "ttl_seconds": self.ttl,
+                "tables": {table: stats.as_dict() for table, stats in self._stats.items()},
+            }
@@ -0,0 +1,227 @@
+"""iCalendar and JSON feeds of upcoming shows per venue and artist.
+
+Feeds are cached per process with a strong ETag. A new show for a cached
+entity is spliced into the existing feed, only the new event is queried and
+rendered; edits to a show, venue or artist in the feed drop the entry. Cached
+feeds also expire when their first show starts and after ``FEED_CACHE_SECONDS``
+so other processes pick up changes they were not told about. Event links point
+at ``FEED_BASE_URL``; without it they use the request's host, which is then
+part of the cache key, so a forged ``Host`` header only ever sees its own feed.
+"""
+import bisect
+import copy
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from sqlalchemy import DateTime, bindparam, text
+
+SHOW_QUERY = (
+    'SELECT show.id, show.start_time, venue.id, venue.name, venue.address, venue.city, venue.state, '
+    'artist.id, artist.name '
+    'FROM show JOIN venue ON venue.id = show.venue_id JOIN artist ON artist.id = show.artist_id '
+)
+
+
+def ics_escape(value):
+    return (value or '').replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+
+
+def ics_fold(line):
+    """Fold a content line to 75 octets as RFC 5545 requires."""
+    encoded = line.encode('utf-8')
+    if len(encoded) <= 75:
+        return line + '\r\n'
+    parts = []
+    while encoded:
+        limit = 75 if not parts else 74
+        cut = min(limit, len(encoded))
+        # never split a multi-byte character
+        while cut < len(encoded) and encoded[cut] & 0xC0 == 0x80:
+            cut -= 1
+        parts.append(encoded[:cut].decode('utf-8'))
+        encoded = encoded[cut:]
+    return '\r\n '.join(parts) + '\r\n'
+
+
+class FeedEvent(object):
+    __slots__ = ('show_id', 'start_time', 'venue_id', 'artist_id', 'ics', 'data')
+
+    def __init__(self, row, base_url):
+        show_id, start_time, venue_id, venue_name, address, city, state, artist_id, artist_name = row
+        self.show_id = show_id
+        self.start_time = start_time
+        self.venue_id = venue_id
+        self.artist_id = artist_id
+        location = ', '.join(part for part in (address, city, state) if part)
+        stamp = start_time.strftime('%Y%m%dT%H%M%S')
+        self.ics = ''.join(ics_fold(line) for line in (
+            'BEGIN:VEVENT',
+            f'UID:show-{show_id}@fyyur',
+            # derived from the show rather than the build time so rebuilt feeds keep their ETag
+            f'DTSTAMP:{stamp}Z',
+            f'DTSTART:{stamp}',
+            'DURATION:PT3H',
+            f'SUMMARY:{ics_escape(artist_name)} at {ics_escape(venue_name)}',
+            f'LOCATION:{ics_escape(location)}',
+            f'URL:{base_url}venues/{venue_id}',
+            'END:VEVENT',
+        ))
+        self.data = {
+            "show_id": show_id,
+            "venue_id": venue_id,
+            "venue_name": venue_name,
+            "artist_id": artist_id,
+            "artist_name": artist_name,
+            "start_time": str(start_time),
+        }
+
+    def sort_key(self):
+        return self.start_time, self.show_id
+
+
+class Feed(object):
+    def __init__(self, kind, entity_id, name, events, ttl):
+        self.kind = kind
+        self.entity_id = entity_id
+        self.name = name
+        self.events = sorted(events, key=FeedEvent.sort_key)
+        self.pending_show_ids = set()
+        self.expires_at = time.time() + ttl
+        self._render()
+
+    def _render(self):
+        self.ics = ''.join([
+            ics_fold('BEGIN:VCALENDAR'),
+            ics_fold('VERSION:2.0'),
+            ics_fold('PRODID:-//Fyyur//Upcoming shows//EN'),
+            ics_fold(f'X-WR-CALNAME:{ics_escape(self.name)}'),
+        ] + [event.ics for event in self.events] + [ics_fold('END:VCALENDAR')])
+        self.json = json.dumps({
+            self.kind: {"id": self.entity_id, "name": self.name},
+            "upcoming_shows": [event.data for event in self.events],
+        })
+        self.ics_etag = hashlib.sha1(self.ics.encode('utf-8')).hexdigest()
+        self.json_etag = hashlib.sha1(self.json.encode('utf-8')).hexdigest()
+
+    def added(self, events):
+        """A copy with ``events`` spliced in; a feed that may be being served is never changed."""
+        feed = copy.copy(self)
+        feed.events = list(self.events)
+        keys = [event.sort_key() for event in feed.events]
+        for event in events:
+            position = bisect.bisect(keys, event.sort_key())
+            keys.insert(position, event.sort_key())
+            feed.events.insert(position, event)
+        feed._render()
+        return feed
+
+    def counterpart_ids(self):
+        column = 'artist_id' if self.kind == 'venue' else 'venue_id'
+        return {getattr(event, column) for event in self.events}
+
+    def is_fresh(self, now):
+        return time.time() < self.expires_at and (not self.events or self.events[0].start_time >= now)
+
+
+class ShowFeeds(object):
+    """Per-process LRU cache of upcoming-show feeds.
+
+    Configuration:
+
+    * ``FEED_CACHE_SIZE`` -- number of feeds kept
+    * ``FEED_CACHE_SECONDS`` -- upper bound on the age of a cached feed
+    * ``FEED_BASE_URL`` -- site root for the links in feeds, e.g. ``https://fyyur.example/``
+    """
+
+    def __init__(self, app=None, db=None, changes=None):
+        self.db = db
+        self.size = 1000
+        self.ttl = 300
+        self.base_url = None
+        self._feeds = OrderedDict()
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app, db, changes)
+
+    def init_app(self, app, db, changes):
+        self.db = db
+        self.size = app.config.setdefault('FEED_CACHE_SIZE', 1000)
+        self.ttl = app.config.setdefault('FEED_CACHE_SECONDS', 300)
+        self.base_url = app.config.setdefault('FEED_BASE_URL', None)
+        changes.on_commit(self._on_commit)
+
+    def _on_commit(self, changes):
+        created = changes.created['show']
+        edited_shows = changes.updated['show'] | changes.deleted['show']
+        with self._lock:
+            for key, feed in list(self._feeds.items()):
+                kind, entity_id, _ = key
+                counterpart = 'artist' if kind == 'venue' else 'venue'
+                if (entity_id in changes.ids(kind)
+                        or feed.counterpart_ids() & changes.ids(counterpart)
+                        or any(event.show_id in edited_shows for event in feed.events)
+                        or (edited_shows and entity_id in changes.parents(kind))):
+                    del self._feeds[key]
+                elif created and entity_id in changes.parents(kind):
+                    # shows are only spliced in on the next request, outside the write path
+                    feed.pending_show_ids.update(created)
+
+    def _load(self, kind, entity_id, now, base_url):
+        # Read the primary: the feed is cached until a commit drops it, so one built from a lagging
+        # replica would miss already-committed shows until it expires.
+        with self.db.engine.connect() as connection:
+            name = connection.execute(text(f'SELECT name FROM {kind} WHERE id = :id AND deleted_at IS NULL'),
+                                      {'id': entity_id}).scalar()
+            if name is None:
+                return None
+            rows = connection.execute(text(
+                SHOW_QUERY + f'WHERE show.{kind}_id = :id AND show.start_time >= :now ORDER BY show.start_time'
+            ).columns(start_time=DateTime), {'id': entity_id, 'now': now}).fetchall()
+        return Feed(kind, entity_id, name, [FeedEvent(row, base_url) for row in rows], self.ttl)
+
+    def _apply_pending(self, key, feed, pending, now, base_url):
+        statement = text(
+            SHOW_QUERY + f'WHERE show.id IN :ids AND show.{feed.kind}_id = :id AND show.start_time >= :now'
+        ).bindparams(bindparam('ids', expanding=True)).columns(start_time=DateTime)
+        # the shows were just written; a replica may not have them yet
+        with self.db.engine.connect() as connection:
+            rows = connection.execute(statement, {'ids': sorted(pending), 'id': feed.entity_id,
+                                                  'now': now}).fetchall()
+        updated = feed.added([FeedEvent(row, base_url) for row in rows])
+        with self._lock:
+            # unless a commit dropped or another request replaced the feed meanwhile
+            if self._feeds.get(key) is feed:
+                updated.pending_show_ids = feed.pending_show_ids - pending
+                self._feeds[key] = updated
+        return updated
+
+    def get(self, kind, entity_id, base_url):
+        """Return the cached ``Feed`` for a venue or artist, building it if needed.
+
+        ``base_url`` (the request's root) is only used without ``FEED_BASE_URL``.
+        """
+        now = datetime.now()
+        base_url = self.base_url or base_url
+        key = (kind, entity_id, base_url)
+        with self._lock:
+            feed = self._feeds.get(key)
+            pending = None
+            if feed is not None and feed.is_fresh(now):
+                self._feeds.move_to_end(key)
+                pending = set(feed.pending_show_ids)
+                if not pending:
+                    return feed
+        if pending:
+            # queried outside the lock, so a slow query does not hold up every other feed
+            return self._apply_pending(key, feed, pending, now, base_url)
+        feed = self._load(kind, entity_id, now, base_url)
+        if feed is not None:
+            with self._lock:
+                self._feeds[key] = feed
+                while len(self._feeds) > self.size:
+                    self._feeds.popitem(last=False)
+        return feed
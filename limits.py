@@ -0,0 +1,288 @@
+"""Admission control: per-client rate limits, a concurrency cap and load shedding.
+
+Every request is put in a route class ('search', 'listing', 'detail' or
+'write') and charged against a token bucket keyed by client and class. Bucket
+state lives in a store shared by all worker processes on the host (an SQLite
+file, by default in /dev/shm) or, with ``RATE_LIMIT_STORE = 'memory'``, in the
+process itself. Admitted requests then pass a concurrency gate with a bounded
+wait queue, and reads are shed with 503 while database latency is high. The
+gate and the latency average are per worker process, not per host.
+"""
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from flask import Response, g, request
+
+from timing import statement_timer
+
+ROUTE_CLASSES = ('search', 'listing', 'detail', 'write')
+# how often each process drops buckets that have been idle long enough to be full again
+PURGE_SECONDS = 60
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryStore(object):
+    """Token buckets held in this process; a stand-in for the shared store.
+
+    Buckets untouched for ``idle_after`` seconds are full again, the same as
+    missing ones, and are dropped every ``PURGE_SECONDS``.
+    """
+
+    def __init__(self, idle_after):
+        self.idle_after = idle_after
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._purged_at = time.time()
+
+    def take(self, key, rate, burst, now):
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            if now - self._purged_at > PURGE_SECONDS:
+                self._purged_at = now
+                self._buckets = {key: bucket for key, bucket in self._buckets.items()
+                                 if now - bucket[1] < self.idle_after}
+        return allowed, 0 if allowed else (1 - tokens) / rate
+
+
+class SQLiteStore(object):
+    """Token buckets in an SQLite file shared by every worker on the host.
+
+    A request that cannot get the file lock within a second is let through
+    (fail open) rather than answered with a 500. Idle buckets are deleted as
+    in ``MemoryStore``.
+    """
+
+    def __init__(self, path, idle_after):
+        self.path = path
+        self.idle_after = idle_after
+        self._local = threading.local()
+        self._purged_at = time.time()
+        self._connection().execute(
+            'CREATE TABLE IF NOT EXISTS bucket (key TEXT PRIMARY KEY, tokens REAL, updated REAL)'
+        )
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._local.connection = sqlite3.connect(self.path, timeout=1, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=OFF')
+        return connection
+
+    def take(self, key, rate, burst, now):
+        connection = self._connection()
+        try:
+            connection.execute('BEGIN IMMEDIATE')
+        except sqlite3.OperationalError:
+            logger.warning('rate limit store busy, admitting %s', key, exc_info=True)
+            return True, 0
+        try:
+            row = connection.execute('SELECT tokens, updated FROM bucket WHERE key = ?', (key,)).fetchone()
+            tokens, updated = row if row else (burst, now)
+            tokens = min(burst, tokens + (now - updated) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            connection.execute('INSERT OR REPLACE INTO bucket (key, tokens, updated) VALUES (?, ?, ?)',
+                               (key, tokens, now))
+            if now - self._purged_at > PURGE_SECONDS:
+                self._purged_at = now
+                connection.execute('DELETE FROM bucket WHERE updated < ?', (now - self.idle_after,))
+            connection.execute('COMMIT')
+        except sqlite3.OperationalError:
+            connection.execute('ROLLBACK')
+            logger.warning('rate limit store failed, admitting %s', key, exc_info=True)
+            return True, 0
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        return allowed, 0 if allowed else (1 - tokens) / rate
+
+
+def make_store(url, idle_after):
+    if url == 'memory':
+        return MemoryStore(idle_after)
+    if url.startswith('sqlite:///'):
+        return SQLiteStore(url[len('sqlite:///'):], idle_after)
+    raise ValueError(f'Unsupported RATE_LIMIT_STORE {url!r}')
+
+
+def default_store_url():
+    directory = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return 'sqlite:///' + os.path.join(directory, 'fyyur-rate-limits.db')
+
+
+class ConcurrencyGate(object):
+    """Caps requests in flight; up to ``max_queued`` more wait ``timeout`` seconds for a slot.
+
+    The counts live in the process, so each worker has its own cap: a host
+    admits up to ``max_active`` times the number of workers.
+    """
+
+    def __init__(self, max_active, max_queued, timeout):
+        self.max_active = max_active
+        self.max_queued = max_queued
+        self.timeout = timeout
+        self.active = 0
+        self.queued = 0
+        self._condition = threading.Condition()
+
+    def enter(self):
+        with self._condition:
+            if self.active < self.max_active:
+                self.active += 1
+                return True
+            if self.queued >= self.max_queued:
+                return False
+            self.queued += 1
+            try:
+                admitted = self._condition.wait_for(lambda: self.active < self.max_active, self.timeout)
+                if admitted:
+                    self.active += 1
+                return admitted
+            finally:
+                self.queued -= 1
+
+    def leave(self):
+        with self._condition:
+            self.active -= 1
+            self._condition.notify()
+
+
+class LatencyMonitor(object):
+    """Exponentially weighted moving average of statement latency across all engines.
+
+    The average decays with a ``half_life`` while no statements run, so shedding
+    every read cannot keep the process shedding forever.
+    """
+
+    def __init__(self, alpha=0.2, half_life=5.0):
+        self.alpha = alpha
+        self.half_life = half_life
+        self.average_ms = 0.0
+        self.sampled_at = time.time()
+
+    def install(self):
+        statement_timer.subscribe(self._sample)
+
+    def _sample(self, conn, statement, parameters, executemany, elapsed_ms):
+        self.average_ms = self.current_ms() * (1 - self.alpha) + elapsed_ms * self.alpha
+        self.sampled_at = time.time()
+
+    def current_ms(self):
+        return self.average_ms * 0.5 ** ((time.time() - self.sampled_at) / self.half_life)
+
+
+class Limiter(object):
+    """Configuration:
+
+    * ``RATE_LIMITS_ENABLED``
+    * ``RATE_LIMITS`` -- ``{route_class: (tokens_per_second, burst)}``
+    * ``RATE_LIMIT_STORE`` -- ``'memory'`` or ``'sqlite:///path'`` shared by the workers
+    * ``RATE_LIMIT_PROXY_HOPS`` -- trusted proxies in front of the app, each appending to ``X-Forwarded-For``
+    * ``MAX_CONCURRENT_REQUESTS``, ``MAX_QUEUED_REQUESTS``, ``QUEUE_TIMEOUT_SECONDS``
+    * ``SHED_DB_LATENCY_MS`` -- shed ``SHED_ROUTE_CLASSES`` while statements average more than this
+    """
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self.limits = {}
+        self.store = None
+        self.proxy_hops = 0
+        self.gate = None
+        self.latency = LatencyMonitor()
+        self.shed_latency_ms = None
+        self.shed_classes = ()
+        self._classes = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        config = app.config
+        config.setdefault('RATE_LIMITS_ENABLED', True)
+        config.setdefault('RATE_LIMITS', {'search': (1, 5), 'listing': (5, 20), 'detail': (10, 40),
+                                          'write': (0.5, 10)})
+        config.setdefault('RATE_LIMIT_STORE', default_store_url())
+        config.setdefault('RATE_LIMIT_PROXY_HOPS', 0)
+        config.setdefault('MAX_CONCURRENT_REQUESTS', 32)
+        config.setdefault('MAX_QUEUED_REQUESTS', 64)
+        config.setdefault('QUEUE_TIMEOUT_SECONDS', 2)
+        config.setdefault('SHED_DB_LATENCY_MS', 250)
+        config.setdefault('SHED_ROUTE_CLASSES', ('search', 'listing', 'detail'))
+        self.enabled = config['RATE_LIMITS_ENABLED']
+        if not self.enabled:
+            return
+        self.limits = config['RATE_LIMITS']
+        # a bucket untouched this long has refilled to its burst and can go
+        idle_after = max([burst / rate for rate, burst in self.limits.values() if rate] or [0])
+        self.store = make_store(config['RATE_LIMIT_STORE'], idle_after)
+        self.proxy_hops = config['RATE_LIMIT_PROXY_HOPS']
+        self.gate = ConcurrencyGate(config['MAX_CONCURRENT_REQUESTS'], config['MAX_QUEUED_REQUESTS'],
+                                    config['QUEUE_TIMEOUT_SECONDS'])
+        self.shed_latency_ms = config['SHED_DB_LATENCY_MS']
+        self.shed_classes = frozenset(config['SHED_ROUTE_CLASSES'])
+        self.latency.install()
+        app.before_request(self._admit)
+        app.teardown_request(self._release)
+
+    def route_class(self, name):
+        """Decorator putting a view in a route class other than the default ('detail' or 'write')."""
+        if name not in ROUTE_CLASSES:
+            raise ValueError(f'Unknown route class {name!r}')
+
+        def decorator(view):
+            self._classes[view.__name__] = name
+            return view
+        return decorator
+
+    def classify(self):
+        name = self._classes.get(request.endpoint)
+        if name is None:
+            name = 'detail' if request.method in ('GET', 'HEAD', 'OPTIONS') else 'write'
+        return name
+
+    def client_key(self):
+        """The address buckets are keyed by: the peer, or the one the outermost trusted proxy saw.
+
+        Like ``werkzeug.middleware.proxy_fix.ProxyFix``, only the last ``RATE_LIMIT_PROXY_HOPS``
+        entries of ``X-Forwarded-For`` are trusted; anything before them is whatever the client sent.
+        """
+        if self.proxy_hops:
+            forwarded = [address.strip() for address in request.headers.get('X-Forwarded-For', '').split(',')]
+            if len(forwarded) >= self.proxy_hops and forwarded[-self.proxy_hops]:
+                return forwarded[-self.proxy_hops]
+        return request.remote_addr
+
+    def _reject(self, status, message, retry_after):
+        return Response(message, status=status, mimetype='text/plain',
+                        headers={'Retry-After': str(max(1, int(retry_after + 0.999)))})
+
+    def _admit(self):
+        if request.endpoint in (None, 'static') or request.environ.get('fyyur.internal'):
+            return None
+        route_class = self.classify()
+        if route_class in self.shed_classes and self.latency.current_ms() > self.shed_latency_ms:
+            return self._reject(503, 'Service temporarily overloaded', self.latency.half_life)
+        rate, burst = self.limits.get(route_class, (None, None))
+        if rate:
+            allowed, retry_after = self.store.take(f'{self.client_key()}:{route_class}', rate, burst, time.time())
+            if not allowed:
+                return self._reject(429, 'Too many requests', retry_after)
+        if not self.gate.enter():
+            return self._reject(503, 'Service temporarily overloaded', self.gate.timeout)
+        g.admitted = True
+        return None
+
+    def _release(self, exception=None):
+        if g.pop('admitted', False):
+            self.gate.leave()
@@ -0,0 +1,196 @@
+"""Structured logging that stays off the request path.
+
+Records are stamped with the request id, route, method and path in the
+request thread, then put on a bounded in-memory queue. A ``QueueListener``
+thread formats them as JSON lines and writes them to stderr or a file, so a
+slow disk never blocks a request; if the queue is full, records
+are dropped and counted instead. Every request logs one ``request`` line with
+status, latency and time spent in database statements. Info-level and lower
+records are sampled per request (``LOG_SAMPLE_RATE``); warnings and errors are
+always kept.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import re
+import sys
+import threading
+import time
+import traceback
+import uuid
+from datetime import datetime
+
+from flask import g, has_request_context, request
+from flask.logging import default_handler
+
+from timing import statement_timer
+
+REQUEST_ID_HEADER = 'X-Request-ID'
+VALID_REQUEST_ID = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+# attributes every LogRecord has; anything else was passed through ``extra``
+STANDARD_ATTRIBUTES = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": datetime.utcfromtimestamp(record.created).isoformat(timespec='milliseconds') + 'Z',
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in STANDARD_ATTRIBUTES and value is not None:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = ''.join(traceback.format_exception(*record.exc_info))
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class RequestContextFilter(logging.Filter):
+    """Adds request fields and drops unsampled info records; runs in the thread that logs."""
+
+    def __init__(self, sample_rate=1.0):
+        super(RequestContextFilter, self).__init__()
+        self.sample_rate = sample_rate
+
+    def filter(self, record):
+        if not has_request_context():
+            return True
+        request_id = g.get('request_id')
+        if record.levelno < logging.WARNING and self.sample_rate < 1.0 and not g.get('log_sampled', True):
+            return False
+        record.request_id = request_id
+        record.route = request.endpoint
+        record.method = request.method
+        record.path = request.path
+        return True
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, log_queue):
+        super(NonBlockingQueueHandler, self).__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # format the exception now, tracebacks cannot cross to the listener thread safely
+        if record.exc_info:
+            record.exc_text = ''.join(traceback.format_exception(*record.exc_info))
+            record.exc_info = None
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class DBTimer(object):
+    """Time spent in cursor executions, summed per thread (the request's thread)."""
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def install(self):
+        statement_timer.subscribe(self._add)
+
+    def reset(self):
+        self._local.total = 0.0
+        self._local.statements = 0
+
+    def _add(self, conn, statement, parameters, executemany, elapsed_ms):
+        self._local.total = getattr(self._local, 'total', 0.0) + elapsed_ms / 1000
+        self._local.statements = getattr(self._local, 'statements', 0) + 1
+
+    def totals(self):
+        return getattr(self._local, 'total', 0.0), getattr(self._local, 'statements', 0)
+
+
+class Logs(object):
+    """Configuration:
+
+    * ``LOG_LEVEL``
+    * ``LOG_FILE`` -- None for stderr; the file is reopened when something else (logrotate) moves it
+    * ``LOG_ROTATE_BYTES`` -- rotate the file in-process at this size, or
+    * ``LOG_ROTATE_WHEN`` -- on a schedule (e.g. ``'midnight'``); both only with a single process
+      writing the file, since each process would rotate it on its own
+    * ``LOG_BACKUP_COUNT``
+    * ``LOG_SAMPLE_RATE`` -- fraction of requests whose info-level records are kept
+    * ``LOG_QUEUE_SIZE`` -- records waiting to be written before new ones are dropped
+    """
+
+    def __init__(self, app=None):
+        self.handler = None
+        self.listener = None
+        self.db_timer = DBTimer()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        config = app.config
+        config.setdefault('LOG_LEVEL', 'INFO')
+        config.setdefault('LOG_FILE', None)
+        config.setdefault('LOG_ROTATE_BYTES', None)
+        config.setdefault('LOG_ROTATE_WHEN', None)
+        config.setdefault('LOG_BACKUP_COUNT', 7)
+        config.setdefault('LOG_SAMPLE_RATE', 1.0)
+        config.setdefault('LOG_QUEUE_SIZE', 10000)
+        self.sample_rate = config['LOG_SAMPLE_RATE']
+
+        if config['LOG_FILE'] is None:
+            output = logging.StreamHandler(sys.stderr)
+        elif config['LOG_ROTATE_WHEN']:
+            output = logging.handlers.TimedRotatingFileHandler(config['LOG_FILE'], when=config['LOG_ROTATE_WHEN'],
+                                                               backupCount=config['LOG_BACKUP_COUNT'], utc=True)
+        elif config['LOG_ROTATE_BYTES']:
+            output = logging.handlers.RotatingFileHandler(config['LOG_FILE'], maxBytes=config['LOG_ROTATE_BYTES'],
+                                                          backupCount=config['LOG_BACKUP_COUNT'])
+        else:
+            output = logging.handlers.WatchedFileHandler(config['LOG_FILE'])
+        output.setFormatter(JSONFormatter())
+
+        self.handler = NonBlockingQueueHandler(queue.Queue(config['LOG_QUEUE_SIZE']))
+        self.handler.addFilter(RequestContextFilter(self.sample_rate))
+        self.listener = logging.handlers.QueueListener(self.handler.queue, output, respect_handler_level=True)
+        self.listener.start()
+        atexit.register(self.listener.stop)
+
+        root = logging.getLogger()
+        root.addHandler(self.handler)
+        root.setLevel(config['LOG_LEVEL'])
+        app.logger.removeHandler(default_handler)
+        app.logger.setLevel(config['LOG_LEVEL'])
+
+        self.db_timer.install()
+        app.before_request(self._start)
+        app.after_request(self._finish)
+
+    def _start(self):
+        request_id = request.headers.get(REQUEST_ID_HEADER, '')
+        g.request_id = request_id if VALID_REQUEST_ID.match(request_id) else uuid.uuid4().hex
+        g.log_sampled = int(uuid.uuid5(uuid.NAMESPACE_OID, g.request_id).hex[:8], 16) < self.sample_rate * 2 ** 32
+        g.request_started = time.perf_counter()
+        self.db_timer.reset()
+
+    def _finish(self, response):
+        if 'request_started' not in g:
+            return response
+        db_seconds, statements = self.db_timer.totals()
+        logging.getLogger('fyyur.request').info('request', extra={
+            "status": response.status_code,
+            "latency_ms": round((time.perf_counter() - g.request_started) * 1000, 2),
+            "db_ms": round(db_seconds * 1000, 2),
+            "db_statements": statements,
+        })
+        response.headers[REQUEST_ID_HEADER] = g.request_id
+        return response
+
+    def stats(self):
+        return {"queued": self.handler.queue.qsize(), "dropped": self.handler.dropped}
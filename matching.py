@@ -0,0 +1,300 @@
+"""Artist/venue matchmaking.
+
+Every venue and artist is a row in a NumPy-backed index: genres as bitsets
+(one bit per genre, packed into uint64 words), interned city/state codes and
+the seeking flag. Ranking one entity against all counterparts is a handful of
+vectorised operations over those arrays plus one query for the shows the two
+sides have already played together. Rows are refreshed incrementally when venues or artists change
+in this process. With ``CATALOG_VERSIONING`` on, writes from other processes show up as a
+``catalog_version`` this process did not write, polled every ``MATCH_POLL_SECONDS``, and the index is
+then loaded again; without it the index is loaded again every ``MATCH_RELOAD_SECONDS``.
+"""
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import bindparam, text
+
+GENRE_WEIGHT = 3.0
+CITY_WEIGHT = 4.0
+STATE_WEIGHT = 1.5
+HISTORY_WEIGHT = 2.0
+SEEKING_WEIGHT = 1.0
+
+# bits set in each byte value, for numpy releases without bitwise_count
+_POPCOUNT = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint8)
+
+
+def popcount(words):
+    """Number of set bits per row of a (rows, words) uint64 array."""
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(words).sum(axis=1, dtype=np.int64)
+    as_bytes = np.ascontiguousarray(words).view(np.uint8).reshape(words.shape[0], -1)
+    return _POPCOUNT[as_bytes].sum(axis=1, dtype=np.int64)
+
+
+class Vocabulary(object):
+    """Interns strings to small integer codes."""
+
+    def __init__(self, initial=()):
+        self.codes = {}
+        self.values = []
+        for value in initial:
+            self.code(value)
+
+    def __len__(self):
+        return len(self.values)
+
+    def code(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+class SideIndex(object):
+    """Columns for one side of the match (all venues or all artists)."""
+
+    def __init__(self, genres, places, words=1, capacity=1024):
+        self.genre_vocabulary = genres
+        self.places = places
+        self.rows = {}
+        self.size = 0
+        self.ids = np.zeros(capacity, dtype=np.int64)
+        self.genres = np.zeros((capacity, words), dtype=np.uint64)
+        self.city = np.full(capacity, -1, dtype=np.int32)
+        self.state = np.full(capacity, -1, dtype=np.int32)
+        self.seeking = np.zeros(capacity, dtype=bool)
+        self.active = np.zeros(capacity, dtype=bool)
+        self.labels = [None] * capacity
+
+    def _grow(self, capacity, words):
+        def resized(column, fill):
+            if column.ndim == 1:
+                grown = np.full(capacity, fill, dtype=column.dtype)
+                grown[:column.shape[0]] = column
+            else:
+                grown = np.full((capacity, words), fill, dtype=column.dtype)
+                grown[:column.shape[0], :column.shape[1]] = column
+            return grown
+
+        self.ids = resized(self.ids, 0)
+        self.genres = resized(self.genres, 0)
+        self.city = resized(self.city, -1)
+        self.state = resized(self.state, -1)
+        self.seeking = resized(self.seeking, False)
+        self.active = resized(self.active, False)
+        self.labels.extend([None] * (capacity - len(self.labels)))
+
+    def genre_bits(self, genres):
+        codes = [self.genre_vocabulary.code(genre) for genre in genres or ()]
+        words = max(self.genres.shape[1], (len(self.genre_vocabulary) + 63) // 64)
+        bits = np.zeros(words, dtype=np.uint64)
+        for code in codes:
+            bits[code // 64] |= np.uint64(1 << (code % 64))
+        return bits
+
+    def upsert(self, entity_id, name, city, state, genres, seeking):
+        bits = self.genre_bits(genres)
+        row = self.rows.get(entity_id)
+        added = row is None
+        if added:
+            row = self.size
+        capacity, words = self.genres.shape
+        if row >= capacity or bits.shape[0] > words:
+            self._grow(capacity * 2 if row >= capacity else capacity, max(words, bits.shape[0]))
+        self.ids[row] = entity_id
+        self.genres[row] = 0
+        self.genres[row, :bits.shape[0]] = bits
+        self.city[row] = self.places.code((city or '').strip().lower() + '|' + (state or ''))
+        self.state[row] = self.places.code(state or '')
+        self.seeking[row] = bool(seeking)
+        self.active[row] = True
+        self.labels[row] = (name, city, state)
+        if added:
+            # counted only once its columns are filled in: rankings read the first ``size`` rows unlocked
+            self.rows[entity_id] = row
+            self.size += 1
+
+    def name(self, entity_id):
+        row = self.rows.get(entity_id)
+        return None if row is None else self.labels[row][0]
+
+    def remove(self, entity_id):
+        row = self.rows.get(entity_id)
+        if row is not None:
+            self.active[row] = False
+
+    def shared_genres(self, row, other_bits):
+        shared = self.genres[row, :other_bits.shape[0]] & other_bits
+        return [genre for code, genre in enumerate(self.genre_vocabulary.values)
+                if code // 64 < shared.shape[0] and int(shared[code // 64]) >> (code % 64) & 1]
+
+
+class MatchIndex(object):
+    """Configuration:
+
+    * ``MATCH_POLL_SECONDS`` -- how often ``catalog_version`` is checked for writes by other processes
+    * ``MATCH_RELOAD_SECONDS`` -- how often the index is loaded again when ``CATALOG_VERSIONING`` is off
+    """
+
+    # soft-deleted rows are left out, and dropped from the index when they change
+    VENUE_QUERY = 'SELECT id, name, city, state, genres, seeking_talent FROM venue WHERE deleted_at IS NULL'
+    ARTIST_QUERY = 'SELECT id, name, city, state, genres, seeking_venue FROM artist WHERE deleted_at IS NULL'
+
+    def __init__(self, app=None, db=None, changes=None, genres=()):
+        self.db = db
+        self.genres = Vocabulary(genres)
+        self.places = Vocabulary()
+        self.venues = None
+        self.artists = None
+        self._dirty = {'venue': set(), 'artist': set()}
+        self._version = None
+        self._polled_at = 0.0
+        self._loaded_at = 0.0
+        self.versioned = False
+        self.poll_seconds = 5
+        self.reload_seconds = 300
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app, db, changes)
+
+    def init_app(self, app, db, changes):
+        self.db = db
+        self.versioned = app.config.setdefault('CATALOG_VERSIONING', app.config.get('CATALOG_SNAPSHOT', False))
+        self.poll_seconds = app.config.setdefault('MATCH_POLL_SECONDS', 5)
+        self.reload_seconds = app.config.setdefault('MATCH_RELOAD_SECONDS', 300)
+        changes.on_commit(self._on_commit)
+
+    def _on_commit(self, changes):
+        with self._lock:
+            self._dirty['venue'].update(changes.ids('venue'))
+            self._dirty['artist'].update(changes.ids('artist'))
+            if changes.version is not None and self._version is not None and changes.version == self._version + 1:
+                # the next version is this process's own write, applied from the dirty ids; any gap is a
+                # write by another process and makes the next poll reload everything
+                self._version = changes.version
+
+    def _current_version(self):
+        if not self.versioned:
+            return None
+        with self.db.engine.connect() as connection:
+            return connection.execute(text('SELECT version FROM catalog_version WHERE id = 1')).scalar()
+
+    def _load(self, side, query, ids=None):
+        # rows just written may not have reached a replica yet, so read the primary
+        with self.db.engine.connect() as connection:
+            if ids is not None:
+                statement = text(query + ' AND id IN :ids').bindparams(bindparam('ids', expanding=True))
+                rows = connection.execute(statement, {'ids': list(ids)}).fetchall()
+                for entity_id in set(ids) - {row[0] for row in rows}:
+                    side.remove(entity_id)
+            else:
+                rows = connection.execute(text(query)).fetchall()
+        for entity_id, name, city, state, genres, seeking in rows:
+            side.upsert(entity_id, name, city, state, genres, seeking)
+
+    def refresh(self):
+        """Bring the index up to date; returns the (venues, artists) sides to read from.
+
+        A reload replaces both sides, so callers hold on to the pair they got back instead of
+        reading ``self.venues`` and ``self.artists`` again.
+        """
+        with self._lock:
+            if self.venues is not None and not self.versioned:
+                if time.time() - self._loaded_at >= self.reload_seconds:
+                    self.venues = self.artists = None
+            elif self.venues is not None and time.time() - self._polled_at >= self.poll_seconds:
+                self._polled_at = time.time()
+                if self._current_version() != self._version:
+                    self.venues = self.artists = None
+            if self.venues is None:
+                # read first: a write landing during the load shows up as a newer version on the next poll
+                self._version = self._current_version()
+                self._polled_at = self._loaded_at = time.time()
+                words = max(1, (len(self.genres) + 63) // 64)
+                self.venues = SideIndex(self.genres, self.places, words)
+                self.artists = SideIndex(self.genres, self.places, words)
+                self._load(self.venues, self.VENUE_QUERY)
+                self._load(self.artists, self.ARTIST_QUERY)
+                self._dirty = {'venue': set(), 'artist': set()}
+                return self.venues, self.artists
+            dirty, self._dirty = self._dirty, {'venue': set(), 'artist': set()}
+            if dirty['venue']:
+                self._load(self.venues, self.VENUE_QUERY, dirty['venue'])
+            if dirty['artist']:
+                self._load(self.artists, self.ARTIST_QUERY, dirty['artist'])
+            return self.venues, self.artists
+
+    def _history(self, column, other_column, entity_id, others):
+        """Past shows played together with each counterpart, aligned with ``others`` rows."""
+        counts = np.zeros(others.ids.shape[0], dtype=np.float64)
+        rows = self.db.session.execute(text(
+            f'SELECT {other_column}, count(*) FROM show WHERE {column} = :id AND start_time < :now '
+            f'GROUP BY {other_column}'
+        ), {'id': entity_id, 'now': datetime.now()})
+        for other_id, count in rows:
+            row = others.rows.get(other_id)
+            if row is not None and row < counts.shape[0]:
+                counts[row] = count
+        return counts
+
+    def _rank(self, own, others, entity_id, history, limit):
+        row = own.rows.get(entity_id)
+        if row is None or not own.active[row]:
+            return None
+        # size first: columns are grown before rows are counted, so each is at least this long
+        size = min(others.size, history.shape[0])
+        bits = own.genres[row]
+        genres = others.genres
+        words = min(bits.shape[0], genres.shape[1])
+        overlap = popcount(genres[:size, :words] & bits[:words])
+        score = (GENRE_WEIGHT * overlap
+                 + CITY_WEIGHT * (others.city[:size] == own.city[row])
+                 + STATE_WEIGHT * (others.state[:size] == own.state[row])
+                 + HISTORY_WEIGHT * np.log1p(history[:size])
+                 + SEEKING_WEIGHT * others.seeking[:size])
+        # only rank counterparts that share something beyond the seeking flag
+        score[~others.active[:size] | (score <= SEEKING_WEIGHT)] = -np.inf
+        limit = min(limit, size)
+        if limit <= 0:
+            return []
+        top = np.argpartition(-score, limit - 1)[:limit]
+        top = top[np.argsort(-score[top], kind='stable')]
+        matches = []
+        for match_row in top:
+            if not np.isfinite(score[match_row]):
+                break
+            name, city, state = others.labels[match_row]
+            matches.append({
+                "id": int(others.ids[match_row]),
+                "name": name,
+                "city": city,
+                "state": state,
+                "shared_genres": others.shared_genres(match_row, bits),
+                "past_shows": int(history[match_row]),
+                "score": round(float(score[match_row]), 2),
+            })
+        return matches
+
+    def venue_name(self, venue_id):
+        venues, _ = self.refresh()
+        return venues.name(venue_id)
+
+    def artist_name(self, artist_id):
+        _, artists = self.refresh()
+        return artists.name(artist_id)
+
+    def artists_for_venue(self, venue_id, limit=20):
+        """Best artist matches for a venue, or None if the venue does not exist."""
+        venues, artists = self.refresh()
+        history = self._history('venue_id', 'artist_id', venue_id, artists)
+        return self._rank(venues, artists, venue_id, history, limit)
+
+    def venues_for_artist(self, artist_id, limit=20):
+        """Best venue matches for an artist, or None if the artist does not exist."""
+        venues, artists = self.refresh()
+        history = self._history('artist_id', 'venue_id', artist_id, venues)
+        return self._rank(artists, venues, artist_id, history, limit)
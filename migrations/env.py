@@ -8,6 +8,8 @@ from sqlalchemy import pool
 
 from alembic import context
 
+import online_migrations
+
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
 config = context.config
@@ -86,10 +88,28 @@ def run_migrations_online():
             **current_app.extensions['migrate'].configure_args
         )
 
+        if online_migrations.is_dry_run():
+            run_dry(connection)
+            return
+
         with context.begin_transaction():
             context.run_migrations()
 
 
+def run_dry(connection):
+    """Run the migrations in a transaction that is rolled back; see online_migrations."""
+    if not context.get_context().impl.transactional_ddl:
+        raise RuntimeError('dry runs need transactional DDL, i.e. PostgreSQL')
+    transaction = connection.begin()
+    try:
+        # plain ops must not queue behind (and then block) live traffic while estimating
+        connection.execute(f"SET LOCAL lock_timeout = '{online_migrations.LOCK_TIMEOUT}'")
+        context.run_migrations()
+    finally:
+        transaction.rollback()
+    logger.info('Dry run finished, all changes rolled back.')
+
+
 if context.is_offline_mode():
     run_migrations_offline()
 else:
@@ -0,0 +1,103 @@
+"""range-partition show by start_time and add show_archive
+
+Revision ID: 3b7d1f2a9c41
+Revises: c05b80364ae9
+Create Date: 2026-10-19 09:12:40.118204
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3b7d1f2a9c41'
+down_revision = 'c05b80364ae9'
+branch_labels = None
+depends_on = None
+
+# Months of partitions created ahead of today; `flask shows maintain` keeps this topped up.
+MONTHS_AHEAD = 3
+
+
+def _add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def upgrade():
+    op.create_table('show_archive',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('venue_id', sa.Integer(), nullable=False),
+    sa.Column('artist_id', sa.Integer(), nullable=False),
+    sa.Column('start_time', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_show_archive_venue_id', 'show_archive', ['venue_id'])
+    op.create_index('ix_show_archive_artist_id', 'show_archive', ['artist_id'])
+
+    connection = op.get_bind()
+    if connection.dialect.name != 'postgresql':
+        # Other backends keep a plain show table; `flask shows maintain` moves
+        # old rows into show_archive instead of detaching partitions.
+        return
+
+    op.execute('ALTER SEQUENCE show_id_seq OWNED BY NONE')
+    op.execute('ALTER TABLE show RENAME TO show_unpartitioned')
+    op.execute('ALTER TABLE show_unpartitioned RENAME CONSTRAINT show_pkey TO show_unpartitioned_pkey')
+    # The partition key has to be part of the primary key.
+    op.execute("""
+        CREATE TABLE show (
+            id integer NOT NULL DEFAULT nextval('show_id_seq'),
+            venue_id integer NOT NULL REFERENCES venue (id),
+            artist_id integer NOT NULL REFERENCES artist (id),
+            start_time timestamp without time zone NOT NULL,
+            PRIMARY KEY (id, start_time)
+        ) PARTITION BY RANGE (start_time)
+    """)
+    op.execute('ALTER SEQUENCE show_id_seq OWNED BY show.id')
+    op.execute('CREATE TABLE show_default PARTITION OF show DEFAULT')
+
+    oldest = connection.execute(sa.text('SELECT min(start_time) FROM show_unpartitioned')).scalar()
+    this_month = datetime.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    month = oldest.replace(day=1, hour=0, minute=0, second=0, microsecond=0) if oldest else this_month
+    month = min(month, this_month)
+    last = _add_months(this_month, MONTHS_AHEAD)
+    while month <= last:
+        following = _add_months(month, 1)
+        op.execute(
+            f"CREATE TABLE show_{month:%Y_%m} PARTITION OF show "
+            f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{following:%Y-%m-%d}')"
+        )
+        month = following
+
+    op.execute('INSERT INTO show (id, venue_id, artist_id, start_time) '
+               'SELECT id, venue_id, artist_id, start_time FROM show_unpartitioned')
+    op.execute('DROP TABLE show_unpartitioned')
+
+
+def downgrade():
+    connection = op.get_bind()
+    if connection.dialect.name == 'postgresql':
+        op.execute('ALTER SEQUENCE show_id_seq OWNED BY NONE')
+        op.execute('ALTER TABLE show RENAME TO show_partitioned')
+        op.execute('ALTER TABLE show_partitioned RENAME CONSTRAINT show_pkey TO show_partitioned_pkey')
+        op.execute("""
+            CREATE TABLE show (
+                id integer NOT NULL DEFAULT nextval('show_id_seq'),
+                venue_id integer NOT NULL REFERENCES venue (id),
+                artist_id integer NOT NULL REFERENCES artist (id),
+                start_time timestamp without time zone NOT NULL,
+                PRIMARY KEY (id)
+            )
+        """)
+        op.execute('ALTER SEQUENCE show_id_seq OWNED BY show.id')
+        op.execute('INSERT INTO show (id, venue_id, artist_id, start_time) '
+                   'SELECT id, venue_id, artist_id, start_time FROM show_partitioned')
+        op.execute('DROP TABLE show_partitioned')
+    op.execute('INSERT INTO show (id, venue_id, artist_id, start_time) '
+               'SELECT id, venue_id, artist_id, start_time FROM show_archive')
+    op.drop_index('ix_show_archive_artist_id', table_name='show_archive')
+    op.drop_index('ix_show_archive_venue_id', table_name='show_archive')
+    op.drop_table('show_archive')
@@ -0,0 +1,31 @@
+"""session_store table for server-side sessions
+
+Revision ID: 5c9e7a3d2f18
+Revises: 8e2c4a6d0b17
+Create Date: 2026-10-19 14:21:47.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5c9e7a3d2f18'
+down_revision = '8e2c4a6d0b17'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('session_store',
+    sa.Column('id', sa.String(length=64), nullable=False),
+    sa.Column('data', sa.Text(), nullable=False),
+    sa.Column('expires_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_session_store_expires_at'), 'session_store', ['expires_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_session_store_expires_at'), table_name='session_store')
+    op.drop_table('session_store')
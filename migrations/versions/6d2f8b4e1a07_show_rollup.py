@@ -0,0 +1,35 @@
+"""show_rollup: shows per month, city, state and genre
+
+Revision ID: 6d2f8b4e1a07
+Revises: 5c9e7a3d2f18
+Create Date: 2026-10-19 15:40:12.604391
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6d2f8b4e1a07'
+down_revision = '5c9e7a3d2f18'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('show_rollup',
+    sa.Column('month', sa.Date(), nullable=False),
+    sa.Column('city', sa.String(length=120), nullable=False),
+    sa.Column('state', sa.String(length=120), nullable=False),
+    sa.Column('genre', sa.String(length=120), nullable=False),
+    sa.Column('shows', sa.Integer(), nullable=False, server_default='0'),
+    sa.PrimaryKeyConstraint('month', 'city', 'state', 'genre')
+    )
+    # the dashboard filters on genre first ('*' for totals), then ranges over months
+    op.create_index('ix_show_rollup_genre_month', 'show_rollup', ['genre', 'month'])
+    # run `flask stats backfill` afterwards to count existing shows
+
+
+def downgrade():
+    op.drop_index('ix_show_rollup_genre_month', table_name='show_rollup')
+    op.drop_table('show_rollup')
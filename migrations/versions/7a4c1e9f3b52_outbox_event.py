@@ -0,0 +1,45 @@
+"""outbox_event table for the transactional outbox
+
+Revision ID: 7a4c1e9f3b52
+Revises: 6d2f8b4e1a07
+Create Date: 2026-10-19 17:03:28.940217
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7a4c1e9f3b52'
+down_revision = '6d2f8b4e1a07'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('outbox_event',
+    sa.Column('id', sa.BigInteger().with_variant(sa.Integer(), 'sqlite'), nullable=False),
+    sa.Column('entity', sa.String(length=20), nullable=False),
+    sa.Column('entity_id', sa.Integer(), nullable=False),
+    sa.Column('op', sa.String(length=10), nullable=False),
+    sa.Column('payload', sa.Text(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('available_at', sa.DateTime(), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False, server_default='0'),
+    sa.Column('delivered_at', sa.DateTime(), nullable=True),
+    sa.Column('last_error', sa.Text(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    # the dispatcher only ever looks at undelivered events
+    op.create_index('ix_outbox_event_pending', 'outbox_event', ['available_at', 'id'],
+                    postgresql_where=sa.text('delivered_at IS NULL'), sqlite_where=sa.text('delivered_at IS NULL'))
+    op.create_index('ix_outbox_event_entity', 'outbox_event', ['entity', 'entity_id', 'id'],
+                    postgresql_where=sa.text('delivered_at IS NULL'), sqlite_where=sa.text('delivered_at IS NULL'))
+    op.create_index('ix_outbox_event_delivered_at', 'outbox_event', ['delivered_at'])
+
+
+def downgrade():
+    op.drop_index('ix_outbox_event_delivered_at', table_name='outbox_event')
+    op.drop_index('ix_outbox_event_entity', table_name='outbox_event')
+    op.drop_index('ix_outbox_event_pending', table_name='outbox_event')
+    op.drop_table('outbox_event')
@@ -0,0 +1,29 @@
+"""catalog_version change counter for in-process catalog snapshots
+
+Revision ID: 8e2c4a6d0b17
+Revises: 3b7d1f2a9c41
+Create Date: 2026-10-19 10:02:11.530913
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8e2c4a6d0b17'
+down_revision = '3b7d1f2a9c41'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    catalog_version = op.create_table('catalog_version',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('version', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.bulk_insert(catalog_version, [{'id': 1, 'version': 0}])
+
+
+def downgrade():
+    op.drop_table('catalog_version')
@@ -0,0 +1,34 @@
+"""indexes for per-venue and per-artist show lists and venues by city
+
+Revision ID: 9b3e5d7f1c26
+Revises: 7a4c1e9f3b52
+Create Date: 2026-10-19 18:41:07.553912
+
+"""
+import online_migrations as online
+
+
+# revision identifiers, used by Alembic.
+revision = '9b3e5d7f1c26'
+down_revision = '7a4c1e9f3b52'
+branch_labels = None
+depends_on = None
+
+# Built concurrently, so writes to show and venue continue during the upgrade.
+INDEXES = (
+    # upcoming and past shows of a venue / artist, in order
+    ('ix_show_venue_id_start_time', 'show', ['venue_id', 'start_time']),
+    ('ix_show_artist_id_start_time', 'show', ['artist_id', 'start_time']),
+    # /venues groups by city and state
+    ('ix_venue_city_state', 'venue', ['city', 'state']),
+)
+
+
+def upgrade():
+    for name, table, columns in INDEXES:
+        online.create_index(name, table, columns)
+
+
+def downgrade():
+    for name, table, _ in reversed(INDEXES):
+        online.drop_index(name, table)
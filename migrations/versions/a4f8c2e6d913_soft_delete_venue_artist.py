@@ -0,0 +1,39 @@
+"""deleted_at on venue and artist, with partial indexes over the rows still listed
+
+Revision ID: a4f8c2e6d913
+Revises: 9b3e5d7f1c26
+Create Date: 2026-10-19 21:12:44.208137
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+import online_migrations as online
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4f8c2e6d913'
+down_revision = '9b3e5d7f1c26'
+branch_labels = None
+depends_on = None
+
+# Only rows that are not soft-deleted are indexed, so listings and the duplicate
+# check never read deleted ones and the indexes stay the size of the live catalog.
+INDEXES = (
+    ('ix_venue_live_state_city', 'venue', ['state', 'city', 'id']),
+    ('ix_artist_live_state_city', 'artist', ['state', 'city', 'id']),
+)
+
+
+def upgrade():
+    for table in ('venue', 'artist'):
+        online.add_column(table, sa.Column('deleted_at', sa.DateTime(), nullable=True))
+    for name, table, columns in INDEXES:
+        online.create_index(name, table, columns, where='deleted_at IS NULL')
+
+
+def downgrade():
+    for name, table, _ in reversed(INDEXES):
+        online.drop_index(name, table)
+    for table in ('artist', 'venue'):
+        online.lock_retries(lambda: op.drop_column(table, 'deleted_at'))
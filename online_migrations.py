@@ -0,0 +1,333 @@
+"""Migration operations that keep the live tables writable.
+
+Plain Alembic ops take locks that queue every write behind them: ``CREATE
+INDEX`` blocks writes for the whole build and an ``ALTER TABLE`` waiting for a
+lock blocks everything queued after it. The helpers here are for use inside
+revisions instead:
+
+* ``create_index`` builds with ``CREATE INDEX CONCURRENTLY`` outside the
+  migration transaction. On the partitioned ``show`` table the parent index is
+  created ``ON ONLY`` the parent, each partition's index concurrently, and the
+  two attached. Invalid leftovers of an interrupted build are dropped first,
+  so rerunning the migration resumes it.
+* ``add_column`` and anything wrapped in ``lock_retries`` give up on a lock
+  after ``LOCK_TIMEOUT`` and try again, instead of stalling other sessions.
+* ``backfill`` updates rows in keyset batches, each committed on its own,
+  with a pause in between. Progress is kept in ``migration_backfill``, so an
+  interrupted backfill continues where it stopped.
+
+``flask db upgrade -x dry_run=1`` runs the pending revisions in a transaction
+that is rolled back. These helpers then change nothing and log how long they
+would take on the current data volume instead (PostgreSQL only).
+Other backends get plain Alembic operations.
+"""
+import logging
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from alembic import context, op
+from sqlalchemy import bindparam, text
+from sqlalchemy.exc import OperationalError
+
+logger = logging.getLogger('alembic.online')
+
+LOCK_TIMEOUT = '5s'
+LOCK_ATTEMPTS = 10
+LOCK_NOT_AVAILABLE = '55P03'
+# rows read per table to time a sample index build or batch
+SAMPLE_ROWS = 10000
+PROGRESS_TABLE = (
+    'CREATE TABLE IF NOT EXISTS migration_backfill ('
+    'name VARCHAR(200) PRIMARY KEY, last_key BIGINT, rows_done BIGINT NOT NULL, '
+    'started_at TIMESTAMP NOT NULL, updated_at TIMESTAMP NOT NULL, finished_at TIMESTAMP)'
+)
+
+
+def is_dry_run():
+    return context.get_x_argument(as_dictionary=True).get('dry_run', '').lower() in ('1', 'true', 'yes')
+
+
+def is_postgresql(connection):
+    return connection.dialect.name == 'postgresql'
+
+
+def estimate(step, seconds, rows=None):
+    """Log one dry-run estimate."""
+    volume = f' over ~{rows:,} rows' if rows is not None else ''
+    logger.info('[dry run] %s: ~%s%s', step, format_seconds(seconds), volume)
+
+
+def format_seconds(seconds):
+    if seconds < 60:
+        return f'{seconds:.1f}s'
+    if seconds < 3600:
+        return f'{seconds / 60:.1f}min'
+    return f'{seconds / 3600:.1f}h'
+
+
+# Locks
+
+@contextmanager
+def lock_timeout(connection, timeout=LOCK_TIMEOUT):
+    """Fail statements that wait longer than ``timeout`` for a lock (PostgreSQL)."""
+    if not is_postgresql(connection):
+        yield
+        return
+    connection.execute(text(f"SET lock_timeout = '{timeout}'"))
+    try:
+        yield
+    except Exception:
+        # a failed transaction cannot run RESET; rolling it (or the savepoint) back undoes the SET
+        if not connection.in_transaction():
+            connection.execute(text('RESET lock_timeout'))
+        raise
+    connection.execute(text('RESET lock_timeout'))
+
+
+def is_lock_timeout(error):
+    return getattr(error.orig, 'pgcode', None) == LOCK_NOT_AVAILABLE
+
+
+def lock_retries(operation, connection=None, timeout=LOCK_TIMEOUT, attempts=LOCK_ATTEMPTS):
+    """Run ``operation()`` with a lock timeout, retrying with backoff while the lock is busy.
+
+    Inside a transaction each attempt gets its own savepoint, so a timed out
+    attempt does not abort the migration.
+    """
+    connection = connection or op.get_bind()
+    if not is_postgresql(connection):
+        return operation()
+    for attempt in range(1, attempts + 1):
+        savepoint = connection.begin_nested() if connection.in_transaction() else None
+        try:
+            with lock_timeout(connection, timeout):
+                result = operation()
+        except OperationalError as error:
+            if savepoint is not None:
+                savepoint.rollback()
+            if not is_lock_timeout(error) or attempt == attempts:
+                raise
+            delay = min(30, 0.5 * 2 ** attempt)
+            logger.warning('lock not available (attempt %d/%d), retrying in %.1fs', attempt, attempts, delay)
+            time.sleep(delay)
+        else:
+            if savepoint is not None:
+                savepoint.commit()
+            return result
+
+
+def add_column(table_name, column):
+    """``op.add_column`` that does not queue writes behind it while waiting for its lock.
+
+    Add nullable columns, or ones with a constant default, so PostgreSQL does
+    not rewrite the table; fill them in with ``backfill``.
+    """
+    if is_dry_run():
+        estimate(f'add column {table_name}.{column.name}', 0)
+        return
+    lock_retries(lambda: op.add_column(table_name, column))
+
+
+# Indexes
+
+def partitions_of(connection, table_name):
+    """Partition names of a partitioned table, or None for a plain table."""
+    if not is_postgresql(connection):
+        return None
+    partitioned = connection.execute(text(
+        'SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:table)'), {'table': table_name}).scalar()
+    if partitioned is None:
+        return None
+    return [row[0] for row in connection.execute(text(
+        'SELECT child.relname FROM pg_inherits JOIN pg_class child ON child.oid = pg_inherits.inhrelid '
+        'WHERE pg_inherits.inhparent = to_regclass(:table) ORDER BY child.relname'), {'table': table_name})]
+
+
+def index_state(connection, index_name):
+    """None if the index does not exist, else whether it is valid."""
+    return connection.execute(text('SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:index)'),
+                              {'index': index_name}).scalar()
+
+
+def is_attached(connection, index_name, parent_name):
+    return connection.execute(text(
+        'SELECT 1 FROM pg_inherits WHERE inhrelid = to_regclass(:index) AND inhparent = to_regclass(:parent)'
+    ), {'index': index_name, 'parent': parent_name}).scalar() is not None
+
+
+def _build_concurrently(connection, index_name, table_name, definition):
+    if index_state(connection, index_name) is False:
+        # left behind by an interrupted concurrent build
+        logger.info('dropping invalid index %s', index_name)
+        connection.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS {index_name}'))
+    started = time.time()
+    connection.execute(text(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {index_name} ON {table_name} {definition}'))
+    logger.info('built %s on %s in %s', index_name, table_name, format_seconds(time.time() - started))
+
+
+def create_index(index_name, table_name, columns, where=None):
+    """Build an index without blocking writes to ``table_name``."""
+    connection = op.get_bind()
+    if not is_postgresql(connection):
+        op.create_index(index_name, table_name, columns,
+                        sqlite_where=text(where) if where else None)
+        return
+    definition = f'({", ".join(columns)})' + (f' WHERE {where}' if where else '')
+    partitions = partitions_of(connection, table_name)
+    if is_dry_run():
+        estimate_index(connection, index_name, table_name, columns)
+        return
+    with outside_transaction() as connection:
+        if partitions is None:
+            _build_concurrently(connection, index_name, table_name, definition)
+            return
+        # an invalid index on the parent only; it becomes valid once every partition's index is attached
+        lock_retries(lambda: connection.execute(text(
+            f'CREATE INDEX IF NOT EXISTS {index_name} ON ONLY {table_name} {definition}')), connection)
+        for partition in partitions:
+            partition_index = f'{partition}_{index_name}'[:63]
+            if is_attached(connection, partition_index, index_name):
+                continue
+            _build_concurrently(connection, partition_index, partition, definition)
+            lock_retries(lambda: connection.execute(text(
+                f'ALTER INDEX {index_name} ATTACH PARTITION {partition_index}')), connection)
+
+
+def drop_index(index_name, table_name):
+    connection = op.get_bind()
+    if not is_postgresql(connection):
+        op.drop_index(index_name, table_name=table_name)
+        return
+    if partitions_of(connection, table_name) is not None:
+        # partitioned indexes cannot be dropped concurrently
+        lock_retries(lambda: connection.execute(text(f'DROP INDEX IF EXISTS {index_name}')), connection)
+        return
+    with outside_transaction() as connection:
+        connection.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS {index_name}'))
+
+
+def estimate_index(connection, index_name, table_name, columns):
+    """Time sorting a sample of the index keys and scale it to the table; concurrent builds scan twice."""
+    rows = table_rows(connection, table_name)
+    if not rows:
+        estimate(f'create index {index_name}', 0, 0)
+        return
+    percent = min(100.0, 100.0 * SAMPLE_ROWS / rows)
+    started = time.perf_counter()
+    sampled = connection.execute(text(
+        f'SELECT count(*) FROM (SELECT {", ".join(columns)} FROM {table_name} TABLESAMPLE SYSTEM ({percent}) '
+        f'ORDER BY {", ".join(columns)}) sample')).scalar()
+    elapsed = time.perf_counter() - started
+    estimate(f'create index {index_name}', 2 * elapsed * rows / max(sampled, 1), rows)
+
+
+def table_rows(connection, table_name):
+    """The planner's row count, summed over partitions; cheap on large tables."""
+    return int(connection.execute(text(
+        'SELECT sum(greatest(reltuples, 0)) FROM pg_class WHERE relname IN :tables'
+    ).bindparams(bindparam('tables', expanding=True)),
+        {'tables': partitions_of(connection, table_name) or [table_name]}).scalar() or 0)
+
+
+@contextmanager
+def outside_transaction():
+    """Commit the migration so far and run the block in autocommit mode (PostgreSQL)."""
+    if is_postgresql(op.get_bind()):
+        with op.get_context().autocommit_block():
+            yield op.get_bind()
+    else:
+        yield op.get_bind()
+
+
+# Backfills
+
+def _progress(connection, name):
+    connection.execute(text(PROGRESS_TABLE))
+    return connection.execute(text(
+        'SELECT last_key, rows_done, finished_at FROM migration_backfill WHERE name = :name'), {'name': name}).first()
+
+
+def _save_progress(connection, name, last_key, rows_done, finished=False):
+    now = datetime.utcnow()
+    values = {'name': name, 'last_key': last_key, 'rows_done': rows_done, 'now': now,
+              'finished_at': now if finished else None}
+    updated = connection.execute(text(
+        'UPDATE migration_backfill SET last_key = :last_key, rows_done = :rows_done, updated_at = :now, '
+        'finished_at = :finished_at WHERE name = :name'), values).rowcount
+    if not updated:
+        connection.execute(text(
+            'INSERT INTO migration_backfill (name, last_key, rows_done, started_at, updated_at, finished_at) '
+            'VALUES (:name, :last_key, :rows_done, :now, :now, :finished_at)'), values)
+
+
+def _next_batch(connection, table_name, key, after, batch_size):
+    """Upper key of the next ``batch_size`` rows after ``after``; None once the table is done."""
+    where = f'WHERE {key} > :after' if after is not None else ''
+    return connection.execute(text(
+        f'SELECT max({key}) FROM (SELECT {key} FROM {table_name} {where} ORDER BY {key} LIMIT :limit) batch'
+    ), {'after': after, 'limit': batch_size}).scalar()
+
+
+def backfill(name, table_name, assignments, where, key='id', batch_size=1000, pause=0.1, max_batch_seconds=1.0):
+    """``UPDATE table_name SET assignments WHERE where`` in keyset batches along ``key``.
+
+    ``name`` identifies the backfill in ``migration_backfill``; ``where``
+    should exclude rows already done (e.g. ``new_column IS NULL``), so the
+    batch that was running when a backfill was interrupted can safely run
+    again. Batches shrink while they take longer than ``max_batch_seconds``.
+    """
+    connection = op.get_bind()
+    if is_dry_run():
+        estimate_backfill(connection, name, table_name, key, batch_size, pause)
+        return
+    with outside_transaction() as connection:
+        progress = _progress(connection, name)
+        if progress is not None and progress[2] is not None:
+            logger.info('backfill %s already finished (%d rows)', name, progress[1])
+            return
+        last_key, rows_done = (progress[0], progress[1]) if progress is not None else (None, 0)
+        total = connection.execute(text(f'SELECT count(*) FROM {table_name} WHERE {where}')).scalar()
+        logger.info('backfill %s: %d rows to update%s', name, total,
+                    f', resuming after {key} {last_key}' if last_key is not None else '')
+        size, started = batch_size, time.time()
+        while True:
+            upper = _next_batch(connection, table_name, key, last_key, size)
+            if upper is None:
+                break
+            batch_started = time.perf_counter()
+            lower = f'{key} > :after AND ' if last_key is not None else ''
+            with connection.begin():
+                rows_done += connection.execute(text(
+                    f'UPDATE {table_name} SET {assignments} WHERE {lower}{key} <= :upper AND ({where})'
+                ), {'after': last_key, 'upper': upper}).rowcount
+                last_key = upper
+                _save_progress(connection, name, last_key, rows_done)
+            elapsed = time.perf_counter() - batch_started
+            # keep each batch's row locks short; grow back towards batch_size once batches are fast again
+            size = max(10, size // 2) if elapsed > max_batch_seconds else min(batch_size, size * 2)
+            rate = rows_done / max(time.time() - started, 1e-6)
+            logger.info('backfill %s: %d/%d rows (%.0f%%), ~%s left', name, rows_done, total,
+                        100.0 * rows_done / max(total, 1), format_seconds(max(total - rows_done, 0) / max(rate, 1e-6)))
+            time.sleep(pause)
+        _save_progress(connection, name, last_key, rows_done, finished=True)
+        logger.info('backfill %s: done, %d rows in %s', name, rows_done, format_seconds(time.time() - started))
+
+
+def estimate_backfill(connection, name, table_name, key, batch_size, pause):
+    """Time rewriting one batch in place (rolled back) and scale it to the rows left."""
+    rows = table_rows(connection, table_name)
+    upper = _next_batch(connection, table_name, key, None, batch_size)
+    if not rows or upper is None:
+        estimate(f'backfill {name}', 0, 0)
+        return
+    savepoint = connection.begin_nested()
+    try:
+        started = time.perf_counter()
+        updated = connection.execute(text(f'UPDATE {table_name} SET {key} = {key} WHERE {key} <= :upper'),
+                                     {'upper': upper}).rowcount
+        elapsed = time.perf_counter() - started
+    finally:
+        savepoint.rollback()
+    batches = rows / max(updated, 1)
+    estimate(f'backfill {name}', batches * (elapsed + pause), rows)
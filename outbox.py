@@ -0,0 +1,343 @@
+"""Transactional outbox of venue, artist and show change events.
+
+Every flush appends one ``outbox_event`` row per changed entity in the same
+transaction as the change, so an event exists if and only if the write
+committed. ``flask outbox dispatch`` (a separate process) drains the table in
+batches and hands events to the configured sinks: delivery is at least once,
+failed events are retried with exponential backoff, and an entity's events
+are delivered in order: a batch holds, per entity, a run of consecutive
+undelivered events starting from the oldest, and when one of them fails the
+rest of the run is retried with it. Several dispatchers can run side by side
+on PostgreSQL (``FOR UPDATE SKIP LOCKED``).
+
+Sinks are configured as URLs in ``OUTBOX_SINKS``: ``http(s)://...`` POSTs
+``{"events": [...]}``, ``file:///path`` appends JSON lines. Without sinks no
+events are written at all. Delivered events are purged after
+``OUTBOX_RETENTION_DAYS``, and events nobody delivered after
+``OUTBOX_MAX_AGE_DAYS``, so the table stays bounded even without a dispatcher
+as long as ``flask outbox purge`` runs.
+``flask outbox receive`` runs a local HTTP endpoint to stand in for a real
+consumer.
+"""
+import json
+import logging
+import os
+import random
+import threading
+import time
+import urllib.request
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import bindparam, text
+from sqlalchemy.orm.attributes import instance_dict
+
+logger = logging.getLogger(__name__)
+
+INSERT_EVENT = (
+    'INSERT INTO outbox_event (entity, entity_id, op, payload, created_at, available_at, attempts) '
+    'VALUES (:entity, :entity_id, :op, :payload, :created_at, :created_at, 0)'
+)
+# due events with no earlier event of their entity waiting out a backoff; ``ahead`` counts the
+# earlier undelivered ones, so rows another dispatcher has locked can be told apart (see ``in_order``)
+CLAIM_EVENTS = (
+    'SELECT id, entity, entity_id, op, payload, created_at, attempts, ('
+    '  SELECT count(*) FROM outbox_event earlier WHERE earlier.entity = e.entity '
+    '  AND earlier.entity_id = e.entity_id AND earlier.delivered_at IS NULL AND earlier.id < e.id'
+    ') AS ahead FROM outbox_event e '
+    'WHERE delivered_at IS NULL AND available_at <= :now AND NOT EXISTS ('
+    '  SELECT 1 FROM outbox_event earlier WHERE earlier.entity = e.entity AND earlier.entity_id = e.entity_id '
+    '  AND earlier.delivered_at IS NULL AND earlier.available_at > :now AND earlier.id < e.id'
+    ') ORDER BY id LIMIT :limit'
+)
+
+
+def in_order(rows):
+    """The claimed rows that continue their entity's run from its oldest undelivered event.
+
+    A row is left out once an earlier event of its entity is missing from the
+    batch, being delivered by another dispatcher or beyond the limit.
+    """
+    claimed, kept = {}, []
+    for row in rows:
+        key = (row[1], row[2])
+        if row[7] == claimed.get(key, 0):
+            claimed[key] = row[7] + 1
+            kept.append(row)
+        else:
+            claimed[key] = -1
+    return kept
+
+
+def and_later(events, failed):
+    """``failed`` plus every later event of the same entities, so none of them overtakes a retry."""
+    entities = set()
+    for event in events:
+        key = (event["entity"], event["id"])
+        if event["event_id"] in failed:
+            entities.add(key)
+        elif key in entities:
+            failed = failed | {event["event_id"]}
+    return failed
+
+
+class DeliveryFailed(Exception):
+    """Raised by a sink; ``event_ids`` are the events that were not delivered (None for all of them)."""
+
+    def __init__(self, message, event_ids=None):
+        super(DeliveryFailed, self).__init__(message)
+        self.event_ids = event_ids
+
+
+class HTTPSink(object):
+    def __init__(self, url, timeout=10):
+        self.url = url
+        self.timeout = timeout
+
+    def deliver(self, events):
+        body = json.dumps({"events": events}).encode('utf-8')
+        request = urllib.request.Request(self.url, data=body, method='POST',
+                                         headers={'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                response.read()
+        except OSError as error:
+            raise DeliveryFailed(f'{self.url}: {error}')
+
+    def __repr__(self):
+        return f'<class {self.__class__.__name__} {self.url}>'
+
+
+class FileSink(object):
+    """Appends one JSON line per event; meant for tests and local debugging."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def deliver(self, events):
+        with open(self.path, 'a') as handle:
+            for event in events:
+                handle.write(json.dumps(event) + '\n')
+            handle.flush()
+            os.fsync(handle.fileno())
+
+    def __repr__(self):
+        return f'<class {self.__class__.__name__} {self.path}>'
+
+
+def make_sink(url):
+    if url.startswith(('http://', 'https://')):
+        return HTTPSink(url)
+    if url.startswith('file://'):
+        return FileSink(url[len('file://'):])
+    raise ValueError(f'Unsupported outbox sink {url!r}')
+
+
+def to_json(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+class Outbox(object):
+    """Configuration:
+
+    * ``OUTBOX_ENABLED`` -- write events; defaults to whether there are sinks
+    * ``OUTBOX_SINKS`` -- sink URLs every event is delivered to
+    * ``OUTBOX_BATCH_SIZE``, ``OUTBOX_POLL_SECONDS``
+    * ``OUTBOX_BACKOFF_SECONDS``, ``OUTBOX_MAX_BACKOFF_SECONDS`` -- retry delay doubles per attempt up to the maximum
+    * ``OUTBOX_RETENTION_DAYS`` -- delivered events older than this are purged
+    * ``OUTBOX_MAX_AGE_DAYS`` -- undelivered events older than this are purged too
+    """
+
+    def __init__(self, app=None, db=None, changes=None):
+        self.db = db
+        self.enabled = False
+        self.sinks = []
+        if app is not None:
+            self.init_app(app, db, changes)
+
+    def init_app(self, app, db, changes):
+        self.db = db
+        config = app.config
+        config.setdefault('OUTBOX_SINKS', [])
+        config.setdefault('OUTBOX_ENABLED', bool(config['OUTBOX_SINKS']))
+        config.setdefault('OUTBOX_BATCH_SIZE', 100)
+        config.setdefault('OUTBOX_POLL_SECONDS', 1)
+        config.setdefault('OUTBOX_BACKOFF_SECONDS', 2)
+        config.setdefault('OUTBOX_MAX_BACKOFF_SECONDS', 600)
+        config.setdefault('OUTBOX_RETENTION_DAYS', 7)
+        config.setdefault('OUTBOX_MAX_AGE_DAYS', 30)
+        self.config = config
+        self.enabled = config['OUTBOX_ENABLED']
+        self.sinks = [make_sink(url) for url in config['OUTBOX_SINKS']]
+        app.cli.add_command(self._command_group())
+        if self.enabled:
+            changes.on_flush(self._on_flush)
+
+    # Writing
+
+    def _on_flush(self, session, changes):
+        now = datetime.utcnow()
+        data = {}
+        for op, instance in changes.instances:
+            # the row as written; set-based changes only carry ids
+            state = instance_dict(instance)
+            data[(instance.__tablename__, op, instance.id)] = {
+                column.key: state[column.key] for column in instance.__table__.columns if column.key in state
+            }
+        rows = []
+        for op in ('created', 'updated', 'deleted'):
+            for entity, ids in sorted(getattr(changes, op).items()):
+                for entity_id in sorted(ids):
+                    payload = {"entity": entity, "id": entity_id, "op": op}
+                    if (entity, op, entity_id) in data:
+                        payload["data"] = data[(entity, op, entity_id)]
+                    rows.append({'entity': entity, 'entity_id': entity_id, 'op': op, 'created_at': now,
+                                 'payload': json.dumps(payload, default=to_json)})
+        if rows:
+            session.connection().execute(text(INSERT_EVENT), rows)
+
+    # Dispatching
+
+    def _backoff(self, attempts):
+        delay = min(self.config['OUTBOX_MAX_BACKOFF_SECONDS'], self.config['OUTBOX_BACKOFF_SECONDS'] * 2 ** attempts)
+        return timedelta(seconds=delay * random.uniform(0.5, 1.0))
+
+    def dispatch_batch(self):
+        """Claim, deliver and record one batch; returns (delivered, failed)."""
+        now = datetime.utcnow()
+        with self.db.engine.begin() as connection:
+            claim = CLAIM_EVENTS
+            if connection.dialect.name == 'postgresql':
+                # rows stay locked until the outcome is recorded, other dispatchers skip them
+                claim += ' FOR UPDATE SKIP LOCKED'
+            rows = in_order(connection.execute(
+                text(claim), {'now': now, 'limit': self.config['OUTBOX_BATCH_SIZE']}).fetchall())
+            if not rows:
+                return 0, 0
+            events = []
+            for event_id, entity, entity_id, op, payload, created_at, attempts, ahead in rows:
+                event = json.loads(payload)
+                event["event_id"] = event_id
+                events.append(event)
+            failed, error = set(), None
+            for sink in self.sinks:
+                try:
+                    sink.deliver([event for event in events if event["event_id"] not in failed])
+                except DeliveryFailed as failure:
+                    error = str(failure)
+                    failed.update(failure.event_ids or [event["event_id"] for event in events])
+                except Exception as failure:
+                    logger.exception('outbox sink %r failed', sink)
+                    error = f'{type(failure).__name__}: {failure}'
+                    failed.update(event["event_id"] for event in events)
+                failed = and_later(events, failed)
+            delivered = [row[0] for row in rows if row[0] not in failed]
+            if delivered:
+                connection.execute(text(
+                    'UPDATE outbox_event SET delivered_at = :now, attempts = attempts + 1 WHERE id IN :ids'
+                ).bindparams(bindparam('ids', expanding=True)), {'now': datetime.utcnow(), 'ids': delivered})
+            retries = [{'id': row[0], 'available_at': now + self._backoff(row[6]), 'error': error}
+                       for row in rows if row[0] in failed]
+            if retries:
+                logger.warning('outbox: %d events failed, retrying later: %s', len(retries), error)
+                connection.execute(text(
+                    'UPDATE outbox_event SET attempts = attempts + 1, available_at = :available_at, '
+                    'last_error = :error WHERE id = :id'), retries)
+        return len(delivered), len(retries)
+
+    def purge(self):
+        """Delete delivered events past retention and undelivered ones past the maximum age;
+        returns (delivered, undelivered) counts."""
+        now = datetime.utcnow()
+        with self.db.engine.begin() as connection:
+            delivered = connection.execute(text(
+                'DELETE FROM outbox_event WHERE delivered_at IS NOT NULL AND delivered_at < :cutoff'
+            ), {'cutoff': now - timedelta(days=self.config['OUTBOX_RETENTION_DAYS'])}).rowcount
+            undelivered = connection.execute(text(
+                'DELETE FROM outbox_event WHERE delivered_at IS NULL AND created_at < :cutoff'
+            ), {'cutoff': now - timedelta(days=self.config['OUTBOX_MAX_AGE_DAYS'])}).rowcount
+        if undelivered:
+            logger.warning('outbox: dropped %d events undelivered after %d days', undelivered,
+                           self.config['OUTBOX_MAX_AGE_DAYS'])
+        return delivered, undelivered
+
+    def run(self, once=False):
+        if not self.sinks:
+            raise click.ClickException('No OUTBOX_SINKS configured')
+        purged_at = 0
+        while True:
+            delivered, failed = self.dispatch_batch()
+            if delivered or failed:
+                logger.info('outbox: delivered %d, failed %d', delivered, failed)
+            if once and not delivered:
+                return
+            if time.time() - purged_at > 3600:
+                self.purge()
+                purged_at = time.time()
+            # a full batch means more events are probably waiting
+            if delivered < self.config['OUTBOX_BATCH_SIZE']:
+                time.sleep(self.config['OUTBOX_POLL_SECONDS'])
+
+    def status(self):
+        with self.db.engine.connect() as connection:
+            row = connection.execute(text(
+                'SELECT count(*), min(created_at), max(attempts) FROM outbox_event WHERE delivered_at IS NULL'
+            )).first()
+        return {"pending": row[0], "oldest_pending": row[1], "max_attempts": row[2]}
+
+    def _command_group(self):
+        outbox_group = AppGroup('outbox', help='Deliver change events to downstream systems.')
+
+        @outbox_group.command('dispatch')
+        @click.option('--once', is_flag=True, help='Exit once nothing is left to deliver.')
+        def dispatch(once):
+            """Drain the outbox into OUTBOX_SINKS until interrupted."""
+            logging.basicConfig(level=logging.INFO)
+            click.echo(f'dispatching to {", ".join(map(repr, self.sinks))}')
+            self.run(once)
+
+        @outbox_group.command('purge')
+        def purge():
+            """Delete delivered events past retention and events too old to deliver."""
+            delivered, undelivered = self.purge()
+            click.echo(f'purged {delivered} delivered and {undelivered} undelivered events')
+
+        @outbox_group.command('status')
+        def status():
+            """Show undelivered events."""
+            for key, value in self.status().items():
+                click.echo(f'{key}: {value}')
+
+        @outbox_group.command('receive')
+        @click.option('--port', type=int, default=8099)
+        @click.option('--output', type=click.File('a'), default='-', help='Where received events are written.')
+        @click.option('--fail-rate', type=float, default=0.0, help='Fraction of requests answered with 503.')
+        def receive(port, output, fail_rate):
+            """Accept events over HTTP like a downstream consumer would."""
+            lock = threading.Lock()
+
+            class Receiver(BaseHTTPRequestHandler):
+                def do_POST(self):
+                    body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                    if random.random() < fail_rate:
+                        self.send_response(503)
+                        self.end_headers()
+                        return
+                    with lock:
+                        for event in json.loads(body)["events"]:
+                            output.write(json.dumps(event) + '\n')
+                        output.flush()
+                    self.send_response(204)
+                    self.end_headers()
+
+                def log_message(self, format, *args):
+                    pass
+
+            click.echo(f'receiving events on http://127.0.0.1:{port}/')
+            HTTPServer(('127.0.0.1', port), Receiver).serve_forever()
+
+        return outbox_group
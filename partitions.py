@@ -0,0 +1,147 @@
+"""Maintenance of the time-partitioned show table.
+
+On PostgreSQL ``show`` is range-partitioned by month on ``start_time`` (see
+migration 3b7d1f2a9c41). ``ShowPartitions.maintain`` creates the partitions for
+the coming months and moves whole partitions older than the retention window
+into ``show_archive``. Other backends keep a plain ``show`` table and old rows
+are moved into ``show_archive`` directly.
+"""
+from datetime import datetime
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import text
+
+
+def month_floor(value):
+    return value.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f'show_{month:%Y_%m}'
+
+
+class ShowPartitions(object):
+    def __init__(self, app=None, db=None):
+        self.db = db
+        self.months_ahead = 3
+        self.archive_after_months = 24
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db):
+        self.db = db
+        self.months_ahead = app.config.setdefault('SHOW_PARTITION_MONTHS_AHEAD', 3)
+        self.archive_after_months = app.config.setdefault('SHOW_ARCHIVE_AFTER_MONTHS', 24)
+        app.cli.add_command(self._command_group())
+
+    def archive_cutoff(self, now=None):
+        """Start of the oldest month still kept in the live show table.
+
+        Adding ``Show.start_time >= archive_cutoff()`` to history queries lets
+        PostgreSQL prune the partitions that have already been archived.
+        """
+        return add_months(month_floor(now or datetime.now()), -self.archive_after_months)
+
+    def is_partitioned(self, connection):
+        if connection.dialect.name != 'postgresql':
+            return False
+        return connection.execute(text(
+            "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid "
+            "WHERE c.relname = 'show'"
+        )).scalar() is not None
+
+    def existing_partitions(self, connection):
+        rows = connection.execute(text(
+            "SELECT child.relname FROM pg_inherits "
+            "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+            "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+            "WHERE parent.relname = 'show'"
+        ))
+        return {row[0] for row in rows}
+
+    def create_partitions(self, connection, now=None):
+        """Create monthly partitions up to ``months_ahead`` from now; returns their names."""
+        existing = self.existing_partitions(connection)
+        created = []
+        month = month_floor(now or datetime.now())
+        for _ in range(self.months_ahead + 1):
+            following = add_months(month, 1)
+            name = partition_name(month)
+            if name not in existing:
+                # Rows for this month may already sit in the default partition;
+                # move them before attaching so the attach does not fail.
+                connection.execute(text(f'CREATE TABLE {name} (LIKE show INCLUDING DEFAULTS)'))
+                connection.execute(text(
+                    f'WITH moved AS (DELETE FROM show_default WHERE start_time >= :lower '
+                    f'AND start_time < :upper RETURNING id, venue_id, artist_id, start_time) '
+                    f'INSERT INTO {name} (id, venue_id, artist_id, start_time) SELECT * FROM moved'
+                ), lower=month, upper=following)
+                connection.execute(text(
+                    f"ALTER TABLE show ATTACH PARTITION {name} "
+                    f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{following:%Y-%m-%d}')"
+                ))
+                created.append(name)
+            month = following
+        return created
+
+    def archive_partitions(self, connection, cutoff):
+        """Detach partitions that end before ``cutoff`` and move their rows to show_archive."""
+        archived = 0
+        for name in sorted(self.existing_partitions(connection)):
+            if name == 'show_default':
+                continue
+            month = datetime.strptime(name, 'show_%Y_%m')
+            if add_months(month, 1) > cutoff:
+                continue
+            connection.execute(text(f'ALTER TABLE show DETACH PARTITION {name}'))
+            archived += connection.execute(text(
+                f'INSERT INTO show_archive (id, venue_id, artist_id, start_time) '
+                f'SELECT id, venue_id, artist_id, start_time FROM {name}'
+            )).rowcount
+            connection.execute(text(f'DROP TABLE {name}'))
+        return archived + self.archive_rows(connection, cutoff)
+
+    def archive_rows(self, connection, cutoff):
+        """Archive-table fallback: move rows older than ``cutoff`` with two set-based statements."""
+        archived = connection.execute(text(
+            'INSERT INTO show_archive (id, venue_id, artist_id, start_time) '
+            'SELECT id, venue_id, artist_id, start_time FROM show WHERE start_time < :cutoff'
+        ), cutoff=cutoff).rowcount
+        connection.execute(text('DELETE FROM show WHERE start_time < :cutoff'), cutoff=cutoff)
+        return archived
+
+    def maintain(self, now=None):
+        cutoff = self.archive_cutoff(now)
+        with self.db.engine.begin() as connection:
+            if self.is_partitioned(connection):
+                created = self.create_partitions(connection, now)
+                archived = self.archive_partitions(connection, cutoff)
+            else:
+                created = []
+                archived = self.archive_rows(connection, cutoff)
+        return created, archived
+
+    def _command_group(self):
+        shows_group = AppGroup('shows', help='Maintain the show table.')
+
+        @shows_group.command('maintain')
+        @click.option('--ahead', type=int, default=None, help='Months of partitions to create ahead.')
+        @click.option('--keep', type=int, default=None, help='Months of history kept before archiving.')
+        def maintain_command(ahead, keep):
+            """Create upcoming partitions and archive old shows."""
+            if ahead is not None:
+                self.months_ahead = ahead
+            if keep is not None:
+                self.archive_after_months = keep
+            created, archived = self.maintain()
+            for name in created:
+                click.echo(f'created partition {name}')
+            click.echo(f'archived {archived} shows older than {self.archive_cutoff():%Y-%m-%d}')
+
+        return shows_group
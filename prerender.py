@@ -0,0 +1,225 @@
+"""Publish mode: venue, artist and listing pages prerendered to static HTML.
+
+Pages are rendered through the app itself (a test client request flagged
+``fyyur.internal`` that reads from the primary) and written under
+``PUBLISH_DIR`` as ``<path>/index.html``, atomically with ``os.replace``.
+After each commit a background worker re-renders only the pages the write
+touched. A static file server in front of the app serves the files and falls
+back to Flask for anything missing; Flask serves them too when they exist.
+Visitors with a session cookie (i.e. flashed messages pending) always get a
+live render. ``flask publish rebuild`` regenerates the whole site.
+
+Venue and artist pages also change without a write, when one of their shows
+starts and moves from upcoming to past. ``flask publish due``, run from cron
+every few minutes, re-renders the pages of the shows that started since it
+last ran (recorded in ``PUBLISH_DIR/.rendered-until``).
+"""
+import logging
+import os
+import queue
+import threading
+from datetime import datetime
+
+import click
+from flask import request, send_from_directory, session
+from flask.cli import AppGroup
+from sqlalchemy import DateTime, bindparam, text
+
+logger = logging.getLogger(__name__)
+
+LISTING_PATHS = ('/', '/venues', '/artists', '/shows')
+# when ``publish_due`` or ``rebuild`` last brought every page up to date; not served, it is no index.html
+STAMP = '.rendered-until'
+STAMP_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+
+class Publisher(object):
+    """Configuration:
+
+    * ``PUBLISH_ENABLED``
+    * ``PUBLISH_DIR`` -- output directory for the prerendered pages
+    * ``PUBLISH_SERVE`` -- let Flask answer from the published files when they exist
+    """
+
+    def __init__(self, app=None, db=None, changes=None):
+        self.app = app
+        self.db = db
+        self.enabled = False
+        self.directory = None
+        self._queue = queue.Queue()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+        if app is not None:
+            self.init_app(app, db, changes)
+
+    def init_app(self, app, db, changes):
+        self.app = app
+        self.db = db
+        config = app.config
+        config.setdefault('PUBLISH_ENABLED', False)
+        config.setdefault('PUBLISH_DIR', os.path.join(app.instance_path, 'published'))
+        config.setdefault('PUBLISH_SERVE', True)
+        self.enabled = config['PUBLISH_ENABLED']
+        self.directory = os.path.abspath(config['PUBLISH_DIR'])
+        app.cli.add_command(self._command_group())
+        if not self.enabled:
+            return
+        changes.on_commit(self._on_commit)
+        if config['PUBLISH_SERVE']:
+            app.before_request(self._serve)
+
+    def filename(self, path):
+        return os.path.join(self.directory, path.strip('/'), 'index.html')
+
+    # Serving
+
+    def _serve(self):
+        if (request.method not in ('GET', 'HEAD') or request.environ.get('fyyur.internal')
+                or request.query_string or session.get('_flashes')):
+            return None
+        filename = self.filename(request.path)
+        if not filename.startswith(self.directory + os.sep) or not os.path.isfile(filename):
+            return None
+        return send_from_directory(os.path.dirname(filename), 'index.html', mimetype='text/html')
+
+    # Rendering
+
+    def render(self, path, client=None):
+        """Render ``path`` and publish it; pages that no longer exist are unpublished."""
+        client = client or self.app.test_client()
+        response = client.get(path, environ_base={'fyyur.internal': True, 'fyyur.read_primary': True})
+        filename = self.filename(path)
+        if response.status_code != 200:
+            response.close()
+            if os.path.exists(filename):
+                os.remove(filename)
+            return False
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        temporary = f'{filename}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temporary, 'wb') as handle:
+            handle.write(response.get_data())
+        os.replace(temporary, filename)
+        return True
+
+    def affected_paths(self, changes):
+        """Pages showing anything a committed ``ChangeSet`` touched."""
+        venue_ids = changes.ids('venue') | changes.parents('venue')
+        artist_ids = changes.ids('artist') | changes.parents('artist')
+        # show lists on the other side name and picture the changed venues and artists
+        with self.db.engine.connect() as connection:
+            for table, other, ids, target in (('venue', 'artist', changes.ids('venue'), artist_ids),
+                                              ('artist', 'venue', changes.ids('artist'), venue_ids)):
+                if ids:
+                    statement = text(f'SELECT DISTINCT {other}_id FROM show WHERE {table}_id IN :ids').bindparams(
+                        bindparam('ids', expanding=True))
+                    target.update(row[0] for row in connection.execute(statement, {'ids': sorted(ids)}))
+        paths = set()
+        if venue_ids:
+            paths.add('/venues')
+        if artist_ids:
+            paths.add('/artists')
+        if venue_ids or artist_ids or changes.ids('show'):
+            paths.add('/shows')
+        paths.update(f'/venues/{venue_id}' for venue_id in venue_ids)
+        paths.update(f'/artists/{artist_id}' for artist_id in artist_ids)
+        return paths
+
+    def due_paths(self, since, until):
+        """Pages with a show that started after ``since`` and by ``until``, no longer upcoming on them."""
+        with self.db.engine.connect() as connection:
+            rows = connection.execute(text(
+                'SELECT DISTINCT venue_id, artist_id FROM show WHERE start_time > :since AND start_time <= :until'
+            ).bindparams(bindparam('since', type_=DateTime), bindparam('until', type_=DateTime)),
+                {'since': since, 'until': until}).fetchall()
+        return {f'/venues/{row[0]}' for row in rows} | {f'/artists/{row[1]}' for row in rows}
+
+    def _rendered_until(self):
+        try:
+            with open(os.path.join(self.directory, STAMP)) as handle:
+                return datetime.strptime(handle.read().strip(), STAMP_FORMAT)
+        except (OSError, ValueError):
+            return None
+
+    def _stamp(self, until):
+        os.makedirs(self.directory, exist_ok=True)
+        filename = os.path.join(self.directory, STAMP)
+        temporary = f'{filename}.{os.getpid()}.tmp'
+        with open(temporary, 'w') as handle:
+            handle.write(until.strftime(STAMP_FORMAT))
+        os.replace(temporary, filename)
+
+    def publish_due(self, until=None):
+        """Re-render the pages whose shows started since the last run; returns how many were rendered.
+
+        Without a record of an earlier run every page is rendered.
+        """
+        until = until or datetime.now()
+        since = self._rendered_until()
+        if since is None:
+            return self.rebuild()[0]
+        client = self.app.test_client()
+        paths = self.due_paths(since, until)
+        for path in sorted(paths):
+            self.render(path, client)
+        self._stamp(until)
+        return len(paths)
+
+    def _on_commit(self, changes):
+        self._queue.put(changes)
+        with self._worker_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name='fyyur-publisher', daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        client = self.app.test_client()
+        while True:
+            batch = [self._queue.get()]
+            # coalesce everything committed meanwhile so a busy page is rendered once
+            while not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            try:
+                paths = set()
+                for changes in batch:
+                    paths.update(self.affected_paths(changes))
+                for path in sorted(paths):
+                    self.render(path, client)
+            except Exception:
+                logger.exception('publishing pages failed')
+
+    def rebuild(self):
+        """Render every page and remove published pages whose entity is gone."""
+        until = datetime.now()
+        client = self.app.test_client()
+        with self.db.engine.connect() as connection:
+            paths = list(LISTING_PATHS)
+            for table in ('venue', 'artist'):
+                paths += [f'/{table}s/{row[0]}' for row in connection.execute(text(
+                    f'SELECT id FROM {table} WHERE deleted_at IS NULL ORDER BY id'))]
+        published = {self.filename(path) for path in paths if self.render(path, client)}
+        self._stamp(until)
+        published.add(os.path.join(self.directory, STAMP))
+        removed = 0
+        for directory, _, filenames in os.walk(self.directory):
+            for name in filenames:
+                filename = os.path.join(directory, name)
+                if filename not in published:
+                    os.remove(filename)
+                    removed += 1
+        return len(published) - 1, removed
+
+    def _command_group(self):
+        publish_group = AppGroup('publish', help='Prerender pages to static HTML.')
+
+        @publish_group.command('rebuild')
+        def rebuild():
+            """Render every venue, artist and listing page into PUBLISH_DIR."""
+            published, removed = self.rebuild()
+            click.echo(f'published {published} pages to {self.directory}, removed {removed} stale files')
+
+        @publish_group.command('due')
+        def due():
+            """Re-render the pages of shows that started since the last run; run it every few minutes."""
+            click.echo(f'published {self.publish_due()} pages to {self.directory}')
+
+        return publish_group
@@ -0,0 +1,186 @@
+"""Read-replica routing for the Flask-SQLAlchemy session.
+
+Safe (GET/HEAD) requests read from one of the configured replicas, everything
+else -- and any request from a client that wrote within the sticky window --
+goes to the primary bound to SQLALCHEMY_DATABASE_URI. Replica health is
+probed in the background, one probe per replica at a time; requests only read
+the last result.
+"""
+import itertools
+import threading
+import time
+
+from flask import g, has_request_context, request
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import create_engine, event, orm, text
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import NullPool
+
+SAFE_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS'])
+STICKY_COOKIE = 'fyyur_primary_until'
+
+
+class Replica(object):
+    def __init__(self, uri, engine_options=None, check_timeout=2):
+        self.uri = uri
+        self.engine = create_engine(uri, pool_pre_ping=True, **(engine_options or {}))
+        self.postgresql = make_url(uri).get_backend_name() == 'postgresql'
+        # probes get their own connection, so they neither wait for nor count against the pool
+        self.probe_engine = create_engine(
+            uri, poolclass=NullPool, connect_args={'connect_timeout': check_timeout} if self.postgresql else {})
+        self.check_timeout = check_timeout
+        self.healthy = True
+        self.checked_at = 0.0
+        self.in_flight = 0
+        self._lock = threading.Lock()
+        self._checking = threading.Lock()
+        event.listen(self.engine, 'checkout', self._on_checkout)
+        event.listen(self.engine, 'checkin', self._on_checkin)
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        with self._lock:
+            self.in_flight += 1
+
+    def _on_checkin(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.in_flight = max(0, self.in_flight - 1)
+
+    def check(self):
+        try:
+            with self.probe_engine.connect() as connection:
+                if self.postgresql:
+                    connection.execute(text(f'SET statement_timeout = {int(self.check_timeout * 1000)}'))
+                connection.execute(text('SELECT 1'))
+            self.healthy = True
+        except Exception:
+            self.healthy = False
+        self.checked_at = time.time()
+        return self.healthy
+
+    def check_in_background(self):
+        """Start a probe unless one is already running; returns whether it started."""
+        if not self._checking.acquire(blocking=False):
+            return False
+
+        def probe():
+            try:
+                self.check()
+            finally:
+                self._checking.release()
+        threading.Thread(target=probe, name=f'replica-check-{self.engine.url.host}', daemon=True).start()
+        return True
+
+    def __repr__(self):
+        return f'<class {self.__class__.__name__} {self.engine.url!r} healthy={self.healthy}>'
+
+
+class ReplicaSet(object):
+    """Picks a healthy replica using round-robin or least-loaded selection."""
+
+    def __init__(self, uris, selection='round_robin', health_check_interval=10, health_check_timeout=2):
+        if selection not in ('round_robin', 'least_loaded'):
+            raise ValueError(f'Unknown replica selection strategy {selection!r}')
+        self.replicas = [Replica(uri, check_timeout=health_check_timeout) for uri in uris]
+        self.selection = selection
+        self.health_check_interval = health_check_interval
+        self._counter = itertools.count()
+
+    def __bool__(self):
+        return bool(self.replicas)
+
+    def healthy(self):
+        """Replicas whose last probe passed; due probes start in the background and never hold up the caller."""
+        now = time.time()
+        for replica in self.replicas:
+            if now - replica.checked_at >= self.health_check_interval:
+                replica.check_in_background()
+        return [replica for replica in self.replicas if replica.healthy]
+
+    def pick(self):
+        candidates = self.healthy()
+        if not candidates:
+            return None
+        if self.selection == 'least_loaded':
+            return min(candidates, key=lambda replica: replica.in_flight)
+        return candidates[next(self._counter) % len(candidates)]
+
+
+class RoutingSession(SignallingSession):
+    def __init__(self, db, **options):
+        self.db = db
+        super(RoutingSession, self).__init__(db, **options)
+
+    def get_bind(self, mapper=None, clause=None):
+        replica = self.db.replica_for_request()
+        # Anything flushing or holding pending changes must see the primary.
+        if replica is None or self._flushing or self.new or self.dirty or self.deleted:
+            return super(RoutingSession, self).get_bind(mapper, clause)
+        return replica.engine
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """SQLAlchemy extension whose session reads from replicas on safe requests.
+
+    Configuration:
+
+    * ``SQLALCHEMY_REPLICA_URIS`` -- list of replica database URLs (empty disables routing)
+    * ``SQLALCHEMY_REPLICA_SELECTION`` -- ``'round_robin'`` or ``'least_loaded'``
+    * ``SQLALCHEMY_REPLICA_HEALTH_CHECK_INTERVAL`` -- seconds between ``SELECT 1`` probes
+    * ``SQLALCHEMY_REPLICA_HEALTH_CHECK_TIMEOUT`` -- seconds a probe may take to connect and to run
+    * ``SQLALCHEMY_REPLICA_STICKY_SECONDS`` -- read-your-writes window after a write
+    """
+
+    def __init__(self, app=None, **kwargs):
+        self.replicas = ReplicaSet([])
+        self.sticky_seconds = 0
+        super(RoutingSQLAlchemy, self).__init__(app, **kwargs)
+
+    def init_app(self, app):
+        super(RoutingSQLAlchemy, self).init_app(app)
+        app.config.setdefault('SQLALCHEMY_REPLICA_URIS', [])
+        app.config.setdefault('SQLALCHEMY_REPLICA_SELECTION', 'round_robin')
+        app.config.setdefault('SQLALCHEMY_REPLICA_HEALTH_CHECK_INTERVAL', 10)
+        app.config.setdefault('SQLALCHEMY_REPLICA_HEALTH_CHECK_TIMEOUT', 2)
+        app.config.setdefault('SQLALCHEMY_REPLICA_STICKY_SECONDS', 5)
+        self.replicas = ReplicaSet(
+            app.config['SQLALCHEMY_REPLICA_URIS'],
+            selection=app.config['SQLALCHEMY_REPLICA_SELECTION'],
+            health_check_interval=app.config['SQLALCHEMY_REPLICA_HEALTH_CHECK_INTERVAL'],
+            health_check_timeout=app.config['SQLALCHEMY_REPLICA_HEALTH_CHECK_TIMEOUT'],
+        )
+        self.sticky_seconds = app.config['SQLALCHEMY_REPLICA_STICKY_SECONDS']
+        app.after_request(self._mark_sticky)
+
+    def create_session(self, options):
+        factory = orm.sessionmaker(class_=RoutingSession, db=self, **options)
+        event.listen(factory, 'after_commit', self._on_commit)
+        return factory
+
+    def _on_commit(self, session):
+        if has_request_context():
+            g.db_wrote = True
+
+    def _mark_sticky(self, response):
+        if self.replicas and (request.method not in SAFE_METHODS or g.get('db_wrote')):
+            response.set_cookie(STICKY_COOKIE, str(time.time() + self.sticky_seconds),
+                                max_age=max(1, int(self.sticky_seconds)), httponly=True)
+        return response
+
+    def _is_sticky(self):
+        try:
+            return float(request.cookies.get(STICKY_COOKIE, 0)) > time.time()
+        except ValueError:
+            return False
+
+    def replica_for_request(self):
+        """Return the replica this request should read from, or None for the primary."""
+        if not self.replicas or not has_request_context():
+            return None
+        if request.method not in SAFE_METHODS or g.get('db_wrote') or self._is_sticky():
+            return None
+        if request.environ.get('fyyur.read_primary'):
+            # internal renders of pages that were just written
+            return None
+        if 'db_replica' not in g:
+            g.db_replica = self.replicas.pick()
+        return g.db_replica
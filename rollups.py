@@ -0,0 +1,231 @@
+"""Show counts per (month, city, state, genre) for the /stats dashboard.
+
+``show_rollup`` is kept up to date inside the transaction that writes the
+shows: a flush listener turns inserted, moved and deleted shows (and venues
+changing city or artists changing genres) into +/- deltas and upserts them.
+A show counts once under each genre of its artist and once under the genre
+``'*'``, which holds the totals. City and state are the venue's. Archived
+shows keep counting. ``flask stats backfill`` rebuilds the table from scratch.
+"""
+from collections import Counter
+from datetime import date
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import Date, DateTime, bindparam, text
+from sqlalchemy.orm.attributes import get_history
+
+ALL_GENRES = '*'
+
+UPSERT = (
+    'INSERT INTO show_rollup (month, city, state, genre, shows) VALUES (:month, :city, :state, :genre, :shows) '
+    'ON CONFLICT (month, city, state, genre) DO UPDATE SET shows = show_rollup.shows + excluded.shows'
+)
+ALL_SHOWS = (
+    '(SELECT id, venue_id, artist_id, start_time FROM show '
+    'UNION ALL SELECT id, venue_id, artist_id, start_time FROM show_archive) AS s'
+)
+BACKFILL_POSTGRESQL = (
+    "INSERT INTO show_rollup (month, city, state, genre, shows) "
+    "SELECT date_trunc('month', s.start_time)::date, v.city, v.state, g.genre, count(*) "
+    f"FROM {ALL_SHOWS} JOIN venue v ON v.id = s.venue_id JOIN artist a ON a.id = s.artist_id "
+    "CROSS JOIN LATERAL (SELECT '*' AS genre UNION SELECT unnest(a.genres)) g "
+    "{where} GROUP BY 1, 2, 3, 4"
+)
+
+
+def month_of(value):
+    return date(value.year, value.month, 1)
+
+
+def next_month(month):
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def rollup_keys(start_time, city, state, genres):
+    month = month_of(start_time)
+    return [(month, city, state, genre) for genre in {ALL_GENRES, *(genres or ())}]
+
+
+def old_value(instance, attribute):
+    """The committed value of ``attribute`` before this flush."""
+    history = get_history(instance, attribute)
+    if history.deleted:
+        return history.deleted[0]
+    return (history.unchanged or history.added or [None])[0]
+
+
+class ShowRollups(object):
+    def __init__(self, app=None, db=None, changes=None):
+        self.db = db
+        if app is not None:
+            self.init_app(app, db, changes)
+
+    def init_app(self, app, db, changes):
+        self.db = db
+        changes.on_flush(self._on_flush)
+        app.cli.add_command(self._command_group())
+
+    # Maintenance
+
+    def _show_rows(self, connection, where, params, expanding=()):
+        statement = text(
+            f'SELECT s.start_time, v.city, v.state, a.genres FROM {ALL_SHOWS} '
+            f'JOIN venue v ON v.id = s.venue_id JOIN artist a ON a.id = s.artist_id WHERE {where}'
+        ).bindparams(*[bindparam(name, expanding=True) for name in expanding]).columns(start_time=DateTime)
+        return connection.execute(statement, params)
+
+    def _on_flush(self, session, changes):
+        connection = session.connection()
+        deltas = Counter()
+        created = sorted(changes.created['show'])
+        # inserted shows, whether they came through the ORM or a set-based statement
+        if created:
+            for row in self._show_rows(connection, 's.id IN :ids', {'ids': created}, ('ids',)):
+                deltas.update(rollup_keys(*row))
+
+        ids = {instance.id for op, instance in changes.instances if instance.__tablename__ == 'show'}
+        # deleted with a set-based statement; marked before it ran, so the rows are still there
+        deleted = sorted(changes.deleted['show'] - ids)
+        if deleted:
+            for row in self._show_rows(connection, 's.id IN :ids', {'ids': deleted}, ('ids',)):
+                deltas.subtract(rollup_keys(*row))
+
+        edited = []
+        for op, instance in changes.instances:
+            table = instance.__tablename__
+            if table == 'show' and op in ('updated', 'deleted'):
+                before = tuple(old_value(instance, field) for field in ('start_time', 'venue_id', 'artist_id'))
+                after = (instance.start_time, instance.venue_id, instance.artist_id)
+                if op == 'deleted' or before != after:
+                    edited.append((before, -1))
+                if op == 'updated' and before != after:
+                    edited.append((after, 1))
+            elif table in ('venue', 'artist') and op == 'updated':
+                fields = ('city', 'state') if table == 'venue' else ('genres',)
+                before = tuple(old_value(instance, field) for field in fields)
+                after = tuple(getattr(instance, field) for field in fields)
+                if before != after:
+                    self._move_history(connection, deltas, table, instance.id, before, after, created)
+
+        if edited:
+            venues = self._lookup(connection, 'SELECT id, city, state FROM venue WHERE id IN :ids',
+                                  {show[1] for show, _ in edited})
+            artists = self._lookup(connection, 'SELECT id, genres FROM artist WHERE id IN :ids',
+                                   {show[2] for show, _ in edited})
+            for (start_time, venue_id, artist_id), sign in edited:
+                if venue_id in venues and artist_id in artists:
+                    for key in rollup_keys(start_time, *venues[venue_id], *artists[artist_id]):
+                        deltas[key] += sign
+        self.apply(connection, deltas)
+
+        # archived shows keep counting under the same keys, nothing to recount
+        set_based = sorted(changes.updated['show'] - ids - changes.archived)
+        if set_based:
+            statement = text(f'SELECT DISTINCT s.start_time FROM {ALL_SHOWS} WHERE s.id IN :ids').bindparams(
+                bindparam('ids', expanding=True)).columns(start_time=DateTime)
+            self.recount(connection, {month_of(row[0]) for row in connection.execute(statement, {'ids': set_based})})
+
+    def _lookup(self, connection, query, ids):
+        statement = text(query).bindparams(bindparam('ids', expanding=True))
+        return {row[0]: tuple(row[1:]) for row in connection.execute(statement, {'ids': sorted(ids)})}
+
+    def _move_history(self, connection, deltas, table, entity_id, before, after, created):
+        """Re-attribute every show of a venue that changed city/state or an artist that changed genres."""
+        where = f's.{table}_id = :id' + (' AND s.id NOT IN :created' if created else '')
+        params = {'id': entity_id, 'created': created} if created else {'id': entity_id}
+        for start_time, city, state, genres in self._show_rows(connection, where, params,
+                                                               ('created',) if created else ()):
+            old_place, new_place = (before, after) if table == 'venue' else ((city, state), (city, state))
+            old_genres, new_genres = (genres, genres) if table == 'venue' else (before[0], after[0])
+            deltas.subtract(rollup_keys(start_time, *old_place, old_genres))
+            deltas.update(rollup_keys(start_time, *new_place, new_genres))
+
+    def apply(self, connection, deltas):
+        rows = [{'month': month, 'city': city, 'state': state, 'genre': genre, 'shows': count}
+                for (month, city, state, genre), count in sorted(deltas.items()) if count]
+        # sorted so concurrent transactions lock rollup rows in the same order
+        if rows:
+            connection.execute(text(UPSERT), rows)
+
+    def recount(self, connection, months):
+        """Replace the rollups of ``months`` with fresh counts of their shows."""
+        if not months:
+            return
+        postgresql = connection.dialect.name == 'postgresql'
+        if postgresql:
+            # as in backfill: concurrent increments land after the recount, not inside it
+            connection.execute(text('LOCK TABLE show_rollup IN EXCLUSIVE MODE'))
+        for month in sorted(months):
+            params = {'month': month, 'lower': month, 'upper': next_month(month)}
+            connection.execute(text('DELETE FROM show_rollup WHERE month = :month'), params)
+            where = 's.start_time >= :lower AND s.start_time < :upper'
+            if postgresql:
+                connection.execute(text(BACKFILL_POSTGRESQL.format(where=f'WHERE {where}')), params)
+            else:
+                deltas = Counter()
+                for row in self._show_rows(connection, where, params):
+                    deltas.update(rollup_keys(*row))
+                self.apply(connection, deltas)
+
+    def backfill(self):
+        with self.db.engine.begin() as connection:
+            postgresql = connection.dialect.name == 'postgresql'
+            if postgresql:
+                # shows inserted meanwhile wait for the lock and add their own increments after the rebuild
+                connection.execute(text('LOCK TABLE show_rollup IN EXCLUSIVE MODE'))
+            connection.execute(text('DELETE FROM show_rollup'))
+            if postgresql:
+                connection.execute(text(BACKFILL_POSTGRESQL.format(where='')))
+            else:
+                deltas = Counter()
+                for row in self._show_rows(connection, '1 = 1', {}):
+                    deltas.update(rollup_keys(*row))
+                self.apply(connection, deltas)
+            return connection.execute(text(
+                'SELECT coalesce(sum(shows), 0) FROM show_rollup WHERE genre = :genre'), {'genre': ALL_GENRES}).scalar()
+
+    def _command_group(self):
+        stats_group = AppGroup('stats', help='Maintain the show rollups behind /stats.')
+
+        @stats_group.command('backfill')
+        def backfill():
+            """Rebuild show_rollup from every show, including archived ones."""
+            click.echo(f'rolled up {self.backfill()} shows')
+
+        return stats_group
+
+    # Queries
+
+    def _filters(self, genre_clause, genre, city, state, since, until):
+        clauses, params = [genre_clause, 'shows > 0'], {'genre': genre}
+        for name, clause, value in (('city', 'city = :city', city), ('state', 'state = :state', state),
+                                    ('since', 'month >= :since', since), ('until', 'month <= :until', until)):
+            if value:
+                clauses.append(clause)
+                params[name] = value
+        return ' AND '.join(clauses), params
+
+    def report(self, city=None, state=None, genre=None, since=None, until=None, limit=20):
+        """Shows per month, top cities and top genres, read only from ``show_rollup``."""
+        session = self.db.session
+        where, params = self._filters('genre = :genre', genre or ALL_GENRES, city, state, since, until)
+        by_month = session.execute(text(
+            f'SELECT month, sum(shows) FROM show_rollup WHERE {where} GROUP BY month ORDER BY month'
+        ).columns(month=Date), params)
+        by_city = session.execute(text(
+            f'SELECT city, state, sum(shows) AS total FROM show_rollup WHERE {where} '
+            f'GROUP BY city, state ORDER BY total DESC, city LIMIT {int(limit)}'
+        ), params)
+        where, params = self._filters('genre <> :genre', ALL_GENRES, city, state, since, until)
+        by_genre = session.execute(text(
+            f'SELECT genre, sum(shows) AS total FROM show_rollup WHERE {where} '
+            f'GROUP BY genre ORDER BY total DESC, genre LIMIT {int(limit)}'
+        ), params)
+        return {
+            "filters": {"city": city, "state": state, "genre": genre,
+                        "since": since and since.strftime('%Y-%m'), "until": until and until.strftime('%Y-%m')},
+            "by_month": [{"month": month.strftime('%Y-%m'), "shows": int(total)} for month, total in by_month],
+            "by_city": [{"city": city, "state": state, "shows": int(total)} for city, state, total in by_city],
+            "by_genre": [{"genre": genre, "shows": int(total)} for genre, total in by_genre],
+        }
@@ -0,0 +1,238 @@
+"""Validation shared by the HTML forms, JSON requests and bulk loads.
+
+A ``Schema`` is compiled once from a model and its WTForms form: required
+fields, string lengths and foreign keys come from the model columns, choices,
+URL checks and date formats from the form fields. Choices are checked against
+frozensets, and foreign keys are checked for a whole batch with one query per
+referenced table, so ``validate`` (one record) and ``validate_many`` (a batch)
+share the same code path. Errors are ``{field: [message, ...]}`` dicts.
+JSON values can be of any type, so each field checks its type first.
+"""
+import inspect
+import re
+from datetime import datetime
+
+from sqlalchemy import Boolean, Integer, String, bindparam, text
+from wtforms.fields import DateTimeField, RadioField, SelectField, SelectMultipleField
+from wtforms.fields.core import UnboundField
+from wtforms.validators import URL, DataRequired
+
+# same pattern as wtforms.validators.URL
+URL_PATTERN = re.compile(r'^[a-z]+://(?P<host>[^/?:]+)(?P<port>:[0-9]+)?(?P<path>/.*?)?(?P<query>\?.*)?$',
+                         re.IGNORECASE)
+DATETIME_FORMATS = ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M')
+BOOLEAN_VALUES = {'True': True, 'true': True, True: True, 'False': False, 'false': False, False: False}
+
+
+class ValidationFailed(Exception):
+    def __init__(self, message):
+        super(ValidationFailed, self).__init__(message)
+        self.message = message
+
+
+def _typed(types, message):
+    # JSON bodies can carry any type; forms only ever send strings
+    def check(value):
+        if value is not None and (not isinstance(value, types) or isinstance(value, bool) and bool not in types):
+            raise ValidationFailed(message)
+        return value
+    return check
+
+
+def _strings(values):
+    if any(not isinstance(value, str) for value in values):
+        raise ValidationFailed('Must be a list of strings.')
+    return values
+
+
+def _required(value):
+    if value is None or value == '' or value == []:
+        raise ValidationFailed('This field is required.')
+    return value
+
+
+def _max_length(length):
+    def check(value):
+        if value is not None and len(value) > length:
+            raise ValidationFailed(f'Must be at most {length} characters long.')
+        return value
+    return check
+
+
+def _choice(choices):
+    def check(value):
+        if value is not None and value not in choices:
+            raise ValidationFailed(f'Not a valid choice: {value}.')
+        return value
+    return check
+
+
+def _choices(choices):
+    def check(values):
+        invalid = [value for value in values if value not in choices]
+        if invalid:
+            raise ValidationFailed(f'Not a valid choice: {", ".join(invalid)}.')
+        return values
+    return check
+
+
+def _url(value):
+    if value is not None and not URL_PATTERN.match(value):
+        raise ValidationFailed('Invalid URL.')
+    return value
+
+
+def _integer(value):
+    if value is None or isinstance(value, int):
+        return value
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValidationFailed('Must be a whole number.')
+
+
+def _boolean(value):
+    if value is None:
+        return None
+    if value not in BOOLEAN_VALUES:
+        raise ValidationFailed('Must be True or False.')
+    return BOOLEAN_VALUES[value]
+
+
+def _datetime(formats):
+    def check(value):
+        if value is None or isinstance(value, datetime):
+            return value
+        for date_format in formats:
+            try:
+                return datetime.strptime(value, date_format)
+            except ValueError:
+                pass
+        try:
+            return datetime.fromisoformat(value)
+        except ValueError:
+            raise ValidationFailed('Not a valid date and time (YYYY-MM-DD HH:MM).')
+    return check
+
+
+def _blank_to_none(value):
+    if isinstance(value, str):
+        value = value.strip()
+        return value or None
+    return value
+
+
+class Field(object):
+    __slots__ = ('name', 'multiple', 'checks', 'references', 'soft_deleted')
+
+    def __init__(self, name, multiple, checks, references=None, soft_deleted=False):
+        self.name = name
+        self.multiple = multiple
+        self.checks = checks
+        self.references = references
+        # the referenced table has a deleted_at column; rows with it set do not count as existing
+        self.soft_deleted = soft_deleted
+
+
+class Schema(object):
+    """Validator for one model, compiled from the model's columns and a form class."""
+
+    def __init__(self, model, form_class):
+        self.model = model
+        self.fields = [self._compile(name, unbound, model.__table__.columns.get(name))
+                       for name, unbound in inspect.getmembers(form_class, lambda m: isinstance(m, UnboundField))]
+
+    def _compile(self, name, unbound, column):
+        field_class = unbound.field_class
+        validators = unbound.kwargs.get('validators') or (unbound.args[1] if len(unbound.args) > 1 else ())
+        required = any(isinstance(v, DataRequired) for v in validators) or (
+            column is not None and not column.nullable and column.default is None and not column.primary_key)
+        multiple = issubclass(field_class, SelectMultipleField)
+        boolean = column is not None and isinstance(column.type, Boolean)
+        if multiple:
+            checks = [_strings]
+        elif boolean:
+            checks = [_typed((str, bool), 'Must be a string or a boolean.'), _blank_to_none]
+        elif column is not None and isinstance(column.type, Integer):
+            checks = [_typed((str, int), 'Must be a string or a whole number.'), _blank_to_none]
+        else:
+            checks = [_typed(str, 'Must be a string.'), _blank_to_none]
+        if issubclass(field_class, RadioField) and 'default' in unbound.kwargs:
+            default = unbound.kwargs['default']
+            checks.append(lambda value: default if value is None else value)
+        if required:
+            checks.append(_required)
+
+        references, soft_deleted = None, False
+        if column is not None:
+            if boolean:
+                checks.append(_boolean)
+            elif isinstance(column.type, Integer):
+                checks.append(_integer)
+            elif isinstance(column.type, String) and column.type.length and not multiple:
+                checks.append(_max_length(column.type.length))
+            for foreign_key in column.foreign_keys:
+                references = foreign_key.column.table.name
+                soft_deleted = 'deleted_at' in foreign_key.column.table.columns
+
+        if issubclass(field_class, DateTimeField):
+            formats = unbound.kwargs.get('format')
+            checks.append(_datetime((formats,) if formats else DATETIME_FORMATS))
+        elif issubclass(field_class, (SelectField, RadioField)) and not boolean:
+            choices = frozenset(choice for choice, _ in unbound.kwargs.get('choices') or ())
+            checks.append(_choices(choices) if multiple else _choice(choices))
+        if any(isinstance(v, URL) for v in validators):
+            checks.append(_url)
+        return Field(name, multiple, checks, references, soft_deleted)
+
+    def _extract(self, record, field):
+        if field.multiple:
+            if hasattr(record, 'getlist'):
+                return record.getlist(field.name)
+            values = record.get(field.name)
+            return [] if values is None else list(values) if isinstance(values, (list, tuple)) else [values]
+        return record.get(field.name)
+
+    def _validate_one(self, record):
+        clean, errors = {}, {}
+        if not hasattr(record, 'get'):
+            return clean, {"record": ['Must be an object.']}
+        for field in self.fields:
+            value = self._extract(record, field)
+            try:
+                for check in field.checks:
+                    value = check(value)
+            except ValidationFailed as failure:
+                errors.setdefault(field.name, []).append(failure.message)
+                continue
+            clean[field.name] = value
+        return clean, errors
+
+    def validate_many(self, records, session=None):
+        """Validate a batch; returns one ``(clean, errors)`` pair per record, in order.
+
+        With a ``session``, foreign keys are checked with one query per referenced table.
+        """
+        results = [self._validate_one(record) for record in records]
+        if session is None:
+            return results
+        for field in self.fields:
+            if field.references is None:
+                continue
+            wanted = {clean[field.name] for clean, errors in results if clean.get(field.name) is not None}
+            if not wanted:
+                continue
+            live = ' AND deleted_at IS NULL' if field.soft_deleted else ''
+            statement = text(f'SELECT id FROM {field.references} WHERE id IN :ids{live}').bindparams(
+                bindparam('ids', expanding=True))
+            found = {row[0] for row in session.execute(statement, {'ids': sorted(wanted)})}
+            for clean, errors in results:
+                value = clean.get(field.name)
+                if value is not None and value not in found:
+                    errors.setdefault(field.name, []).append(f'No {field.references} with id {value}.')
+                    del clean[field.name]
+        return results
+
+    def validate(self, record, session=None):
+        """Validate a single record (a dict or a form ``MultiDict``); returns ``(clean, errors)``."""
+        return self.validate_many([record], session)[0]
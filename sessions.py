@@ -0,0 +1,273 @@
+"""Sessions that work across workers and nodes.
+
+Cookies are signed with a keyring instead of a per-process random key: the
+first key signs, every key verifies, so keys can be rotated by prepending a new
+one and dropping the oldest once its sessions have expired. Keys come from
+``SECRET_KEYS`` (newest first), which config.py reads from ``FYYUR_SECRET_KEYS``.
+
+With ``SESSION_STORE`` set, the cookie only carries a signed session id and
+the data lives server side, in files under ``SESSION_FILE_DIR``, in the
+``session_store`` table, or (``'memory'``) in the process itself as a stand-in
+for a shared cache.
+"""
+import logging
+import os
+import secrets
+import threading
+import time
+from datetime import datetime
+
+import click
+from flask.cli import AppGroup
+from flask.sessions import SecureCookieSessionInterface, SessionInterface, SessionMixin
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+from sqlalchemy import text
+from werkzeug.datastructures import CallbackDict
+
+logger = logging.getLogger(__name__)
+
+
+def load_keyring(config):
+    """Signing keys, newest first, from ``SECRET_KEYS`` or else ``SECRET_KEY``."""
+    keys = list(config.get('SECRET_KEYS') or ())
+    if not keys and config.get('SECRET_KEY'):
+        keys = [config['SECRET_KEY']]
+    return keys
+
+
+class KeyringSerializer(object):
+    """Signs with the first key and accepts a signature from any key."""
+
+    def __init__(self, serializers):
+        self.serializers = serializers
+
+    def dumps(self, value):
+        return self.serializers[0].dumps(value)
+
+    def loads(self, value, max_age=None):
+        failure = None
+        for serializer in self.serializers:
+            try:
+                return serializer.loads(value, max_age=max_age)
+            except BadSignature as error:
+                failure = error
+        raise failure
+
+
+class KeyringSessionInterface(SecureCookieSessionInterface):
+    """Flask's signed cookie session, verified against every key in the keyring."""
+
+    def __init__(self, keys):
+        self.keys = keys
+
+    def _serializer(self, key):
+        return URLSafeTimedSerializer(key, salt=self.salt, serializer=self.serializer,
+                                      signer_kwargs={'key_derivation': self.key_derivation,
+                                                     'digest_method': self.digest_method})
+
+    def get_signing_serializer(self, app):
+        return KeyringSerializer([self._serializer(key) for key in self.keys])
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(session):
+            session.modified = True
+
+        CallbackDict.__init__(self, initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+
+
+class MemoryStore(object):
+    """Sessions held in this process; a stand-in for a shared cache."""
+
+    def __init__(self):
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def load(self, sid):
+        with self._lock:
+            payload, expires = self._sessions.get(sid, (None, 0))
+        return payload if expires > time.time() else None
+
+    def save(self, sid, payload, expires):
+        with self._lock:
+            self._sessions[sid] = (payload, expires)
+
+    def delete(self, sid):
+        with self._lock:
+            self._sessions.pop(sid, None)
+
+    def purge(self):
+        now = time.time()
+        with self._lock:
+            expired = [sid for sid, (_, expires) in self._sessions.items() if expires <= now]
+            for sid in expired:
+                del self._sessions[sid]
+        return len(expired)
+
+
+class FilesystemStore(object):
+    """One file per session; point ``SESSION_FILE_DIR`` at shared storage to span nodes."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, sid):
+        return os.path.join(self.directory, sid)
+
+    def load(self, sid):
+        try:
+            with open(self._path(sid)) as handle:
+                expires, payload = handle.read().split('\n', 1)
+        except (OSError, ValueError):
+            return None
+        return payload if float(expires) > time.time() else None
+
+    def save(self, sid, payload, expires):
+        temporary = f'{self._path(sid)}.{os.getpid()}.tmp'
+        with open(temporary, 'w') as handle:
+            handle.write(f'{expires}\n{payload}')
+        os.replace(temporary, self._path(sid))
+
+    def delete(self, sid):
+        try:
+            os.remove(self._path(sid))
+        except OSError:
+            pass
+
+    def purge(self):
+        purged = 0
+        for sid in os.listdir(self.directory):
+            if not sid.endswith('.tmp') and self.load(sid) is None:
+                self.delete(sid)
+                purged += 1
+        return purged
+
+
+class SQLStore(object):
+    """Sessions in the ``session_store`` table, read and written on the primary outside the request transaction."""
+
+    def __init__(self, db):
+        self.db = db
+
+    def load(self, sid):
+        with self.db.engine.connect() as connection:
+            return connection.execute(text(
+                'SELECT data FROM session_store WHERE id = :id AND expires_at > :now'
+            ), {'id': sid, 'now': datetime.utcnow()}).scalar()
+
+    def save(self, sid, payload, expires):
+        values = {'id': sid, 'data': payload, 'expires_at': datetime.utcfromtimestamp(expires)}
+        with self.db.engine.begin() as connection:
+            updated = connection.execute(text(
+                'UPDATE session_store SET data = :data, expires_at = :expires_at WHERE id = :id'), values)
+            if not updated.rowcount:
+                connection.execute(text(
+                    'INSERT INTO session_store (id, data, expires_at) VALUES (:id, :data, :expires_at)'), values)
+
+    def delete(self, sid):
+        with self.db.engine.begin() as connection:
+            connection.execute(text('DELETE FROM session_store WHERE id = :id'), {'id': sid})
+
+    def purge(self):
+        with self.db.engine.begin() as connection:
+            return connection.execute(text('DELETE FROM session_store WHERE expires_at <= :now'),
+                                      {'now': datetime.utcnow()}).rowcount
+
+
+class ServerSessionInterface(SessionInterface):
+    """The cookie holds a signed random id; the session data is kept in ``store``."""
+
+    salt = 'fyyur-session-id'
+
+    def __init__(self, keys, store):
+        self.keys = keys
+        self.store = store
+        self.serializer = SecureCookieSessionInterface.serializer
+        self.signer = KeyringSerializer([URLSafeTimedSerializer(key, salt=self.salt) for key in keys])
+
+    def open_session(self, app, request):
+        cookie = request.cookies.get(app.session_cookie_name)
+        if cookie:
+            try:
+                sid = self.signer.loads(cookie, max_age=int(app.permanent_session_lifetime.total_seconds()))
+            except BadSignature:
+                sid = None
+            payload = self.store.load(sid) if sid else None
+            if payload is not None:
+                return ServerSession(self.serializer.loads(payload), sid)
+        return ServerSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        name = app.session_cookie_name
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if not session:
+            if session.modified and not session.new:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+        if not self.should_set_cookie(app, session):
+            return
+        expires = time.time() + app.permanent_session_lifetime.total_seconds()
+        self.store.save(session.sid, self.serializer.dumps(dict(session)), expires)
+        response.set_cookie(name, self.signer.dumps(session.sid), expires=self.get_expiration_time(app, session),
+                            httponly=self.get_cookie_httponly(app), domain=domain, path=path,
+                            secure=self.get_cookie_secure(app), samesite=self.get_cookie_samesite(app))
+
+
+class Sessions(object):
+    """Configuration:
+
+    * ``SECRET_KEYS`` -- signing keys, newest first
+    * ``SESSION_STORE`` -- None for signed cookies, or ``'filesystem'``, ``'sql'`` or ``'memory'``
+    * ``SESSION_FILE_DIR`` -- directory used by the filesystem store
+    """
+
+    def __init__(self, app=None, db=None):
+        self.store = None
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db):
+        config = app.config
+        config.setdefault('SECRET_KEYS', [])
+        config.setdefault('SESSION_STORE', None)
+        config.setdefault('SESSION_FILE_DIR', os.path.join(app.instance_path, 'sessions'))
+        keys = load_keyring(config)
+        if not keys:
+            if not app.debug:
+                raise RuntimeError('No session signing key: set FYYUR_SECRET_KEYS or SECRET_KEYS')
+            # a throwaway key only works with a single process
+            logger.warning('No FYYUR_SECRET_KEYS set; signing sessions with a random key for this process')
+            keys = [os.urandom(32)]
+        app.secret_key = keys[0]
+
+        kind = config['SESSION_STORE']
+        if kind is None:
+            app.session_interface = KeyringSessionInterface(keys)
+            return
+        if kind == 'memory':
+            self.store = MemoryStore()
+        elif kind == 'filesystem':
+            self.store = FilesystemStore(config['SESSION_FILE_DIR'])
+        elif kind == 'sql':
+            self.store = SQLStore(db)
+        else:
+            raise ValueError(f'Unsupported SESSION_STORE {kind!r}')
+        app.session_interface = ServerSessionInterface(keys, self.store)
+        app.cli.add_command(self._command_group())
+
+    def _command_group(self):
+        sessions_group = AppGroup('sessions', help='Maintain the server-side session store.')
+
+        @sessions_group.command('purge')
+        def purge():
+            """Delete expired sessions."""
+            click.echo(f'purged {self.store.purge()} expired sessions')
+
+        return sessions_group
@@ -0,0 +1,252 @@
+"""Slow-query log with the plan of every offending statement.
+
+Statements that take longer than ``SLOW_QUERY_MS`` are grouped by
+fingerprint (the SQL with literals and bind parameters replaced by ``?``), so
+``/venues/1`` and ``/venues/2`` count as the same query. The first time a
+fingerprint is seen, and again every ``SLOW_QUERY_EXPLAIN_INTERVAL`` seconds,
+its plan is captured on the same connection and with the same parameters:
+``EXPLAIN (ANALYZE, BUFFERS)`` for SELECTs on PostgreSQL (plain ``EXPLAIN``
+for writes, which must not run twice), ``EXPLAIN QUERY PLAN`` on SQLite.
+Plans that only differ in costs and timings are stored once. Each slow
+statement is also logged as a ``fyyur.slow_query`` warning.
+
+Only normalized statements are kept and logged: bind parameters and the raw
+SQL (sessions, outbox payloads, form input) are left out, and string literals
+in plans masked, unless ``SLOW_QUERY_PARAMETERS`` is set. Entries are kept per
+process; ``/admin/slow-queries`` lists the worst ones when ``SLOW_QUERY_ADMIN``
+or ``DEBUG`` is on.
+"""
+import hashlib
+import logging
+import re
+import threading
+import time
+
+from flask import has_request_context, request
+
+from timing import statement_timer
+
+logger = logging.getLogger('fyyur.slow_query')
+
+STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+BIND_PARAMETER = re.compile(r'%\([^)]+\)s|%s|(?<!:):\w+|\$\d+|\?')
+PARAMETER_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+WHITESPACE = re.compile(r'\s+')
+# costs, row estimates, timings and buffer counts change from run to run, the plan shape does not
+PLAN_MEASUREMENTS = re.compile(r'\((?:cost|actual)[^)]*\)|\b(?:rows|loops|width|Buffers|Memory Usage)[=:][^\n,)]*'
+                               r'|^\s*(?:Planning|Execution) Time:.*$|\d+(?:\.\d+)?', re.MULTILINE)
+MAX_PARAMETERS_LENGTH = 500
+MAX_PLANS = 3
+# psycopg2.extensions.TRANSACTION_STATUS_INTRANS: idle in a transaction, so a savepoint can be taken
+TRANSACTION_STATUS_INTRANS = 2
+
+
+def fingerprint(statement):
+    """Normalized SQL and its short hash; statements differing only in values share both."""
+    normalized = STRING_LITERAL.sub('?', statement)
+    normalized = BIND_PARAMETER.sub('?', normalized)
+    normalized = NUMBER_LITERAL.sub('?', normalized)
+    normalized = PARAMETER_LIST.sub('(?)', normalized)
+    normalized = WHITESPACE.sub(' ', normalized).strip()
+    return normalized, hashlib.sha1(normalized.encode('utf-8')).hexdigest()[:12]
+
+
+def plan_fingerprint(plan):
+    return hashlib.sha1(WHITESPACE.sub(' ', PLAN_MEASUREMENTS.sub('', plan)).encode('utf-8')).hexdigest()[:12]
+
+
+def is_select(statement):
+    return statement.lstrip().lstrip('(').upper().startswith('SELECT')
+
+
+def in_transaction_block(conn):
+    """Whether the PostgreSQL connection is inside a transaction block (and not in autocommit mode)."""
+    if conn.get_execution_options().get('isolation_level') == 'AUTOCOMMIT':
+        return False
+    raw = conn.connection.connection
+    if getattr(raw, 'autocommit', False):
+        return False
+    status = getattr(raw, 'get_transaction_status', None)
+    return status is None or status() == TRANSACTION_STATUS_INTRANS
+
+
+class SlowQuery(object):
+    def __init__(self, key, normalized, statement):
+        self.fingerprint = key
+        self.normalized = normalized
+        self.statement = statement
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.routes = {}
+        self.parameters = None
+        self.last_seen = None
+        self.plans = {}
+        self.explained_at = 0
+
+    def add(self, elapsed_ms, route, parameters):
+        self.count += 1
+        self.total_ms += elapsed_ms
+        self.last_seen = time.time()
+        self.routes[route] = self.routes.get(route, 0) + 1
+        if elapsed_ms >= self.max_ms:
+            # the parameters of the slowest run are the ones worth reproducing
+            self.max_ms = elapsed_ms
+            self.parameters = parameters
+
+    def as_dict(self):
+        return {
+            "fingerprint": self.fingerprint,
+            "statement": self.statement,
+            "normalized": self.normalized,
+            "count": self.count,
+            "total_ms": round(self.total_ms, 2),
+            "mean_ms": round(self.total_ms / self.count, 2),
+            "max_ms": round(self.max_ms, 2),
+            "routes": dict(sorted(self.routes.items(), key=lambda item: -item[1])),
+            "parameters": self.parameters,
+            "last_seen": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(self.last_seen)),
+            "plans": [{"fingerprint": key, "seen": seen, "plan": plan}
+                      for key, (plan, seen) in self.plans.items()],
+        }
+
+
+class SlowQueryLog(object):
+    """Configuration:
+
+    * ``SLOW_QUERY_ENABLED``
+    * ``SLOW_QUERY_MS`` -- statements taking longer than this are recorded
+    * ``SLOW_QUERY_EXPLAIN`` -- capture plans; ``SLOW_QUERY_EXPLAIN_ANALYZE`` runs SELECTs again to get actual timings
+    * ``SLOW_QUERY_EXPLAIN_INTERVAL`` -- seconds before a known statement's plan is captured again
+    * ``SLOW_QUERY_MAX_ENTRIES`` -- fingerprints kept; the ones with the least total time go first
+    * ``SLOW_QUERY_PARAMETERS`` -- also keep and log the raw statement and the parameters of the slowest run
+    * ``SLOW_QUERY_ADMIN`` -- serve ``/admin/slow-queries`` outside of ``DEBUG``
+    """
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self.threshold_ms = 100
+        self._queries = {}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        config = app.config
+        config.setdefault('SLOW_QUERY_ENABLED', False)
+        config.setdefault('SLOW_QUERY_MS', 100)
+        config.setdefault('SLOW_QUERY_EXPLAIN', True)
+        config.setdefault('SLOW_QUERY_EXPLAIN_ANALYZE', True)
+        config.setdefault('SLOW_QUERY_EXPLAIN_INTERVAL', 300)
+        config.setdefault('SLOW_QUERY_MAX_ENTRIES', 500)
+        config.setdefault('SLOW_QUERY_PARAMETERS', False)
+        config.setdefault('SLOW_QUERY_ADMIN', False)
+        self.config = config
+        self.enabled = config['SLOW_QUERY_ENABLED']
+        self.threshold_ms = config['SLOW_QUERY_MS']
+        self.with_parameters = config['SLOW_QUERY_PARAMETERS']
+        self.admin = config['SLOW_QUERY_ADMIN'] or config.get('DEBUG', False)
+        if self.enabled:
+            statement_timer.subscribe(self._check)
+
+    def _check(self, conn, statement, parameters, executemany, elapsed_ms):
+        if elapsed_ms < self.threshold_ms:
+            return
+        route = request.endpoint if has_request_context() else None
+        shown_parameters = None
+        if self.with_parameters and not executemany:
+            shown_parameters = repr(parameters)[:MAX_PARAMETERS_LENGTH]
+        entry, explain = self.record(statement, elapsed_ms, route, shown_parameters)
+        logger.warning('slow query', extra={"fingerprint": entry.fingerprint, "duration_ms": round(elapsed_ms, 2),
+                                            "statement": entry.statement or entry.normalized,
+                                            "parameters": shown_parameters})
+        if explain and not executemany:
+            try:
+                plan = self.explain(conn, statement, parameters)
+            except Exception:
+                # the statement itself succeeded; a failed plan capture must not fail it
+                logger.warning('could not capture the plan of %s', entry.fingerprint, exc_info=True)
+                return
+            if plan is not None:
+                if not self.with_parameters:
+                    # filters in the plan quote the values they compare against
+                    plan = STRING_LITERAL.sub("'?'", plan)
+                with self._lock:
+                    seen = entry.plans.get(plan_fingerprint(plan), (plan, 0))[1]
+                    entry.plans[plan_fingerprint(plan)] = (plan, seen + 1)
+                    while len(entry.plans) > MAX_PLANS:
+                        entry.plans.pop(next(iter(entry.plans)))
+
+    def record(self, statement, elapsed_ms, route, parameters):
+        """Count one slow run; also says whether its plan should be captured now."""
+        normalized, key = fingerprint(statement)
+        with self._lock:
+            entry = self._queries.get(key)
+            if entry is None:
+                entry = self._queries[key] = SlowQuery(key, normalized,
+                                                       statement if self.with_parameters else None)
+                if len(self._queries) > self.config['SLOW_QUERY_MAX_ENTRIES']:
+                    least = min(self._queries.values(), key=lambda query: query.total_ms if query is not entry
+                                else float('inf'))
+                    del self._queries[least.fingerprint]
+            entry.add(elapsed_ms, route, parameters)
+            explain = (self.config['SLOW_QUERY_EXPLAIN']
+                       and time.time() - entry.explained_at >= self.config['SLOW_QUERY_EXPLAIN_INTERVAL'])
+            if explain:
+                entry.explained_at = time.time()
+        return entry, explain
+
+    def explain(self, conn, statement, parameters):
+        """The plan of ``statement`` as text, run on the connection that ran it; None if it can't be explained."""
+        dialect = conn.dialect.name
+        if dialect == 'postgresql':
+            analyze = self.config['SLOW_QUERY_EXPLAIN_ANALYZE'] and is_select(statement)
+            prefix = 'EXPLAIN (ANALYZE, BUFFERS) ' if analyze else 'EXPLAIN '
+            if not in_transaction_block(conn):
+                # e.g. CREATE INDEX CONCURRENTLY in a migration's autocommit block: no savepoint to fall back to
+                return None
+        elif dialect == 'sqlite':
+            prefix = 'EXPLAIN QUERY PLAN '
+        else:
+            return None
+        # a raw DBAPI cursor, so the EXPLAIN itself is neither timed nor logged
+        cursor = conn.connection.cursor()
+        try:
+            savepoint = False
+            try:
+                if dialect == 'postgresql':
+                    # a failing EXPLAIN must not abort the caller's transaction
+                    cursor.execute('SAVEPOINT fyyur_slow_query')
+                    savepoint = True
+                cursor.execute(prefix + statement, parameters)
+                rows = cursor.fetchall()
+            except Exception:
+                if savepoint:
+                    cursor.execute('ROLLBACK TO SAVEPOINT fyyur_slow_query')
+                logger.debug('could not explain %s', statement, exc_info=True)
+                return None
+            if dialect == 'postgresql':
+                cursor.execute('RELEASE SAVEPOINT fyyur_slow_query')
+                return '\n'.join(row[0] for row in rows)
+            return sqlite_plan(rows)
+        finally:
+            cursor.close()
+
+    def top(self, order='total_ms', limit=50):
+        with self._lock:
+            queries = [query.as_dict() for query in self._queries.values()]
+        return sorted(queries, key=lambda query: -query[order])[:limit]
+
+    def reset(self):
+        with self._lock:
+            self._queries.clear()
+
+
+def sqlite_plan(rows):
+    """Indent ``EXPLAIN QUERY PLAN`` rows (id, parent, notused, detail) into a tree."""
+    depth, lines = {0: -1}, []
+    for node_id, parent, _, detail in rows:
+        depth[node_id] = depth.get(parent, -1) + 1
+        lines.append('  ' * depth[node_id] + detail)
+    return '\n'.join(lines)
@@ -2,3 +2,29 @@ window.parseISOString = function parseISOString(s) {
   var b = s.split(/\D+/);
   return new Date(Date.UTC(b[0], --b[1], b[2], b[3], b[4], b[5], b[6]));
 };
+
+// Warn about likely duplicates while a new venue or artist is being filled in.
+document.querySelectorAll('form[data-similar-url]').forEach(function (form) {
+  var warning = form.querySelector('.similar-warning');
+  function check() {
+    var params = new URLSearchParams({
+      name: form.elements.name.value,
+      city: form.elements.city.value,
+      state: form.elements.state.value
+    });
+    if (!params.get('name') || !params.get('city') || !params.get('state')) {
+      warning.textContent = '';
+      return;
+    }
+    fetch(form.dataset.similarUrl + '?' + params).then(function (response) {
+      return response.ok ? response.json() : [];
+    }).then(function (matches) {
+      warning.textContent = matches.length ? 'Already listed? ' + matches.map(function (match) {
+        return match.name + ' (' + match.city + ', ' + match.state + ')';
+      }).join(', ') : '';
+    });
+  }
+  ['name', 'city', 'state'].forEach(function (field) {
+    form.elements[field].addEventListener('change', check);
+  });
+});
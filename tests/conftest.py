@@ -0,0 +1,83 @@
+"""Shared fixtures: the app runs against an SQLite file instead of PostgreSQL.
+
+The environment is set before ``app`` is imported, since config.py reads it
+at import time. The migrations are run once, in a separate process so that
+Alembic's logging setup does not replace the app's, and each test that asks
+for ``database`` gets a fresh copy of the result with two venues, two artists
+and three shows.
+"""
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DIRECTORY = tempfile.mkdtemp(prefix='fyyur-tests-')
+DATABASE = os.path.join(DIRECTORY, 'fyyur.db')
+MIGRATED = os.path.join(DIRECTORY, 'migrated.db')
+os.environ['FYYUR_DATABASE_URL'] = f'sqlite:///{DATABASE}'
+os.environ['FYYUR_RATE_LIMIT_STORE'] = 'memory'
+# change events are only written with somewhere to deliver them
+os.environ['FYYUR_OUTBOX_SINKS'] = 'file://' + os.path.join(DIRECTORY, 'events.jsonl')
+os.environ.setdefault('FYYUR_SECRET_KEYS', 'test-secret-key')
+sys.path.insert(0, ROOT)
+
+# SQLite cannot render ARRAY columns; everything else in the migrations runs as it is
+MIGRATE = """
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.types import ARRAY
+
+
+@compiles(ARRAY, 'sqlite')
+def array_as_json(type_, compiler, **kw):
+    return 'JSON'
+
+
+import flask_migrate
+import app
+with app.app.app_context():
+    flask_migrate.upgrade(directory='migrations')
+"""
+SEED = """
+INSERT INTO venue (id, name, city, state, address, seeking_talent) VALUES
+    (1, 'The Musical Hop', 'San Francisco', 'CA', '1015 Folsom Street', 1),
+    (2, 'Park Square Live Music & Coffee', 'San Francisco', 'CA', '34 Whiskey Moore Ave', 0);
+INSERT INTO artist (id, name, city, state, seeking_venue) VALUES
+    (1, 'Guns N Petals', 'San Francisco', 'CA', 1),
+    (2, 'Matt Quevedo', 'New York', 'NY', 0);
+INSERT INTO show (id, venue_id, artist_id, start_time) VALUES
+    (1, 1, 1, '2019-05-21 21:30:00.000000'),
+    (2, 1, 2, '2035-04-01 20:00:00.000000'),
+    (3, 2, 2, '2035-04-08 20:00:00.000000');
+"""
+
+
+@pytest.fixture(scope='session')
+def fyyur():
+    subprocess.run([sys.executable, '-c', MIGRATE], cwd=ROOT, check=True, stdout=subprocess.DEVNULL,
+                   stderr=subprocess.PIPE, env=dict(os.environ, FYYUR_DATABASE_URL=f'sqlite:///{MIGRATED}'))
+    import app
+    return app
+
+
+@pytest.fixture
+def database(fyyur):
+    """A freshly built and seeded database; yields the app's engine."""
+    fyyur.db.session.remove()
+    fyyur.db.engine.dispose()
+    shutil.copyfile(MIGRATED, DATABASE)
+    connection = sqlite3.connect(DATABASE)
+    connection.executescript(SEED)
+    connection.close()
+    with fyyur.app.app_context():
+        yield fyyur.db.engine
+        fyyur.db.session.remove()
+
+
+@pytest.fixture
+def client(fyyur, database):
+    return fyyur.app.test_client()
@@ -0,0 +1,86 @@
+from datetime import datetime
+
+import pytest
+from flask import Flask
+
+from catalog import Catalog
+
+NOW = datetime(2026, 1, 1)
+
+
+@pytest.fixture
+def snapshot(fyyur, database):
+    return fyyur.catalog.load()
+
+
+def test_venue_page(snapshot):
+    page = snapshot.venue_page(1, NOW)
+    assert page["name"] == 'The Musical Hop'
+    assert [show["artist_name"] for show in page["past_shows"]] == ['Guns N Petals']
+    assert [show["artist_name"] for show in page["upcoming_shows"]] == ['Matt Quevedo']
+    assert (page["past_shows_count"], page["upcoming_shows_count"]) == (1, 1)
+    assert page["upcoming_shows"][0]["start_time"] == '2035-04-01 20:00:00'
+    assert snapshot.venue_page(99, NOW) is None
+
+
+def test_artist_page(snapshot):
+    page = snapshot.artist_page(2, NOW)
+    # upcoming shows soonest first
+    assert [show["venue_id"] for show in page["upcoming_shows"]] == [1, 2]
+    assert page["past_shows"] == []
+
+
+def test_listings(snapshot):
+    [area] = snapshot.venue_areas(NOW)
+    assert (area["city"], area["state"]) == ('San Francisco', 'CA')
+    assert [(venue["id"], venue["num_upcoming_shows"]) for venue in area["venues"]] == [(1, 1), (2, 1)]
+    assert snapshot.artist_list() == [{"id": 1, "name": 'Guns N Petals'}, {"id": 2, "name": 'Matt Quevedo'}]
+    # latest first
+    assert [show["start_time"] for show in snapshot.show_list()] == [
+        '2035-04-08 20:00:00', '2035-04-01 20:00:00', '2019-05-21 21:30:00']
+
+
+def test_deleted_venues_and_their_shows_are_left_out(fyyur, database):
+    database.execute("UPDATE venue SET deleted_at = '2026-01-01 00:00:00.000000' WHERE id = 2")
+    snapshot = fyyur.catalog.load()
+    assert snapshot.venue(2) is None
+    assert [show["venue_id"] for show in snapshot.show_list()] == [1, 1]
+    assert len(snapshot) == 1 + 2 + 2
+
+
+@pytest.mark.parametrize('path', ['/venues', '/artists', '/shows'])
+def test_pages_match_the_database(fyyur, client, monkeypatch, path):
+    expected = client.get(path).get_data(as_text=True)
+    monkeypatch.setattr(fyyur.catalog, 'enabled', True)
+    fyyur.catalog.invalidate()
+    assert client.get(path).get_data(as_text=True) == expected
+
+
+def version(database):
+    return database.execute('SELECT version FROM catalog_version WHERE id = 1').scalar()
+
+
+def rename_venue(fyyur, name):
+    fyyur.Venue.query.get(1).name = name
+    fyyur.db.session.commit()
+
+
+def test_writes_leave_the_version_alone_without_versioning(fyyur, database):
+    assert not fyyur.catalog.versioned
+    rename_venue(fyyur, 'The Musical Hop Too')
+    assert version(database) == 0
+
+
+def test_versioned_writes_bump_the_version(fyyur, database, monkeypatch):
+    monkeypatch.setattr(fyyur.changes, '_flush_listeners', list(fyyur.changes._flush_listeners))
+    monkeypatch.setattr(fyyur.changes, '_commit_listeners', list(fyyur.changes._commit_listeners))
+    app = Flask(__name__)
+    app.config['CATALOG_VERSIONING'] = True
+    catalog = Catalog(app, fyyur.db, fyyur.changes)
+    snapshot = catalog.snapshot()
+    rename_venue(fyyur, 'The Musical Hop Too')
+    assert version(database) == 1
+    # a process that missed the commit notices on its next poll
+    monkeypatch.setattr(catalog, 'poll_seconds', 0)
+    assert catalog.snapshot() is not snapshot
+    assert catalog.snapshot().venue(1).name == 'The Musical Hop Too'
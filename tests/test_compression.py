@@ -0,0 +1,98 @@
+import gzip
+import os
+import zlib
+
+import pytest
+from flask import Flask, Response, request
+
+from compression import Compressor, negotiate, precompress
+
+PAGE = '<p>The Musical Hop</p>\n' * 100
+
+
+def make_app(static_folder=None, **config):
+    app = Flask(__name__, static_folder=static_folder)
+    app.config.update(config)
+    Compressor(app)
+
+    @app.route('/page')
+    def page():
+        response = Response(PAGE, mimetype='text/html')
+        response.set_etag('page')
+        return response.make_conditional(request)
+
+    @app.route('/small')
+    def small():
+        return 'short'
+
+    @app.route('/image')
+    def image():
+        return Response(b'\x89PNG' * 500, mimetype='image/png')
+
+    @app.route('/stream')
+    def stream():
+        return Response((line for line in PAGE.splitlines(keepends=True)), mimetype='text/html')
+
+    return app
+
+
+@pytest.mark.parametrize('header, expected', [
+    ('gzip, deflate, br', ['br', 'gzip']),
+    ('br;q=0.5, gzip', ['gzip', 'br']),
+    ('*', ['br', 'gzip']),
+    ('gzip;q=0, *;q=0.1', ['br']),
+    ('identity', []),
+    ('', []),
+    ('gzip;q=nope', []),
+])
+def test_negotiate(header, expected):
+    assert negotiate(header, ('br', 'gzip')) == expected
+
+
+def test_gzip():
+    client = make_app().test_client()
+    response = client.get('/page', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip' and response.headers['Vary'] == 'Accept-Encoding'
+    assert gzip.decompress(response.get_data()).decode() == PAGE
+    assert response.headers['ETag'] == 'W/"page"'
+    # the weak tag still validates
+    assert client.get('/page', headers={'Accept-Encoding': 'gzip', 'If-None-Match': 'W/"page"'}).status_code == 304
+
+
+def test_passed_through():
+    client = make_app().test_client()
+    plain = client.get('/page')
+    assert 'Content-Encoding' not in plain.headers and plain.headers['Vary'] == 'Accept-Encoding'
+    assert plain.get_data(as_text=True) == PAGE
+    for path in ('/small', '/image'):
+        assert 'Content-Encoding' not in client.get(path, headers={'Accept-Encoding': 'gzip'}).headers
+    assert 'Content-Encoding' not in client.head('/page', headers={'Accept-Encoding': 'gzip'}).headers
+
+
+def test_streamed_chunks_are_flushed_one_by_one():
+    client = make_app(COMPRESSION_MIN_SIZE=100).test_client()
+    response = client.get('/stream', headers={'Accept-Encoding': 'gzip'}, buffered=False)
+    assert response.headers['Content-Encoding'] == 'gzip' and 'Content-Length' not in response.headers
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    pieces = [decompressor.decompress(chunk) for chunk in response.response]
+    # everything sent so far decompresses without waiting for the end of the body
+    assert sum(1 for piece in pieces if piece) > 10
+    assert b''.join(pieces).decode() == PAGE
+
+
+def test_precompressed_static_files(tmp_path):
+    static = tmp_path / 'static'
+    static.mkdir()
+    (static / 'app.css').write_text('body { color: red; }\n' * 200)
+    (static / 'noise.txt').write_bytes(os.urandom(2000))
+    [(variant, original, compressed)] = precompress(str(static / 'app.css'), ['gzip'])
+    assert variant.endswith('app.css.gz') and compressed < original
+    # incompressible files get no variant
+    assert precompress(str(static / 'noise.txt'), ['gzip']) == []
+    assert precompress(str(static / 'app.css'), ['gzip']) == []
+
+    client = make_app(str(static)).test_client()
+    response = client.get('/static/app.css', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.get_data() == (static / 'app.css.gz').read_bytes()
+    assert client.get('/static/app.css').get_data() == (static / 'app.css').read_bytes()
@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+
+from dedup import candidate_pairs, normalize_name, similarity, trigrams
+
+
+def scores(*pairs):
+    codes = trigrams([normalize_name(name) for pair in pairs for name in pair])
+    return similarity(codes[0::2], codes[1::2])
+
+
+@pytest.mark.parametrize('name, normalized', [
+    ('The Musical Hop', 'musical hop'),
+    ('Musical Hop, The', 'musical hop'),
+    ('Park Square Live Music & Coffee', 'park square live music and coffee'),
+    ('Café Ünder-Ground!', 'cafe under ground'),
+    ('The', 'the'),
+])
+def test_normalize_name(name, normalized):
+    assert normalize_name(name) == normalized
+
+
+def test_similarity():
+    same, close, different = scores(('The Musical Hop', 'Musical Hop, The'), ('The Musical Hop', 'Musical Hops'),
+                                    ('The Musical Hop', 'Park Square Live Music'))
+    assert same == 1.0
+    assert 0.7 < close < 1.0
+    assert different < 0.3
+
+
+def test_similarity_reads_whole_names():
+    prefix = 'The Royal Metropolitan Philharmonic Orchestra and Chamber '
+    # names that only differ after the first forty characters are still told apart
+    assert scores((prefix + 'Orchestra', prefix + 'Chorus'))[0] < 1.0
+
+
+def test_similarity_chunks_long_names(monkeypatch):
+    monkeypatch.setattr('dedup.COMPARISON_CELLS', 100)
+    pairs = [('Musical Hop', 'Musical Hops'), ('a' * 50 + ' hall', 'a' * 50 + ' hall')] * 3
+    chunked = scores(*pairs)
+    monkeypatch.undo()
+    assert np.allclose(chunked, scores(*pairs))
+
+
+def test_candidate_pairs():
+    # block 0 holds rows 0, 1, 2; block 1 rows 1 and 2 again; block 2 a lone row
+    blocks = np.array([0, 0, 0, 1, 1, 2], dtype=np.int64)
+    rows = np.array([0, 1, 2, 2, 1, 3], dtype=np.int64)
+    assert candidate_pairs(blocks, rows, max_block=10).tolist() == [[0, 1], [0, 2], [1, 2]]
+
+
+def test_candidate_pairs_skip_large_blocks():
+    blocks = np.array([0, 0, 0, 1, 1], dtype=np.int64)
+    rows = np.array([0, 1, 2, 3, 4], dtype=np.int64)
+    assert candidate_pairs(blocks, rows, max_block=2).tolist() == [[3, 4]]
+
+
+def test_candidate_pairs_empty():
+    empty = np.zeros(0, dtype=np.int64)
+    assert candidate_pairs(empty, empty, max_block=10).shape == (0, 2)
+    assert candidate_pairs(np.array([0, 1]), np.array([0, 1]), max_block=10).shape == (0, 2)
+
+
+def test_clusters_keep_the_row_with_most_shows(fyyur, database):
+    database.execute("INSERT INTO venue (id, name, city, state, seeking_talent) VALUES "
+                     "(3, 'Musical Hop, The', 'San Francisco', 'CA', 0), (4, 'The Musical Hop', 'Oakland', 'CA', 0)")
+    [cluster] = fyyur.dedup.clusters('venue', threshold=0.8)
+    # the Oakland venue is in another city, so it is never compared
+    assert [(member["id"], member["shows"]) for member in cluster] == [(1, 2), (3, 0)]
+    assert cluster[1]["score"] == 1.0
+
+
+def test_clusters_do_not_chain(fyyur, database):
+    database.execute("INSERT INTO artist (id, name, city, state, seeking_venue) VALUES "
+                     "(3, 'Petals Blue', 'Austin', 'TX', 0), (4, 'Petals Blues', 'Austin', 'TX', 0), "
+                     "(5, 'Petals Bluesy', 'Austin', 'TX', 0)")
+    threshold = float(scores(('Petals Blue', 'Petals Blues'))[0])
+    assert scores(('Petals Blue', 'Petals Bluesy'))[0] < threshold
+    # 5 is close enough to 4 to be grouped with it, but not to 3, the row that is kept
+    [cluster] = fyyur.dedup.clusters('artist', threshold=threshold)
+    assert cluster[0]["id"] == 3 and all(member["score"] >= threshold for member in cluster)
+    assert 5 not in [member["id"] for member in cluster]
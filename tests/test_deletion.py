@@ -0,0 +1,92 @@
+import pytest
+from flask import Flask
+
+from deletion import Deleter
+
+
+@pytest.fixture(params=['cascade', 'soft'])
+def mode(request, fyyur, database, monkeypatch):
+    monkeypatch.setattr(fyyur.deleter, 'mode', request.param)
+    database.execute("INSERT INTO show_archive (id, venue_id, artist_id, start_time) "
+                     "VALUES (10, 1, 1, '2015-05-01 21:00:00.000000')")
+    database.execute('DELETE FROM outbox_event')
+    fyyur.stats.backfill()
+    return request.param
+
+
+def rollups(engine):
+    return engine.execute('SELECT month, city, genre, shows FROM show_rollup WHERE shows > 0 '
+                          'ORDER BY month, city, genre').fetchall()
+
+
+def shows(engine, table='show'):
+    return [row[0] for row in engine.execute(f'SELECT id FROM {table} ORDER BY id')]
+
+
+def events(engine):
+    return {(row[0], row[1], row[2]) for row in engine.execute('SELECT entity, entity_id, op FROM outbox_event')}
+
+
+def test_delete_venue(fyyur, database, mode, monkeypatch):
+    before = rollups(database)
+    if mode == 'soft':
+        # archived shows keep counting under the same keys: nothing to recount
+        monkeypatch.setattr(fyyur.stats, 'recount', lambda *args: pytest.fail('recounted'))
+    assert fyyur.deleter.delete('venue', 1) == 'The Musical Hop'
+
+    if mode == 'cascade':
+        assert database.execute('SELECT count(*) FROM venue WHERE id = 1').scalar() == 0
+        assert shows(database) == [3] and shows(database, 'show_archive') == []
+        assert events(database) >= {('venue', 1, 'deleted'), ('show', 1, 'deleted'), ('show', 2, 'deleted'),
+                                    ('show', 10, 'deleted')}
+    else:
+        assert database.execute('SELECT deleted_at FROM venue WHERE id = 1').scalar() is not None
+        assert shows(database) == [3] and shows(database, 'show_archive') == [1, 2, 10]
+        assert rollups(database) == before
+        assert events(database) >= {('venue', 1, 'deleted'), ('show', 1, 'updated'), ('show', 2, 'updated')}
+    # kept up to date in the same transaction
+    live = rollups(database)
+    assert fyyur.stats.backfill() == (1 if mode == 'cascade' else 4)
+    assert rollups(database) == live
+    # gone either way
+    assert fyyur.deleter.delete('venue', 1) is None
+
+
+def test_delete_artist(fyyur, database, mode):
+    assert fyyur.deleter.delete('artist', 2) == 'Matt Quevedo'
+    assert shows(database) == [1]
+    assert shows(database, 'show_archive') == ([2, 3, 10] if mode == 'soft' else [10])
+
+
+def test_delete_route(fyyur, client, mode):
+    response = client.delete('/venues/2', headers={'Content-Type': 'application/json'})
+    assert response.status_code == 200
+    assert response.get_json() == {"id": 2, "name": 'Park Square Live Music & Coffee', "mode": mode}
+    assert client.delete('/venues/2', headers={'Content-Type': 'application/json'}).status_code == 404
+    assert client.delete('/artists/99').status_code == 404
+
+
+def test_soft_deleted_rows_are_not_listed(fyyur, client, monkeypatch):
+    monkeypatch.setattr(fyyur.deleter, 'mode', 'soft')
+    fyyur.deleter.delete('venue', 2)
+    assert fyyur.db.engine.execute('SELECT deleted_at FROM venue WHERE id = 2').scalar() is not None
+    page = client.get('/venues').get_data(as_text=True)
+    assert 'The Musical Hop' in page
+    assert 'Park Square Live Music' not in page
+
+
+def test_purge(fyyur, database, monkeypatch):
+    monkeypatch.setattr(fyyur.deleter, 'mode', 'soft')
+    fyyur.deleter.delete('venue', 1)
+    # not old enough yet
+    assert fyyur.deleter.purge('venue') == 0
+    assert fyyur.deleter.purge('venue', older_than_days=0) == 1
+    assert database.execute('SELECT count(*) FROM venue WHERE id = 1').scalar() == 0
+    assert shows(database) == [3] and shows(database, 'show_archive') == []
+
+
+def test_unknown_mode(fyyur):
+    app = Flask(__name__)
+    app.config['DELETE_MODE'] = 'hard'
+    with pytest.raises(ValueError):
+        Deleter(app, fyyur.db, fyyur.changes)
@@ -0,0 +1,83 @@
+import pytest
+
+from entity_cache import CACHED_TABLES, CacheStats
+
+
+@pytest.fixture
+def cache(fyyur, database, monkeypatch):
+    cache = fyyur.entity_cache
+    monkeypatch.setattr(cache, 'enabled', True)
+    monkeypatch.setattr(cache, 'ttl', 60)
+    monkeypatch.setattr(cache, '_stats', {table: CacheStats() for table in CACHED_TABLES})
+    cache._rows.clear()
+    cache._written.clear()
+    yield cache
+    cache._rows.clear()
+    cache._written.clear()
+
+
+def fresh_get(fyyur, cache, entity_id):
+    # a new request starts with an empty identity map
+    fyyur.db.session.remove()
+    return cache.get(fyyur.Venue, entity_id)
+
+
+def loads(fyyur, monkeypatch):
+    """Which database each miss read from, as 'session' or 'primary'."""
+    seen = []
+    load = fyyur.entity_cache._load
+    monkeypatch.setattr(fyyur.entity_cache, '_load', lambda mapper, entity_id, primary=False: (
+        seen.append('primary' if primary else 'session'), load(mapper, entity_id, primary))[1])
+    return seen
+
+
+def test_hits_skip_the_database(fyyur, cache, monkeypatch):
+    seen = loads(fyyur, monkeypatch)
+    assert fresh_get(fyyur, cache, 1).name == 'The Musical Hop'
+    venue = fresh_get(fyyur, cache, 1)
+    assert venue.name == 'The Musical Hop' and [show.id for show in venue.shows] == [1, 2]
+    assert seen == ['session']
+    assert cache.stats()["tables"]["venue"]["hits"] >= 1
+    assert fresh_get(fyyur, cache, 99) is None
+
+
+def test_commits_evict_and_read_the_primary_next(fyyur, cache, monkeypatch):
+    seen = loads(fyyur, monkeypatch)
+    fresh_get(fyyur, cache, 1).name = 'The Musical Hop Too'
+    # a change that is never committed does not reach the cache
+    fyyur.db.session.rollback()
+    assert fresh_get(fyyur, cache, 1).name == 'The Musical Hop'
+    fyyur.Venue.query.get(1).name = 'The Musical Hop Too'
+    fyyur.db.session.commit()
+    assert fresh_get(fyyur, cache, 1).name == 'The Musical Hop Too'
+    assert fresh_get(fyyur, cache, 2).name == 'Park Square Live Music & Coffee'
+    # the row just committed is read from the primary, others where the request reads
+    assert seen == ['session', 'primary', 'session']
+    assert cache.stats()["tables"]["venue"]["invalidations"] == 1
+
+
+def test_loads_overtaken_by_a_commit_are_not_stored(fyyur, cache):
+    values, generation, _ = cache._lookup('venue', 1)
+    assert values is None
+    fyyur.Venue.query.get(1).name = 'The Musical Hop Too'
+    fyyur.db.session.commit()
+    cache._store('venue', 1, {"id": 1, "name": 'The Musical Hop'}, generation)
+    assert ('venue', 1) not in cache._rows
+
+
+def test_expired_rows_are_loaded_again(fyyur, cache, monkeypatch):
+    fresh_get(fyyur, cache, 1)
+    fyyur.db.engine.execute("UPDATE venue SET name = 'Renamed elsewhere' WHERE id = 1")
+    assert fresh_get(fyyur, cache, 1).name == 'The Musical Hop'
+    monkeypatch.setattr(cache, 'ttl', 0)
+    cache._rows.clear()
+    fresh_get(fyyur, cache, 1)
+    assert fresh_get(fyyur, cache, 1).name == 'Renamed elsewhere'
+
+
+def test_lru_eviction(fyyur, cache, monkeypatch):
+    monkeypatch.setattr(cache, 'size', 1)
+    fresh_get(fyyur, cache, 1)
+    fresh_get(fyyur, cache, 2)
+    assert list(cache._rows) == [('venue', 2)]
+    assert cache.stats()["tables"]["venue"]["evictions"] == 1
@@ -0,0 +1,69 @@
+from datetime import datetime
+
+import pytest
+
+from feeds import ics_fold
+
+
+@pytest.fixture
+def feeds(fyyur, database):
+    fyyur.feeds._feeds.clear()
+    yield fyyur.feeds
+    fyyur.feeds._feeds.clear()
+
+
+def add_show(fyyur, venue_id, artist_id, start_time):
+    show = fyyur.Show(venue_id, artist_id, start_time)
+    fyyur.db.session.add(show)
+    fyyur.db.session.commit()
+    return show.id
+
+
+def test_ics_fold():
+    assert ics_fold('SUMMARY:short') == 'SUMMARY:short\r\n'
+    folded = ics_fold('SUMMARY:' + 'é' * 60)
+    lines = folded.split('\r\n ')
+    assert all(len(line.encode('utf-8')) <= 75 for line in lines)
+    # multi-byte characters are never split across lines
+    assert ''.join(lines) == 'SUMMARY:' + 'é' * 60 + '\r\n'
+
+
+def test_upcoming_shows_only(client, feeds):
+    data = client.get('/venues/1/calendar.json').get_json()
+    assert data["venue"] == {"id": 1, "name": 'The Musical Hop'}
+    assert [show["show_id"] for show in data["upcoming_shows"]] == [2]
+    ics = client.get('/artists/2/calendar.ics').get_data(as_text=True)
+    assert ics.count('BEGIN:VEVENT') == 2 and 'UID:show-3@fyyur' in ics
+    assert client.get('/venues/99/calendar.ics').status_code == 404
+
+
+def test_etag(client, feeds):
+    response = client.get('/venues/1/calendar.ics')
+    etag = response.headers['ETag']
+    assert client.get('/venues/1/calendar.ics', headers={'If-None-Match': etag}).status_code == 304
+    # rebuilt from scratch, the feed keeps its ETag
+    feeds._feeds.clear()
+    assert client.get('/venues/1/calendar.ics', headers={'If-None-Match': etag}).status_code == 304
+    assert client.get('/venues/1/calendar.json', headers={'If-None-Match': etag}).status_code == 200
+
+
+def test_new_shows_are_spliced_in(fyyur, client, feeds, monkeypatch):
+    etag = client.get('/venues/1/calendar.json').headers['ETag']
+    first = add_show(fyyur, 1, 1, datetime(2035, 3, 1, 20))
+    last = add_show(fyyur, 1, 2, datetime(2035, 5, 1, 20))
+    monkeypatch.setattr(feeds, '_load', lambda *args: pytest.fail('feed rebuilt'))
+    response = client.get('/venues/1/calendar.json', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert [show["show_id"] for show in response.get_json()["upcoming_shows"]] == [first, 2, last]
+    monkeypatch.undo()
+    # the same as a feed built from scratch
+    feeds._feeds.clear()
+    assert client.get('/venues/1/calendar.json', headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+
+
+def test_edits_drop_the_feed(fyyur, client, feeds):
+    client.get('/venues/1/calendar.json')
+    fyyur.Artist.query.get(2).name = 'Matt Quevedo Trio'
+    fyyur.db.session.commit()
+    data = client.get('/venues/1/calendar.json').get_json()
+    assert data["upcoming_shows"][0]["artist_name"] == 'Matt Quevedo Trio'
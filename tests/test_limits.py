@@ -0,0 +1,97 @@
+import time
+
+import pytest
+from flask import Flask
+
+from limits import ConcurrencyGate, Limiter, MemoryStore
+
+
+def make_app(**config):
+    app = Flask(__name__)
+    app.config.update(RATE_LIMIT_STORE='memory', RATE_LIMITS={'search': (1, 2), 'detail': (100, 100)},
+                      **config)
+    limiter = Limiter(app)
+
+    @app.route('/search', methods=['POST'])
+    @limiter.route_class('search')
+    def search():
+        return 'results'
+
+    @app.route('/venues/<int:venue_id>', methods=['GET', 'POST'])
+    def venue(venue_id):
+        return 'venue'
+
+    return app, limiter
+
+
+def search(client, address='10.0.0.1', **headers):
+    return client.post('/search', headers=headers, environ_base={'REMOTE_ADDR': address})
+
+
+def test_memory_store_refills():
+    store = MemoryStore(idle_after=10)
+    assert [store.take('client', 1, 2, 100.0)[0] for _ in range(3)] == [True, True, False]
+    assert store.take('client', 1, 2, 100.0)[1] == pytest.approx(1.0)
+    assert store.take('client', 1, 2, 101.0)[0]
+
+
+def test_over_budget_gets_429():
+    app, _ = make_app()
+    client = app.test_client()
+    assert [search(client).status_code for _ in range(3)] == [200, 200, 429]
+    response = search(client)
+    assert response.headers['Retry-After'] == '1'
+    # other clients and route classes have their own buckets
+    assert search(client, '10.0.0.2').status_code == 200
+    assert client.get('/venues/1', environ_base={'REMOTE_ADDR': '10.0.0.1'}).status_code == 200
+
+
+def test_forwarded_for_is_ignored_without_trusted_proxies():
+    app, _ = make_app()
+    client = app.test_client()
+    statuses = [search(client, '10.0.0.1', **{'X-Forwarded-For': f'192.0.2.{i}'}).status_code for i in range(3)]
+    assert statuses == [200, 200, 429]
+
+
+def test_clients_behind_a_trusted_proxy():
+    app, _ = make_app(RATE_LIMIT_PROXY_HOPS=1)
+    client = app.test_client()
+    proxy = '10.0.0.1'
+    assert [search(client, proxy, **{'X-Forwarded-For': '192.0.2.1'}).status_code for _ in range(3)] == [200, 200, 429]
+    assert search(client, proxy, **{'X-Forwarded-For': '192.0.2.2'}).status_code == 200
+    # only the entry the proxy appended counts, not one the client made up
+    assert search(client, proxy, **{'X-Forwarded-For': '198.51.100.7, 192.0.2.1'}).status_code == 429
+    # without the header the proxy itself is the client
+    assert search(client, proxy).status_code == 200
+
+
+def test_reads_are_shed_while_the_database_is_slow():
+    app, limiter = make_app(SHED_DB_LATENCY_MS=100)
+    client = app.test_client()
+    limiter.latency.average_ms, limiter.latency.sampled_at = 1000.0, time.time()
+    response = client.get('/venues/1')
+    assert response.status_code == 503 and response.headers['Retry-After'] == '5'
+    # writes are not shed
+    assert client.post('/venues/1').status_code == 200
+    # the average decays while nothing runs
+    limiter.latency.sampled_at -= 5 * limiter.latency.half_life
+    assert client.get('/venues/1').status_code == 200
+
+
+def test_full_gate_gets_503():
+    app, limiter = make_app(MAX_CONCURRENT_REQUESTS=1, MAX_QUEUED_REQUESTS=0)
+    client = app.test_client()
+    assert limiter.gate.enter()
+    assert client.get('/venues/1').status_code == 503
+    limiter.gate.leave()
+    assert client.get('/venues/1').status_code == 200
+    # the slot is given back after each request
+    assert limiter.gate.active == 0
+
+
+def test_queued_requests_wait_for_a_slot():
+    gate = ConcurrencyGate(max_active=1, max_queued=1, timeout=0.05)
+    assert gate.enter()
+    started = time.time()
+    assert not gate.enter()
+    assert time.time() - started >= 0.05 and gate.queued == 0
@@ -0,0 +1,68 @@
+import json
+import logging
+import queue
+import sys
+
+from flask import g
+
+from logs import JSONFormatter, NonBlockingQueueHandler, RequestContextFilter
+
+
+def record(level=logging.INFO, message='venue %s listed', args=('The Musical Hop',), **extra):
+    entry = logging.LogRecord('fyyur.test', level, __file__, 1, message, args, None)
+    entry.__dict__.update(extra)
+    return entry
+
+
+def test_json_lines():
+    line = json.loads(JSONFormatter().format(record(venue_id=1, skipped=None)))
+    assert line["level"] == 'INFO' and line["logger"] == 'fyyur.test'
+    assert line["message"] == 'venue The Musical Hop listed'
+    assert line["venue_id"] == 1 and 'skipped' not in line
+    assert line["ts"].endswith('Z')
+
+
+def test_exceptions_are_formatted_before_queueing():
+    handler = NonBlockingQueueHandler(queue.Queue(1))
+    try:
+        raise ValueError('boom')
+    except ValueError:
+        handler.handle(logging.LogRecord('fyyur.test', logging.ERROR, __file__, 1, 'failed', (), sys.exc_info()))
+    queued = handler.queue.get_nowait()
+    assert queued.exc_info is None and 'ValueError: boom' in queued.exc_text
+    assert 'ValueError: boom' in json.loads(JSONFormatter().format(queued))["exception"]
+
+
+def test_full_queue_drops_records():
+    handler = NonBlockingQueueHandler(queue.Queue(1))
+    handler.handle(record())
+    handler.handle(record())
+    assert handler.queue.qsize() == 1 and handler.dropped == 1
+
+
+def test_unsampled_requests_keep_warnings_only(fyyur):
+    sampling = RequestContextFilter(sample_rate=0.5)
+    with fyyur.app.test_request_context('/venues/1'):
+        g.request_id, g.log_sampled = 'abc', False
+        assert not sampling.filter(record())
+        warning = record(logging.WARNING)
+        assert sampling.filter(warning)
+        assert (warning.request_id, warning.path, warning.method) == ('abc', '/venues/1', 'GET')
+        g.log_sampled = True
+        assert sampling.filter(record())
+    # outside a request nothing is added or dropped
+    assert RequestContextFilter(sample_rate=0.0).filter(record())
+
+
+def test_request_line(client, caplog):
+    caplog.set_level(logging.INFO, logger='fyyur.request')
+    response = client.get('/venues/1/calendar.json', headers={'X-Request-ID': 'req-1'})
+    assert response.headers['X-Request-ID'] == 'req-1'
+    [line] = [entry for entry in caplog.records if entry.name == 'fyyur.request']
+    assert (line.request_id, line.route, line.status) == ('req-1', 'venue_calendar', 200)
+    assert line.db_statements >= 1 and line.db_ms >= 0 and line.latency_ms >= line.db_ms
+
+
+def test_invalid_request_ids_are_replaced(client):
+    response = client.get('/venues/1/calendar.json', headers={'X-Request-ID': 'no spaces allowed'})
+    assert len(response.headers['X-Request-ID']) == 32
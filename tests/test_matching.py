@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+from matching import CITY_WEIGHT, HISTORY_WEIGHT, SEEKING_WEIGHT, STATE_WEIGHT, SideIndex, Vocabulary, popcount
+
+
+@pytest.fixture
+def matches(fyyur, database):
+    # each test gets a fresh database, so start from an empty index
+    fyyur.matches.venues = fyyur.matches.artists = None
+    yield fyyur.matches
+    fyyur.matches.venues = fyyur.matches.artists = None
+
+
+def test_popcount():
+    words = np.array([[0, 1], [2 ** 64 - 1, 3]], dtype=np.uint64)
+    assert popcount(words).tolist() == [1, 66]
+
+
+def test_genre_bits_grow_past_one_word():
+    genres = Vocabulary('genre %d' % code for code in range(70))
+    side = SideIndex(genres, Vocabulary(), capacity=1)
+    side.upsert(1, 'The Musical Hop', 'San Francisco', 'CA', ['genre 3', 'genre 69'], True)
+    side.upsert(2, 'Park Square', 'San Francisco', 'CA', ['genre 69', 'genre 70'], False)
+    assert side.genres.shape == (2, 2) and side.size == 2
+    assert side.shared_genres(0, side.genres[1]) == ['genre 69']
+    assert side.name(2) == 'Park Square' and side.name(3) is None
+
+
+def test_rank_by_genres_place_and_history(matches):
+    genres = matches.genres
+    venues = SideIndex(genres, matches.places)
+    artists = SideIndex(genres, matches.places)
+    venues.upsert(1, 'The Musical Hop', 'San Francisco', 'CA', ['Jazz', 'Folk'], True)
+    artists.upsert(1, 'Same city', 'San Francisco', 'CA', [], False)
+    artists.upsert(2, 'Two genres', 'New York', 'NY', ['Jazz', 'Folk'], False)
+    artists.upsert(3, 'Only seeking', 'Austin', 'TX', [], True)
+    artists.upsert(4, 'Played here', 'Austin', 'TX', ['Folk'], True)
+    artists.remove(2)
+    history = np.zeros(artists.ids.shape[0])
+    history[artists.rows[4]] = 2
+    ranked = matches._rank(venues, artists, 1, history, limit=10)
+    assert [(match["id"], match["score"]) for match in ranked] == [
+        (4, round(3.0 + HISTORY_WEIGHT * np.log1p(2) + SEEKING_WEIGHT, 2)),
+        (1, CITY_WEIGHT + STATE_WEIGHT),
+    ]
+    assert ranked[0]["shared_genres"] == ['Folk'] and ranked[0]["past_shows"] == 2
+    assert matches._rank(venues, artists, 1, history, limit=1) == ranked[:1]
+    assert matches._rank(venues, artists, 99, history, limit=10) is None
+
+
+def test_artists_for_venue(matches):
+    # same city and state, a past show together and seeking; Matt Quevedo shares nothing
+    [match] = matches.artists_for_venue(1)
+    assert (match["id"], match["name"], match["past_shows"]) == (1, 'Guns N Petals', 1)
+    assert match["score"] == round(CITY_WEIGHT + STATE_WEIGHT + HISTORY_WEIGHT * np.log1p(1) + SEEKING_WEIGHT, 2)
+    assert [venue["id"] for venue in matches.venues_for_artist(1)] == [1, 2]
+    assert matches.artists_for_venue(99) is None
+
+
+def test_edits_are_applied_incrementally(fyyur, matches):
+    matches.artists_for_venue(1)
+    artists = matches.artists
+    artist = fyyur.Artist.query.get(2)
+    artist.city, artist.state = 'San Francisco', 'CA'
+    fyyur.db.session.commit()
+    assert {match["id"] for match in matches.artists_for_venue(1)} == {1, 2}
+    fyyur.deleter.delete('artist', 1)
+    assert [match["id"] for match in matches.artists_for_venue(1)] == [2]
+    assert matches.artists is artists and matches.artist_name(2) == 'Matt Quevedo'
+
+
+def test_matches_page(client, matches):
+    page = client.get('/venues/1/matches').get_data(as_text=True)
+    assert 'Guns N Petals' in page
+    assert client.get('/venues/99/matches').status_code == 404
@@ -0,0 +1,74 @@
+import pytest
+from alembic.migration import MigrationContext
+from alembic.operations import Operations
+from sqlalchemy import create_engine
+
+import online_migrations
+from online_migrations import backfill, create_index, format_seconds
+
+
+@pytest.fixture
+def connection(tmp_path, monkeypatch):
+    monkeypatch.setattr(online_migrations, 'is_dry_run', lambda: False)
+    monkeypatch.setattr(online_migrations.time, 'sleep', lambda seconds: None)
+    engine = create_engine(f'sqlite:///{tmp_path}/migrate.db')
+    engine.execute('CREATE TABLE venue (id INTEGER PRIMARY KEY, city TEXT, city_key TEXT)')
+    engine.execute("INSERT INTO venue (id, city) VALUES (1, 'San Francisco'), (2, 'New York'), (4, 'Austin'), "
+                   "(5, 'Oakland'), (9, 'Portland')")
+    with engine.connect() as connection:
+        with Operations.context(MigrationContext.configure(connection)):
+            yield connection
+
+
+def city_keys(connection):
+    return [row[0] for row in connection.execute('SELECT city_key FROM venue ORDER BY id')]
+
+
+def progress(connection):
+    return connection.execute('SELECT last_key, rows_done, finished_at IS NOT NULL FROM migration_backfill').first()
+
+
+def test_backfill_in_batches(connection):
+    backfill('venue_city_key', 'venue', 'city_key = lower(city)', 'city_key IS NULL', batch_size=2)
+    assert city_keys(connection) == ['san francisco', 'new york', 'austin', 'oakland', 'portland']
+    assert progress(connection) == (9, 5, True)
+
+
+def test_finished_backfills_do_not_run_again(connection):
+    backfill('venue_city_key', 'venue', 'city_key = lower(city)', 'city_key IS NULL', batch_size=2)
+    connection.execute('UPDATE venue SET city_key = NULL')
+    backfill('venue_city_key', 'venue', 'city_key = lower(city)', 'city_key IS NULL', batch_size=2)
+    assert city_keys(connection) == [None] * 5
+
+
+def test_interrupted_backfills_resume(connection):
+    connection.execute(online_migrations.PROGRESS_TABLE)
+    # stopped after committing the batch that ended at id 2
+    connection.execute("INSERT INTO migration_backfill (name, last_key, rows_done, started_at, updated_at) "
+                       "VALUES ('venue_city_key', 2, 2, '2026-01-01 00:00:00', '2026-01-01 00:00:00')")
+    backfill('venue_city_key', 'venue', 'city_key = lower(city)', 'city_key IS NULL', batch_size=2)
+    assert city_keys(connection) == [None, None, 'austin', 'oakland', 'portland']
+    assert progress(connection) == (9, 5, True)
+
+
+def test_slow_batches_shrink(connection, monkeypatch):
+    batches = []
+    next_batch = online_migrations._next_batch
+    monkeypatch.setattr(online_migrations, '_next_batch', lambda connection, table_name, key, after, size: (
+        batches.append(size), next_batch(connection, table_name, key, after, size))[1])
+    backfill('venue_city_key', 'venue', 'city_key = lower(city)', 'city_key IS NULL', batch_size=40,
+             max_batch_seconds=0)
+    # every batch takes longer than zero seconds: the lookup after the first is already halved
+    assert batches == [40, 20]
+    assert city_keys(connection)[-1] == 'portland'
+
+
+def test_create_index_elsewhere_than_postgresql(connection):
+    create_index('ix_venue_city_pending', 'venue', ['city'], where='city_key IS NULL')
+    sql = connection.execute("SELECT sql FROM sqlite_master WHERE name = 'ix_venue_city_pending'").scalar()
+    assert 'WHERE city_key IS NULL' in sql
+
+
+@pytest.mark.parametrize('seconds, text', [(1.25, '1.2s'), (90, '1.5min'), (5400, '1.5h')])
+def test_format_seconds(seconds, text):
+    assert format_seconds(seconds) == text
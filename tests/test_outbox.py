@@ -0,0 +1,149 @@
+import json
+from datetime import datetime, timedelta
+
+import pytest
+from flask import Flask
+from sqlalchemy import text
+
+from changes import ChangeTracker
+from outbox import INSERT_EVENT, DeliveryFailed, Outbox, and_later, in_order
+
+
+class RecordingSink(object):
+    def __init__(self, fail=None):
+        self.batches = []
+        # None delivers everything, True fails the whole batch, a set fails those event ids
+        self.fail = fail
+
+    def deliver(self, events):
+        self.batches.append([event["event_id"] for event in events])
+        if self.fail is True:
+            raise DeliveryFailed('down')
+        if self.fail:
+            raise DeliveryFailed('partly down', [event["event_id"] for event in events
+                                                 if event["event_id"] in self.fail])
+
+
+@pytest.fixture
+def outbox(fyyur, database, monkeypatch):
+    database.execute('DELETE FROM outbox_event')
+    monkeypatch.setitem(fyyur.outbox.config, 'OUTBOX_BACKOFF_SECONDS', 2)
+    monkeypatch.setitem(fyyur.outbox.config, 'OUTBOX_MAX_BACKOFF_SECONDS', 600)
+    monkeypatch.setitem(fyyur.outbox.config, 'OUTBOX_BATCH_SIZE', 100)
+    monkeypatch.setattr(fyyur.outbox, 'sinks', [])
+    return fyyur.outbox
+
+
+def add_events(engine, *entities, created_at=None):
+    created_at = created_at or datetime.utcnow() - timedelta(seconds=1)
+    for entity, entity_id in entities:
+        payload = json.dumps({"entity": entity, "id": entity_id, "op": "updated"})
+        engine.execute(text(INSERT_EVENT), entity=entity, entity_id=entity_id, op='updated', payload=payload,
+                       created_at=created_at)
+
+
+def events(engine):
+    return {row[0]: row[1:] for row in engine.execute(
+        'SELECT id, delivered_at IS NOT NULL, attempts, available_at, last_error FROM outbox_event')}
+
+
+def test_delivers_a_batch(outbox, database):
+    add_events(database, ('venue', 1), ('venue', 1), ('artist', 2))
+    sink = RecordingSink()
+    outbox.sinks = [sink]
+    assert outbox.dispatch_batch() == (3, 0)
+    assert sink.batches == [[1, 2, 3]]
+    assert all(delivered and attempts == 1 for delivered, attempts, _, _ in events(database).values())
+    assert outbox.dispatch_batch() == (0, 0)
+
+
+def test_failed_events_back_off_exponentially(outbox, database):
+    add_events(database, ('venue', 1))
+    outbox.sinks = [RecordingSink(fail=True)]
+    for attempt, base in enumerate((2, 4, 8)):
+        database.execute('UPDATE outbox_event SET available_at = :now', now=datetime.utcnow() - timedelta(seconds=1))
+        started = datetime.utcnow()
+        assert outbox.dispatch_batch() == (0, 1)
+        delivered, attempts, available_at, error = events(database)[1]
+        assert not delivered and attempts == attempt + 1 and error == 'down'
+        available_at = datetime.strptime(available_at, '%Y-%m-%d %H:%M:%S.%f')
+        # jittered between half and all of the delay
+        assert started + timedelta(seconds=base / 2 - 1) <= available_at <= datetime.utcnow() + timedelta(seconds=base)
+        # not claimed again before it is due
+        assert outbox.dispatch_batch() == (0, 0)
+
+
+def test_backoff_is_capped(outbox, monkeypatch):
+    monkeypatch.setitem(outbox.config, 'OUTBOX_MAX_BACKOFF_SECONDS', 60)
+    assert outbox._backoff(30) <= timedelta(seconds=60)
+    assert outbox._backoff(0) <= timedelta(seconds=2)
+
+
+def test_retries_keep_entity_order(outbox, database):
+    add_events(database, ('venue', 1), ('venue', 1), ('artist', 2), ('venue', 1))
+    first, second = RecordingSink(fail={1}), RecordingSink()
+    outbox.sinks = [first, second]
+    # event 1 failed, so 2 and 4 of the same venue wait with it; the artist's event goes out
+    assert outbox.dispatch_batch() == (1, 3)
+    assert second.batches == [[3]]
+    state = events(database)
+    assert [event_id for event_id, (delivered, *_) in sorted(state.items()) if delivered] == [3]
+    # an entity whose oldest event is backing off is not claimed at all
+    add_events(database, ('venue', 1), ('venue', 5))
+    first.fail, first.batches = None, []
+    assert outbox.dispatch_batch() == (1, 0)
+    assert first.batches == [[6]]
+
+
+def test_claims_consecutive_events_per_entity(outbox, database):
+    add_events(database, *[('venue', 1)] * 5)
+    sink = RecordingSink()
+    outbox.sinks = [sink]
+    assert outbox.dispatch_batch() == (5, 0)
+    assert sink.batches == [[1, 2, 3, 4, 5]]
+
+
+def test_in_order_drops_rows_after_a_gap():
+    # (id, entity, entity_id, op, payload, created_at, attempts, ahead)
+    rows = [(1, 'venue', 1, None, None, None, 0, 0), (2, 'venue', 2, None, None, None, 0, 1),
+            (3, 'venue', 1, None, None, None, 0, 1), (5, 'venue', 1, None, None, None, 0, 3)]
+    # venue 2 has an earlier event locked elsewhere; venue 1 misses event 4
+    assert [row[0] for row in in_order(rows)] == [1, 3]
+
+
+def test_and_later_extends_failures_to_later_events():
+    batch = [{"event_id": 1, "entity": 'venue', "id": 1}, {"event_id": 2, "entity": 'artist', "id": 1},
+             {"event_id": 3, "entity": 'venue', "id": 1}]
+    assert and_later(batch, {1}) == {1, 3}
+    assert and_later(batch, {3}) == {3}
+
+
+def test_writes_events_only_with_sinks(fyyur):
+    changes = ChangeTracker()
+    assert not Outbox(Flask(__name__), fyyur.db, changes).enabled
+    assert changes._flush_listeners == []
+    app = Flask(__name__)
+    app.config['OUTBOX_SINKS'] = ['file:///tmp/events.jsonl']
+    assert Outbox(app, fyyur.db, changes).enabled
+    assert changes._flush_listeners
+
+
+def test_write_appends_events(fyyur, outbox, database):
+    fyyur.Venue.query.get(1).name = 'The Musical Hop Too'
+    fyyur.db.session.commit()
+    [(entity, entity_id, op, payload)] = database.execute(
+        'SELECT entity, entity_id, op, payload FROM outbox_event').fetchall()
+    assert (entity, entity_id, op) == ('venue', 1, 'updated')
+    assert json.loads(payload)["data"]["name"] == 'The Musical Hop Too'
+
+
+def test_purge(outbox, database):
+    long_ago = datetime.utcnow() - timedelta(days=60)
+    add_events(database, ('venue', 1), ('venue', 2), created_at=long_ago)
+    add_events(database, ('venue', 3), ('venue', 4))
+    add_events(database, ('venue', 5), created_at=datetime.utcnow() - timedelta(days=10))
+    database.execute('UPDATE outbox_event SET delivered_at = :at WHERE id = 1', at=long_ago)
+    database.execute('UPDATE outbox_event SET delivered_at = :at WHERE id = 3', at=datetime.utcnow())
+    # 1 delivered long ago, 2 never delivered and too old; 3 delivered recently enough, 4 and 5 still due
+    assert outbox.purge() == (1, 1)
+    assert sorted(events(database)) == [3, 4, 5]
@@ -0,0 +1,46 @@
+from datetime import datetime
+
+from partitions import add_months, month_floor, partition_name
+
+
+def shows(engine, table='show'):
+    return [row[0] for row in engine.execute(f'SELECT id FROM {table} ORDER BY id')]
+
+
+def test_months():
+    assert month_floor(datetime(2035, 4, 8, 20, 30)) == datetime(2035, 4, 1)
+    assert add_months(datetime(2035, 11, 1), 3) == datetime(2036, 2, 1)
+    assert add_months(datetime(2035, 1, 1), -1) == datetime(2034, 12, 1)
+    assert partition_name(datetime(2035, 4, 1)) == 'show_2035_04'
+
+
+def test_archive_cutoff(fyyur):
+    partitions = fyyur.show_partitions
+    assert partitions.archive_cutoff(datetime(2021, 5, 21, 12)) == datetime(2019, 5, 1)
+
+
+def test_old_shows_move_to_the_archive(fyyur, database):
+    # SQLite has no partitions: old rows are moved one by one
+    assert fyyur.show_partitions.maintain(datetime(2021, 6, 1)) == ([], 1)
+    assert shows(database) == [2, 3] and shows(database, 'show_archive') == [1]
+    # nothing left to move
+    assert fyyur.show_partitions.maintain(datetime(2021, 6, 1)) == ([], 0)
+    assert fyyur.show_partitions.maintain(datetime(2020, 6, 1)) == ([], 0)
+
+
+def test_maintain_command(fyyur, database, monkeypatch):
+    monkeypatch.setattr(fyyur.show_partitions, 'archive_after_months', 24)
+    result = fyyur.app.test_cli_runner().invoke(args=['shows', 'maintain', '--keep', '1000'])
+    assert result.exit_code == 0 and 'archived 0 shows' in result.output
+    result = fyyur.app.test_cli_runner().invoke(args=['shows', 'maintain', '--keep', '12'])
+    assert 'archived 1 shows' in result.output
+    assert shows(database, 'show_archive') == [1]
+
+
+def test_past_shows_stop_at_the_cutoff(fyyur, client, database, monkeypatch):
+    database.execute("UPDATE venue SET genres = '[]'")
+    monkeypatch.setattr(fyyur.show_partitions, 'archive_after_months', 1000)
+    assert 'Guns N Petals' in client.get('/venues/1').get_data(as_text=True)
+    # past the cutoff the show is left out, archived or not
+    monkeypatch.setattr(fyyur.show_partitions, 'archive_after_months', 12)
+    assert 'Guns N Petals' not in client.get('/venues/1').get_data(as_text=True)
@@ -0,0 +1,74 @@
+import os
+from datetime import datetime
+
+import pytest
+
+from changes import ChangeSet
+
+
+@pytest.fixture
+def publisher(fyyur, database, tmp_path, monkeypatch):
+    # the detail templates loop over genres, which the SQLite schema cannot hold as an array
+    database.execute("UPDATE venue SET genres = '[]'")
+    database.execute("UPDATE artist SET genres = '[]'")
+    monkeypatch.setattr(fyyur.publisher, 'directory', str(tmp_path / 'published'))
+    return fyyur.publisher
+
+
+def changeset(**ids):
+    changes = ChangeSet()
+    for key, values in ids.items():
+        op, table = key.split('_')
+        changes.add(table, op, values)
+    return changes
+
+
+def published(publisher):
+    return sorted(os.path.relpath(os.path.join(directory, name), publisher.directory)
+                  for directory, _, names in os.walk(publisher.directory) for name in names)
+
+
+def test_a_venue_edit_renders_the_artists_playing_there(publisher):
+    assert publisher.affected_paths(changeset(updated_venue={2})) == {'/venues', '/artists', '/shows', '/venues/2',
+                                                                      '/artists/2'}
+
+
+def test_an_artist_edit(publisher):
+    assert publisher.affected_paths(changeset(updated_artist={1})) == {'/venues', '/artists', '/shows', '/artists/1',
+                                                                       '/venues/1'}
+
+
+def test_a_new_show_renders_both_sides(publisher):
+    changes = changeset(created_show={4})
+    changes.show_parents.update({('venue', 2), ('artist', 1)})
+    # only the two pages listing the show; nothing else shows it
+    assert publisher.affected_paths(changes) == {'/venues', '/artists', '/shows', '/venues/2', '/artists/1'}
+
+
+def test_due_paths(publisher):
+    # show 2 (venue 1, artist 2) starts 2035-04-01 20:00, show 3 (venue 2, artist 2) a week later
+    assert publisher.due_paths(datetime(2035, 3, 1), datetime(2035, 4, 2)) == {'/venues/1', '/artists/2'}
+    assert publisher.due_paths(datetime(2035, 4, 1, 20), datetime(2035, 4, 2)) == set()
+    assert publisher.due_paths(datetime(2035, 3, 1), datetime(2035, 5, 1)) == {'/venues/1', '/venues/2',
+                                                                               '/artists/2'}
+
+
+def test_rebuild(publisher):
+    os.makedirs(os.path.join(publisher.directory, 'venues', '99'))
+    open(os.path.join(publisher.directory, 'venues', '99', 'index.html'), 'w').close()
+    assert publisher.rebuild() == (8, 1)
+    assert published(publisher) == ['.rendered-until', 'artists/1/index.html', 'artists/2/index.html',
+                                    'artists/index.html', 'index.html', 'shows/index.html', 'venues/1/index.html',
+                                    'venues/2/index.html', 'venues/index.html']
+
+
+def test_publish_due(publisher, monkeypatch):
+    # the first run has nothing to go by and renders everything
+    assert publisher.publish_due() == 8
+    rendered = []
+    monkeypatch.setattr(publisher, 'render', lambda path, client=None: rendered.append(path))
+    assert publisher.publish_due() == 0
+    publisher._stamp(datetime(2035, 3, 1))
+    assert publisher.publish_due(datetime(2035, 4, 2)) == 2 and rendered == ['/artists/2', '/venues/1']
+    assert publisher._rendered_until() == datetime(2035, 4, 2)
+
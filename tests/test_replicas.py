@@ -0,0 +1,121 @@
+import time
+
+import pytest
+from flask import Flask
+
+from replicas import STICKY_COOKIE, RoutingSQLAlchemy
+
+
+@pytest.fixture
+def routing(tmp_path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{tmp_path}/primary.db'
+    app.config['SQLALCHEMY_REPLICA_URIS'] = [f'sqlite:///{tmp_path}/replica.db']
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db = RoutingSQLAlchemy(app)
+
+    class Thing(db.Model):
+        id = db.Column(db.Integer, primary_key=True)
+
+    @app.route('/things', methods=['GET', 'POST'])
+    def things():
+        return ''
+
+    return app, db, Thing
+
+
+def bind_for(app, db, method='GET', **kwargs):
+    with app.test_request_context('/things', method=method, **kwargs):
+        return db.session.get_bind()
+
+
+def test_safe_requests_read_from_a_replica(routing):
+    app, db, _ = routing
+    assert bind_for(app, db) is db.replicas.replicas[0].engine
+    assert bind_for(app, db, method='HEAD') is db.replicas.replicas[0].engine
+
+
+def test_unsafe_requests_use_the_primary(routing):
+    app, db, _ = routing
+    with app.app_context():
+        primary = db.engine
+        assert bind_for(app, db, method='POST') is primary
+        assert db.session.get_bind() is primary
+
+
+def test_sticky_cookie_keeps_reads_on_the_primary(routing):
+    app, db, _ = routing
+    with app.app_context():
+        primary = db.engine
+    fresh = {'HTTP_COOKIE': f'{STICKY_COOKIE}={time.time() + 5}'}
+    assert bind_for(app, db, environ_base=fresh) is primary
+    expired = {'HTTP_COOKIE': f'{STICKY_COOKIE}={time.time() - 5}'}
+    assert bind_for(app, db, environ_base=expired) is db.replicas.replicas[0].engine
+    garbled = {'HTTP_COOKIE': f'{STICKY_COOKIE}=soon'}
+    assert bind_for(app, db, environ_base=garbled) is db.replicas.replicas[0].engine
+
+
+def test_writes_set_the_sticky_cookie(routing):
+    app, db, _ = routing
+    response = app.test_client().post('/things')
+    assert STICKY_COOKIE in response.headers.get('Set-Cookie', '')
+    response = app.test_client().get('/things')
+    assert 'Set-Cookie' not in response.headers
+
+
+def test_pending_changes_use_the_primary(routing):
+    app, db, Thing = routing
+    with app.test_request_context('/things'):
+        replica = db.session.get_bind()
+        db.session.add(Thing())
+        assert replica is not db.engine
+        assert db.session.get_bind() is db.engine
+
+
+def test_internal_renders_read_the_primary(routing):
+    app, db, _ = routing
+    with app.app_context():
+        primary = db.engine
+    assert bind_for(app, db, environ_base={'fyyur.read_primary': True}) is primary
+
+
+def test_unhealthy_replicas_are_skipped(routing):
+    app, db, _ = routing
+    replica = db.replicas.replicas[0]
+    replica.healthy, replica.checked_at = False, time.time()
+    with app.app_context():
+        primary = db.engine
+    assert bind_for(app, db) is primary
+
+
+def test_health_checks_run_in_the_background(routing):
+    app, db, _ = routing
+    replica = db.replicas.replicas[0]
+    replica._checking.acquire()
+    try:
+        # a probe already running is not joined by a second one
+        assert not replica.check_in_background()
+        assert db.replicas.healthy() == [replica]
+    finally:
+        replica._checking.release()
+    assert replica.check_in_background()
+    deadline = time.time() + 5
+    while replica.checked_at == 0 and time.time() < deadline:
+        time.sleep(0.01)
+    assert replica.healthy and replica.checked_at > 0
+
+
+def test_least_loaded_selection(tmp_path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{tmp_path}/primary.db'
+    app.config['SQLALCHEMY_REPLICA_URIS'] = [f'sqlite:///{tmp_path}/one.db', f'sqlite:///{tmp_path}/two.db']
+    app.config['SQLALCHEMY_REPLICA_SELECTION'] = 'least_loaded'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db = RoutingSQLAlchemy(app)
+    one, two = db.replicas.replicas
+    for replica in (one, two):
+        replica.checked_at = time.time()
+    one.in_flight, two.in_flight = 3, 1
+    assert db.replicas.pick() is two
+    one.in_flight = 0
+    assert db.replicas.pick() is one
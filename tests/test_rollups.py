@@ -0,0 +1,72 @@
+from datetime import date, datetime
+
+import pytest
+
+from rollups import ALL_GENRES, rollup_keys
+
+
+@pytest.fixture
+def stats(fyyur, database):
+    fyyur.stats.backfill()
+    return fyyur.stats
+
+
+def rollups(engine):
+    return engine.execute("SELECT month, city, shows FROM show_rollup WHERE genre = '*' AND shows > 0 "
+                          "ORDER BY month, city").fetchall()
+
+
+def check_against_backfill(fyyur, database):
+    live = rollups(database)
+    fyyur.stats.backfill()
+    assert rollups(database) == live
+    return live
+
+
+def test_rollup_keys():
+    keys = rollup_keys(datetime(2035, 4, 1, 20), 'San Francisco', 'CA', ['Jazz', 'Folk', 'Jazz'])
+    assert sorted(keys) == [(date(2035, 4, 1), 'San Francisco', 'CA', genre) for genre in (ALL_GENRES, 'Folk', 'Jazz')]
+    assert rollup_keys(datetime(2035, 4, 1), 'Oakland', 'CA', None) == [(date(2035, 4, 1), 'Oakland', 'CA', '*')]
+
+
+def test_backfill(fyyur, database):
+    assert fyyur.stats.backfill() == 3
+    assert rollups(database) == [('2019-05-01', 'San Francisco', 1), ('2035-04-01', 'San Francisco', 2)]
+
+
+def test_new_moved_and_deleted_shows(fyyur, database, stats):
+    show = fyyur.Show(2, 1, datetime(2035, 5, 2, 20))
+    fyyur.db.session.add(show)
+    fyyur.db.session.commit()
+    assert check_against_backfill(fyyur, database)[-1] == ('2035-05-01', 'San Francisco', 1)
+
+    fyyur.Show.query.get(show.id).start_time = datetime(2035, 4, 20, 20)
+    fyyur.db.session.commit()
+    assert check_against_backfill(fyyur, database)[-1] == ('2035-04-01', 'San Francisco', 3)
+
+    fyyur.db.session.delete(fyyur.Show.query.get(show.id))
+    fyyur.db.session.commit()
+    assert check_against_backfill(fyyur, database)[-1] == ('2035-04-01', 'San Francisco', 2)
+
+
+def test_a_venue_moving_takes_its_history(fyyur, database, stats):
+    venue = fyyur.Venue.query.get(2)
+    venue.city = 'Oakland'
+    fyyur.db.session.commit()
+    assert check_against_backfill(fyyur, database) == [
+        ('2019-05-01', 'San Francisco', 1), ('2035-04-01', 'Oakland', 1), ('2035-04-01', 'San Francisco', 1)]
+
+
+def test_rolled_back_writes_leave_no_trace(fyyur, database, stats):
+    fyyur.db.session.add(fyyur.Show(2, 1, datetime(2035, 5, 2, 20)))
+    fyyur.db.session.flush()
+    fyyur.db.session.rollback()
+    assert check_against_backfill(fyyur, database)[-1] == ('2035-04-01', 'San Francisco', 2)
+
+
+def test_report(client, stats):
+    report = client.get('/stats.json?since=2030-01').get_json()
+    assert report["by_month"] == [{"month": '2035-04', "shows": 2}]
+    assert report["by_city"] == [{"city": 'San Francisco', "state": 'CA', "shows": 2}]
+    assert report["by_genre"] == []
+    assert client.get('/stats.json?city=Oakland').get_json()["by_month"] == []
@@ -0,0 +1,84 @@
+import pytest
+
+VENUE = {
+    "name": 'The Dueling Pianos Bar', "city": 'New York', "state": 'NY', "address": '335 Delancey Street',
+    "phone": '914-003-1132', "genres": ['Classical', 'R&B'], "facebook_link": 'https://www.facebook.com/pianos',
+    "website": 'https://www.theduelingpianos.com', "seeking_talent": False,
+}
+
+
+def test_valid_venue(fyyur):
+    clean, errors = fyyur.venue_schema.validate(VENUE)
+    assert errors == {}
+    assert clean["name"] == VENUE["name"] and clean["genres"] == VENUE["genres"]
+    assert clean["seeking_talent"] is False and clean["image_link"] is None
+
+
+@pytest.mark.parametrize('record', [['name', 'city'], 'name=x', 42, None])
+def test_records_must_be_objects(fyyur, record):
+    assert fyyur.venue_schema.validate(record) == ({}, {"record": ['Must be an object.']})
+
+
+@pytest.mark.parametrize('field, value, message', [
+    ('name', ['The Dueling Pianos Bar'], 'Must be a string.'),
+    ('name', {"first": 'Dueling'}, 'Must be a string.'),
+    ('city', 12, 'Must be a string.'),
+    ('state', True, 'Must be a string.'),
+    ('genres', ['Jazz', 7], 'Must be a list of strings.'),
+    ('genres', [['Jazz']], 'Must be a list of strings.'),
+    ('genres', ['Polka'], 'Not a valid choice: Polka.'),
+    ('seeking_talent', 1, 'Must be a string or a boolean.'),
+    ('seeking_talent', 'maybe', 'Must be True or False.'),
+    ('website', 'not a url', 'Invalid URL.'),
+])
+def test_field_errors(fyyur, field, value, message):
+    clean, errors = fyyur.venue_schema.validate(dict(VENUE, **{field: value}))
+    assert errors == {field: [message]}
+    assert field not in clean
+
+
+def test_missing_required_fields(fyyur):
+    _, errors = fyyur.venue_schema.validate({})
+    assert errors["name"] == ['This field is required.']
+    assert errors["genres"] == ['This field is required.']
+    # the radio default fills in a missing answer
+    assert 'seeking_talent' not in errors
+
+
+@pytest.mark.parametrize('value, message', [
+    (1.5, 'Must be a string or a whole number.'),
+    (True, 'Must be a string or a whole number.'),
+    ([1], 'Must be a string or a whole number.'),
+    ('one', 'Must be a whole number.'),
+])
+def test_show_ids_must_be_whole_numbers(fyyur, value, message):
+    _, errors = fyyur.show_schema.validate({"venue_id": value, "artist_id": '1', "start_time": '2035-01-01 20:00'})
+    assert errors == {"venue_id": [message]}
+
+
+def test_show_references_are_checked_in_one_batch(fyyur, database):
+    database.execute("UPDATE venue SET deleted_at = '2026-01-01 00:00:00.000000' WHERE id = 2")
+    results = fyyur.show_schema.validate_many([
+        {"venue_id": 1, "artist_id": 2, "start_time": '2035-01-01 20:00'},
+        {"venue_id": '99', "artist_id": 1, "start_time": '2035-01-01 20:00'},
+        {"venue_id": 2, "artist_id": 1, "start_time": '2035-01-01 20:00'},
+    ], fyyur.db.session)
+    assert [errors for _, errors in results] == [
+        {}, {"venue_id": ['No venue with id 99.']}, {"venue_id": ['No venue with id 2.']}]
+
+
+def test_json_body_must_be_an_object(client):
+    response = client.post('/venues/create', json=[VENUE])
+    assert response.status_code == 400
+    assert response.get_json() == {"errors": {"body": ['Must be a JSON object.']}}
+
+
+def test_malformed_json_is_rejected(client):
+    response = client.post('/venues/create', data='{"name": ', content_type='application/json')
+    assert response.status_code == 400
+
+
+def test_json_field_errors(client):
+    response = client.post('/venues/create', json=dict(VENUE, name=None, city=['New York']))
+    assert response.status_code == 400
+    assert response.get_json() == {"errors": {"name": ['This field is required.'], "city": ['Must be a string.']}}
@@ -0,0 +1,101 @@
+import os
+
+import pytest
+from flask import Flask, flash, get_flashed_messages, session
+from flask_sqlalchemy import SQLAlchemy
+
+from sessions import Sessions, load_keyring
+
+STORES = [None, 'memory', 'filesystem', 'sql']
+
+
+def make_app(tmp_path, store, keys):
+    app = Flask(__name__)
+    app.config.update(SECRET_KEYS=keys, SESSION_STORE=store, SESSION_FILE_DIR=str(tmp_path / 'sessions'),
+                      SQLALCHEMY_DATABASE_URI=os.environ['FYYUR_DATABASE_URL'], SQLALCHEMY_TRACK_MODIFICATIONS=False)
+    db = SQLAlchemy(app)
+    Sessions(app, db)
+
+    @app.route('/flash', methods=['POST'])
+    def post():
+        flash('Venue The Musical Hop was successfully listed!')
+        return '', 302
+
+    @app.route('/remember/<value>', methods=['POST'])
+    def remember(value):
+        session['value'] = value
+        return ''
+
+    @app.route('/messages')
+    def messages():
+        return ' | '.join(get_flashed_messages())
+
+    @app.route('/recall')
+    def recall():
+        return session.get('value', '')
+
+    return app
+
+
+def worker(tmp_path, store, keys):
+    # a client without a cookie jar of its own, sending the cookie another worker set
+    return make_app(tmp_path, store, keys).test_client(use_cookies=False)
+
+
+def session_cookie(response):
+    return response.headers['Set-Cookie'].split(';')[0]
+
+
+@pytest.mark.parametrize('store', STORES)
+def test_flash_survives_the_redirect(tmp_path, database, store):
+    client = make_app(tmp_path, store, ['key']).test_client()
+    response = client.post('/flash')
+    assert response.status_code == 302
+    if store:
+        # only a signed id travels in the cookie
+        assert 'Musical' not in session_cookie(response) and len(session_cookie(response)) < 200
+    assert client.get('/messages').get_data(as_text=True) == 'Venue The Musical Hop was successfully listed!'
+    assert client.get('/messages').get_data(as_text=True) == ''
+
+
+# the memory store is per process
+@pytest.mark.parametrize('store', [None, 'filesystem', 'sql'])
+def test_another_worker_reads_the_session(tmp_path, database, store):
+    cookie = session_cookie(make_app(tmp_path, store, ['key']).test_client().post('/remember/hop'))
+    other = worker(tmp_path, store, ['key'])
+    assert other.get('/recall', headers={'Cookie': cookie}).get_data(as_text=True) == 'hop'
+
+
+@pytest.mark.parametrize('store', [None, 'filesystem', 'sql'])
+def test_rotated_keys_still_verify_old_sessions(tmp_path, database, store):
+    cookie = session_cookie(make_app(tmp_path, store, ['old-key']).test_client().post('/remember/hop'))
+    rotated = worker(tmp_path, store, ['new-key', 'old-key'])
+    assert rotated.get('/recall', headers={'Cookie': cookie}).get_data(as_text=True) == 'hop'
+    # new sessions are signed with the new key only
+    fresh = session_cookie(rotated.post('/remember/square'))
+    retired = worker(tmp_path, store, ['new-key'])
+    assert retired.get('/recall', headers={'Cookie': fresh}).get_data(as_text=True) == 'square'
+    assert retired.get('/recall', headers={'Cookie': cookie}).get_data(as_text=True) == ''
+
+
+def test_tampered_cookie_starts_a_new_session(tmp_path, database):
+    client = make_app(tmp_path, 'filesystem', ['key']).test_client()
+    name, value = session_cookie(client.post('/remember/hop')).split('=', 1)
+    forged = worker(tmp_path, 'filesystem', ['other-key'])
+    assert forged.get('/recall', headers={'Cookie': f'{name}={value}'}).get_data(as_text=True) == ''
+    assert forged.get('/recall', headers={'Cookie': f'{name}={value[:-2]}xx'}).get_data(as_text=True) == ''
+
+
+def test_keyring():
+    assert load_keyring({"SECRET_KEYS": ['new', 'old'], "SECRET_KEY": 'single'}) == ['new', 'old']
+    assert load_keyring({"SECRET_KEY": 'single'}) == ['single']
+    assert load_keyring({}) == []
+
+
+def test_missing_key_fails_outside_debug():
+    app = Flask(__name__)
+    with pytest.raises(RuntimeError):
+        Sessions(app)
+    app.debug = True
+    Sessions(app)
+    assert app.secret_key
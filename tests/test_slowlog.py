@@ -0,0 +1,65 @@
+import pytest
+from flask import Flask
+from sqlalchemy import create_engine
+
+from slowlog import SlowQueryLog, fingerprint, plan_fingerprint, sqlite_plan
+from timing import statement_timer
+
+
+@pytest.fixture
+def slow_log():
+    app = Flask(__name__)
+    app.config.update(SLOW_QUERY_ENABLED=True, SLOW_QUERY_MS=0, SLOW_QUERY_MAX_ENTRIES=2)
+    log = SlowQueryLog(app)
+    yield log
+    statement_timer.unsubscribe(log._check)
+
+
+@pytest.fixture
+def engine():
+    engine = create_engine('sqlite://')
+    engine.execute('CREATE TABLE venue (id INTEGER PRIMARY KEY, name TEXT, city TEXT)')
+    engine.execute('CREATE INDEX ix_venue_city ON venue (city)')
+    return engine
+
+
+def test_fingerprint_ignores_values():
+    first, key = fingerprint("SELECT * FROM venue WHERE id = 1 AND name = 'Hop'  AND city IN (?, ?, ?)")
+    assert first == 'SELECT * FROM venue WHERE id = ? AND name = ? AND city IN (?)'
+    assert fingerprint('SELECT * FROM venue WHERE id = %(id)s AND name = :name AND city IN (?)')[1] == key
+
+
+def test_plan_fingerprint_ignores_costs():
+    plan = 'Index Scan using venue_pkey on venue  (cost=0.15..8.17 rows=1 width=4) (actual time=0.01..0.02 rows=1)'
+    assert plan_fingerprint(plan) == plan_fingerprint(plan.replace('8.17', '9.01').replace('0.02', '3.50'))
+    assert plan_fingerprint(plan) != plan_fingerprint(plan.replace('Index Scan', 'Seq Scan'))
+
+
+def test_sqlite_plan_is_indented():
+    assert sqlite_plan([(2, 0, 0, 'SCAN venue'), (5, 2, 0, 'USE TEMP B-TREE')]) == 'SCAN venue\n  USE TEMP B-TREE'
+
+
+def test_slow_statements_are_recorded_with_their_plan(slow_log, engine):
+    for city in ('San Francisco', 'New York'):
+        engine.execute('SELECT id FROM venue WHERE city = ?', (city,)).fetchall()
+    [entry] = [query for query in slow_log.top() if query["normalized"] == 'SELECT id FROM venue WHERE city = ?']
+    assert entry["count"] == 2 and entry["routes"] == {None: 2}
+    # values stay out of the log unless asked for
+    assert entry["statement"] is None and entry["parameters"] is None
+    [plan] = entry["plans"]
+    assert 'ix_venue_city' in plan["plan"] and plan["seen"] == 1
+
+
+def test_least_costly_entries_are_evicted(slow_log):
+    slow_log.record('SELECT * FROM venue', 50.0, None, None)
+    slow_log.record('SELECT * FROM artist', 10.0, None, None)
+    slow_log.record('SELECT * FROM show', 30.0, None, None)
+    assert [(query["normalized"], query["total_ms"]) for query in slow_log.top()] == [
+        ('SELECT * FROM venue', 50.0), ('SELECT * FROM show', 30.0)]
+
+
+def test_fast_statements_are_skipped(slow_log, engine, monkeypatch):
+    monkeypatch.setattr(slow_log, 'threshold_ms', 10000)
+    slow_log.reset()
+    engine.execute('SELECT 1')
+    assert slow_log.top() == []
@@ -0,0 +1,17 @@
+from sqlalchemy import create_engine
+
+from timing import StatementTimer
+
+
+def test_subscribers_share_one_timing():
+    timer = StatementTimer()
+    first, second = [], []
+    timer.subscribe(lambda conn, statement, parameters, executemany, elapsed_ms: first.append((statement, elapsed_ms)))
+    callback = timer.subscribe(lambda *args: second.append(args[-1]))
+    engine = create_engine('sqlite://')
+    engine.execute('SELECT 1')
+    assert [statement for statement, _ in first] == ['SELECT 1']
+    assert second == [first[0][1]] and second[0] >= 0
+    timer.unsubscribe(callback)
+    engine.execute('SELECT 2')
+    assert len(first) == 2 and len(second) == 1
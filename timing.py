@@ -0,0 +1,53 @@
+"""One timer for every database statement in the process.
+
+SQLAlchemy's cursor events are hooked once, whatever needs statement timings:
+the request log, the load shedder and the slow-query log subscribe to
+``statement_timer`` and get the elapsed time of each statement instead of
+each stamping and timing every statement on their own.
+"""
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+class StatementTimer(object):
+    """Times cursor executions on every engine and hands the result to subscribers."""
+
+    def __init__(self):
+        self._subscribers = ()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._installed = False
+
+    def subscribe(self, callback):
+        """Register ``callback(conn, statement, parameters, executemany, elapsed_ms)``, called after each statement
+        in the thread that ran it."""
+        with self._lock:
+            if not self._installed:
+                event.listen(Engine, 'before_cursor_execute', self._before)
+                event.listen(Engine, 'after_cursor_execute', self._after)
+                self._installed = True
+            # replaced rather than appended to, so statements running meanwhile iterate a stable tuple
+            self._subscribers = self._subscribers + (callback,)
+        return callback
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            self._subscribers = tuple(subscriber for subscriber in self._subscribers if subscriber != callback)
+
+    def _before(self, conn, cursor, statement, parameters, context, executemany):
+        self._local.started = time.perf_counter()
+
+    def _after(self, conn, cursor, statement, parameters, context, executemany):
+        started = getattr(self._local, 'started', None)
+        if started is None:
+            return
+        self._local.started = None
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        for callback in self._subscribers:
+            callback(conn, statement, parameters, executemany, elapsed_ms)
+
+
+statement_timer = StatementTimer()